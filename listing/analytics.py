@@ -0,0 +1,377 @@
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from listing.models import Listing, ListingStatBucket, SellerStatBucket, StatBucket
+from server.backends import RedisClaim, shared_backend
+
+# Event kind -> the bucket column it is counted in
+EVENT_FIELDS = {"view": "views", "save": "saves", "chat": "chats"}
+BUCKET_FIELDS = tuple(EVENT_FIELDS.values())
+# Seconds between roll-ups of the event log into bucket rows
+AGGREGATE_INTERVAL = getattr(settings, "ANALYTICS_AGGREGATE_INTERVAL", 60)
+# Events rolled up per pass
+AGGREGATE_BATCH_SIZE = getattr(settings, "ANALYTICS_AGGREGATE_BATCH_SIZE", 10000)
+AGGREGATE_LOCK_TTL = 120
+# Roll-ups a batch may fail before it is moved to the dead-letter list, so
+# one bad batch cannot stall the event log
+AGGREGATE_MAX_ATTEMPTS = getattr(settings, "ANALYTICS_AGGREGATE_MAX_ATTEMPTS", 5)
+# Most dead-lettered events kept for inspection; older ones are dropped
+DEAD_LETTER_SIZE = 10 * AGGREGATE_BATCH_SIZE
+# Seconds between prunes of hourly buckets too old to be read
+PRUNE_INTERVAL = 60 * 60
+# Default and largest ranges a series can be read for
+DEFAULT_RANGE = {StatBucket.HOUR: timedelta(hours=48), StatBucket.DAY: timedelta(days=7)}
+MAX_BUCKETS = {StatBucket.HOUR: 24 * 31, StatBucket.DAY: 366}
+
+EVENTS_KEY = "analytics:events"
+PROCESSING_KEY = "analytics:processing"
+ATTEMPTS_KEY = "analytics:attempts"
+DEAD_LETTER_KEY = "analytics:dead_letter"
+AGGREGATE_LOCK_KEY = "analytics:aggregate_lock"
+
+
+class InvalidAnalyticsParameter(ValueError):
+    pass
+
+
+def bucket_start(at, granularity):
+    at = at.astimezone(dt_timezone.utc)
+    if granularity == StatBucket.DAY:
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_step(granularity):
+    return timedelta(days=1) if granularity == StatBucket.DAY else timedelta(hours=1)
+
+
+# Moves up to ARGV[1] events aside for aggregation. Events left there by a
+# failed roll-up are returned again instead, so none are lost, until they
+# have been taken ARGV[2] times; then they go to the dead-letter list
+# (capped at ARGV[3] events) and a new batch is taken. Returns the number
+# of events dead-lettered and the batch.
+# KEYS: events, processing, attempts, dead letters.
+TAKE = """
+local dropped = 0
+if redis.call('EXISTS', KEYS[2]) == 1 and redis.call('INCR', KEYS[3]) > tonumber(ARGV[2]) then
+    local failed = redis.call('LRANGE', KEYS[2], 0, -1)
+    for i = 1, #failed do
+        redis.call('RPUSH', KEYS[4], failed[i])
+    end
+    redis.call('LTRIM', KEYS[4], -tonumber(ARGV[3]), -1)
+    redis.call('DEL', KEYS[2], KEYS[3])
+    dropped = #failed
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    local events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #events == 0 then
+        return {dropped, {}}
+    end
+    redis.call('LTRIM', KEYS[1], #events, -1)
+    for i = 1, #events do
+        redis.call('RPUSH', KEYS[2], events[i])
+    end
+    redis.call('SET', KEYS[3], 1)
+end
+return {dropped, redis.call('LRANGE', KEYS[2], 0, -1)}
+"""
+
+class RedisEventLog:
+    """
+    Append-only log of analytics events shared by every worker: a Redis
+    list of compact JSON events, drained in batches by the aggregator.
+    Appending is one RPUSH, so recording an event never touches the
+    database.
+    """
+
+    def __init__(self, client, max_attempts=AGGREGATE_MAX_ATTEMPTS):
+        self.client = client
+        self.max_attempts = max_attempts
+        self.take_script = client.register_script(TAKE)
+        self.claim = RedisClaim(client, AGGREGATE_LOCK_KEY, [PROCESSING_KEY, ATTEMPTS_KEY], AGGREGATE_LOCK_TTL)
+
+    def append(self, event):
+        self.client.rpush(EVENTS_KEY, json.dumps(event, separators=(",", ":")))
+
+    def take(self, limit=AGGREGATE_BATCH_SIZE):
+        """Claim up to `limit` events, or None when another worker is aggregating."""
+        if self.claim.acquire() is None:
+            return None
+        dropped, events = self.take_script(
+            keys=[EVENTS_KEY, PROCESSING_KEY, ATTEMPTS_KEY, DEAD_LETTER_KEY],
+            args=[limit, self.max_attempts, DEAD_LETTER_SIZE],
+        )
+        if dropped:
+            print(f"Moved {dropped} analytics events to {DEAD_LETTER_KEY} after {self.max_attempts} failed roll-ups")
+        return [json.loads(event) for event in events]
+
+    def release(self, done):
+        self.claim.release(done)
+
+    def dead_letters(self):
+        return [json.loads(event) for event in self.client.lrange(DEAD_LETTER_KEY, 0, -1)]
+
+
+class LocalEventLog:
+    """The event log of RedisEventLog, kept in this process."""
+
+    def __init__(self, max_attempts=AGGREGATE_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self._events = []
+        self._processing = []
+        self._attempts = 0
+        self._dead_letters = []
+        self._taken = False
+        self._lock = threading.Lock()
+
+    def append(self, event):
+        with self._lock:
+            self._events.append(dict(event))
+
+    def take(self, limit=AGGREGATE_BATCH_SIZE):
+        with self._lock:
+            if self._taken:
+                return None
+            self._taken = True
+            if self._processing:
+                self._attempts += 1
+                if self._attempts > self.max_attempts:
+                    self._dead_letters = (self._dead_letters + self._processing)[-DEAD_LETTER_SIZE:]
+                    self._processing = []
+            if not self._processing:
+                self._processing, self._events = self._events[:limit], self._events[limit:]
+                self._attempts = 1
+            return [dict(event) for event in self._processing]
+
+    def release(self, done):
+        with self._lock:
+            if done:
+                self._processing = []
+            self._taken = False
+
+    def dead_letters(self):
+        with self._lock:
+            return [dict(event) for event in self._dead_letters]
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._processing.clear()
+            self._dead_letters.clear()
+            self._attempts = 0
+            self._taken = False
+
+
+get_event_log = shared_backend(RedisEventLog, LocalEventLog)
+
+
+def record_event(kind, listing_id, at=None):
+    """
+    Append a view, save or chat event for a listing; the seller is looked up
+    when the event is rolled up. Failures are only logged: analytics must
+    never fail the request that produced them.
+    """
+    at = at or timezone.now()
+    try:
+        get_event_log().append({"k": kind, "l": int(listing_id), "t": at.timestamp()})
+        get_aggregator()
+    except Exception as e:
+        print(f"Recording {kind} event for listing {listing_id} failed: {e}")
+
+
+def add_counts(model, owner_field, counts):
+    """
+    Add {(owner id, granularity, start): Counter(field -> n)} to the bucket
+    rows of `model`. Missing rows are inserted empty first, ignoring the
+    ones another aggregator inserted meanwhile, and then every row is
+    locked and added to, so overlapping roll-ups neither fail on the
+    unique constraint nor overwrite each other's counts.
+    """
+    if not counts:
+        return
+    model.objects.bulk_create(
+        [model(**{f"{owner_field}_id": owner}, granularity=granularity, start=start) for owner, granularity, start in counts],
+        ignore_conflicts=True,
+        batch_size=500,
+    )
+    owners = {owner for owner, _, _ in counts}
+    starts = {start for _, _, start in counts}
+    existing = {
+        (getattr(bucket, f"{owner_field}_id"), bucket.granularity, bucket.start): bucket
+        for bucket in model.objects.select_for_update().filter(**{f"{owner_field}_id__in": owners}, start__in=starts)
+    }
+    updated = []
+    for key, fields in counts.items():
+        bucket = existing[key]
+        for field, n in fields.items():
+            setattr(bucket, field, getattr(bucket, field) + n)
+        updated.append(bucket)
+    model.objects.bulk_update(updated, BUCKET_FIELDS, batch_size=500)
+
+
+def prune_buckets(now=None):
+    """
+    Delete hourly buckets more than MAX_BUCKETS hours old; past that, a
+    listing's history is kept in its daily buckets only.
+    """
+    cutoff = bucket_start(now or timezone.now(), StatBucket.HOUR) - MAX_BUCKETS[StatBucket.HOUR] * bucket_step(StatBucket.HOUR)
+    for model in (ListingStatBucket, SellerStatBucket):
+        model.objects.filter(granularity=StatBucket.HOUR, start__lt=cutoff).delete()
+
+
+def parse_event(event):
+    """(bucket field, listing id, time) of a logged event, or None when it is malformed."""
+    try:
+        field = EVENT_FIELDS.get(event["k"])
+        return field, int(event["l"]), datetime.fromtimestamp(event["t"], tz=dt_timezone.utc)
+    except (KeyError, TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def roll_up(events):
+    """
+    Count events into the hourly and daily listing and seller buckets.
+    Malformed events are skipped rather than failing the whole batch.
+    """
+    parsed = [event for event in map(parse_event, events) if event is not None and event[0] is not None]
+    listing_ids = {listing_id for _, listing_id, _ in parsed}
+    # Events of since-deleted listings (and their sellers) are dropped
+    live = dict(Listing.objects.filter(id__in=listing_ids).values_list("id", "user_id"))
+    listing_counts, seller_counts = {}, {}
+    for field, listing_id, at in parsed:
+        if listing_id not in live:
+            continue
+        for granularity in (StatBucket.HOUR, StatBucket.DAY):
+            start = bucket_start(at, granularity)
+            listing_counts.setdefault((listing_id, granularity, start), Counter())[field] += 1
+            seller_counts.setdefault((live[listing_id], granularity, start), Counter())[field] += 1
+    with transaction.atomic():
+        add_counts(ListingStatBucket, "listing", listing_counts)
+        add_counts(SellerStatBucket, "seller", seller_counts)
+
+
+def aggregate_events(log=None, limit=AGGREGATE_BATCH_SIZE):
+    """Roll up one batch of the event log. Returns the number of events handled."""
+    log = log or get_event_log()
+    events = log.take(limit)
+    if events is None:
+        return 0
+    done = False
+    try:
+        if events:
+            roll_up(events)
+        done = True
+    finally:
+        log.release(done)
+    return len(events)
+
+
+class AnalyticsAggregator:
+    """Background thread rolling up the event log every `interval` seconds."""
+
+    def __init__(self, interval=AGGREGATE_INTERVAL):
+        self.interval = interval
+        self.pruned_at = 0
+        self.thread = threading.Thread(target=self.run, name="analytics-aggregator", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                while aggregate_events() == AGGREGATE_BATCH_SIZE:
+                    pass
+                if time.monotonic() - self.pruned_at >= PRUNE_INTERVAL:
+                    prune_buckets()
+                    self.pruned_at = time.monotonic()
+            except Exception as e:
+                print(f"Aggregating analytics events failed: {e}")
+            finally:
+                close_old_connections()
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator():
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = AnalyticsAggregator()
+    return _aggregator
+
+
+def parse_range(granularity=None, since=None, until=None):
+    """Validate series query parameters into (granularity, first start, end)."""
+    granularity = granularity or StatBucket.DAY
+    if granularity not in MAX_BUCKETS:
+        raise InvalidAnalyticsParameter("granularity must be 'hour' or 'day'.")
+    try:
+        until = parse_datetime(until) if until else timezone.now()
+        if since:
+            since = parse_datetime(since)
+        elif until:
+            # The default range ends with the bucket that `until` falls in
+            since = bucket_start(until, granularity) - DEFAULT_RANGE[granularity] + bucket_step(granularity)
+    except ValueError:
+        since = until = None
+    if since is None or until is None:
+        raise InvalidAnalyticsParameter("since and until must be ISO 8601 datetimes.")
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, dt_timezone.utc)
+    if timezone.is_naive(until):
+        until = timezone.make_aware(until, dt_timezone.utc)
+    since = bucket_start(since, granularity)
+    if until <= since:
+        raise InvalidAnalyticsParameter("until must be after since.")
+    if (until - since) / bucket_step(granularity) > MAX_BUCKETS[granularity]:
+        raise InvalidAnalyticsParameter(f"At most {MAX_BUCKETS[granularity]} {granularity} buckets can be read at once.")
+    return granularity, since, until
+
+
+def series(buckets, granularity, since, until):
+    """
+    One entry per bucket from `since` to `until`, zero-filled, plus totals.
+    `buckets` is the ordered bucket rows in range, so this is O(buckets).
+    """
+    rows = {row["start"]: row for row in buckets.filter(
+        granularity=granularity, start__gte=since, start__lt=until
+    ).order_by("start").values("start", *BUCKET_FIELDS)}
+    points = []
+    totals = Counter({field: 0 for field in BUCKET_FIELDS})
+    start = since
+    step = bucket_step(granularity)
+    while start < until:
+        row = rows.get(start)
+        point = {"start": start.isoformat(), **{field: row[field] if row else 0 for field in BUCKET_FIELDS}}
+        totals.update({field: point[field] for field in BUCKET_FIELDS})
+        points.append(point)
+        start += step
+    return {"granularity": granularity, "buckets": points, "totals": dict(totals)}
+
+
+def listing_series(listing_id, granularity, since, until):
+    return series(ListingStatBucket.objects.filter(listing_id=listing_id), granularity, since, until)
+
+
+def seller_series(uid, granularity, since, until):
+    return series(SellerStatBucket.objects.filter(seller_id=uid), granularity, since, until)
+
+
+def seller_views(uid, days=7):
+    """Views of all a seller's listings over the last `days` daily buckets, today included."""
+    since = bucket_start(timezone.now(), StatBucket.DAY) - timedelta(days=days - 1)
+    rows = SellerStatBucket.objects.filter(
+        seller_id=uid, granularity=StatBucket.DAY, start__gte=since
+    ).values_list("views", flat=True)
+    return sum(rows)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ListingConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'listing'
+
+    def ready(self):
+        import listing.signals  # noqa: F401
@@ -0,0 +1,62 @@
+from django.db.models import Count, F, IntegerField, JSONField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from listing.models import Listing, ListingMedia
+from server.media import VIDEO_EXTENSIONS, media_url, variant_name
+
+CARD_FIELDS = ("id", "title", "price", "thumbnail", "displayName", "saves")
+
+
+def wants_cards(request):
+    """
+    List endpoints return compact cards when the client asks for them with
+    `view=card` (query string, or request body for POST endpoints).
+    """
+    view = request.query_params.get("view")
+    if view is None and hasattr(request.data, "get"):
+        view = request.data.get("view")
+    return view == "card"
+
+
+def listing_cards(listings, *extra_fields):
+    """
+    Project a Listing queryset straight to card dicts with values(), so no
+    model instances, media rows or saved_by lists are loaded. The queryset's
+    ordering and slicing are kept. `extra_fields` are selected as well (e.g.
+    the sort key needed to build a pagination cursor).
+
+    The thumbnail comes from the first media item that can be shown in an
+    image tag: an image, or a video once its poster frame was generated.
+    Listings with neither get None.
+    """
+    video = Q(file__iregex=r"\.({})$".format("|".join(VIDEO_EXTENSIONS)))
+    first_media = ListingMedia.objects.filter(
+        Q(variants__has_key="thumb") | ~video, listing=OuterRef("pk")
+    ).order_by("id")
+    save_count = (
+        Listing.saved_by.through.objects.filter(listing_id=OuterRef("pk"))
+        .values("listing_id")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    rows = listings.values(
+        "id", "title", "price", *extra_fields,
+        displayName=F("user__displayName"),
+        thumbnail=Subquery(first_media.values("file")[:1]),
+        thumbnailVariants=Subquery(first_media.values("variants")[:1], output_field=JSONField()),
+        saves=Coalesce(Subquery(save_count, output_field=IntegerField()), Value(0)),
+    )
+
+    storage = ListingMedia._meta.get_field("file").storage
+    cards = list(rows)
+    for card in cards:
+        # The small variant (a poster frame for videos) once processed
+        variants = card.pop("thumbnailVariants")
+        thumbnail = variant_name(variants, "thumb") or card["thumbnail"]
+        if thumbnail:
+            card["thumbnail"] = media_url(storage, thumbnail)
+    return cards
+
+
+def strip_extra_fields(cards):
+    return [{field: card[field] for field in CARD_FIELDS} for card in cards]
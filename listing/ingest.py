@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from listing.models import ListingMedia
+from listing.uploads import new_media_key
+from user.storage_cleanup import enqueue_deletions
+
+MEDIA_UPLOAD_WORKERS = getattr(settings, "MEDIA_UPLOAD_WORKERS", 4)
+MEDIA_UPLOAD_MAX_RETRIES = getattr(settings, "MEDIA_UPLOAD_MAX_RETRIES", 3)
+# Seconds before the first retry, doubled after each failed attempt
+MEDIA_UPLOAD_RETRY_BACKOFF = getattr(settings, "MEDIA_UPLOAD_RETRY_BACKOFF", 0.2)
+
+
+class MediaUploadError(Exception):
+    pass
+
+
+def upload_with_retries(storage, name, f, max_retries=MEDIA_UPLOAD_MAX_RETRIES):
+    delay = MEDIA_UPLOAD_RETRY_BACKOFF
+    for attempt in range(1, max_retries + 1):
+        try:
+            f.seek(0)
+            return storage.save(name, f)
+        except Exception as e:
+            print(f"Uploading {name} failed (attempt {attempt}/{max_retries}): {e}")
+            if attempt == max_retries:
+                raise MediaUploadError(f"Uploading {f.name} failed: {e}") from e
+            time.sleep(delay)
+            delay *= 2
+
+
+def discard_uploads(storage, keys):
+    """
+    Remove uploaded objects that no row will reference. Deletes that fail
+    are left to the storage deletion outbox.
+    """
+    leftover = []
+    for key in keys:
+        try:
+            storage.delete(key)
+        except Exception as e:
+            print(f"Removing uploaded {key} failed: {e}")
+            leftover.append(key)
+    if leftover:
+        try:
+            with transaction.atomic():
+                enqueue_deletions(leftover)
+        except Exception as e:
+            print(f"Queueing {len(leftover)} uploads for deletion failed, the reconciler will find them: {e}")
+
+
+def upload_listing_media(listing, files, workers=MEDIA_UPLOAD_WORKERS):
+    """
+    Upload a new listing's files to storage concurrently, before any
+    ListingMedia row is written, and return their keys in the order given.
+    Keys come from new_media_key, like presigned uploads. If any upload
+    still fails after its retries, the ones that succeeded are discarded
+    again and MediaUploadError is raised, so no partial media is left behind.
+    """
+    if not files:
+        return []
+    storage = ListingMedia._meta.get_field("file").storage
+    names = [new_media_key(listing, f.name) for f in files]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(files)), thread_name_prefix="media-upload") as pool:
+        futures = [pool.submit(upload_with_retries, storage, name, f) for name, f in zip(names, files)]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        discard_uploads(storage, [future.result() for future in futures if future.exception() is None])
+        raise errors[0]
+    return [future.result() for future in futures]
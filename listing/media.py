@@ -0,0 +1,36 @@
+from django.db import close_old_connections, transaction
+
+from listing.models import ListingMedia
+from server.media import get_media_processor, process_media
+
+
+def media_storage():
+    return ListingMedia._meta.get_field("file").storage
+
+
+def process_listing_media(media_id):
+    """Generate and record the variants of one ListingMedia file."""
+    close_old_connections()
+    try:
+        name = ListingMedia.objects.filter(id=media_id).values_list("file", flat=True).first()
+        if not name:
+            return
+        variants = process_media(media_storage(), name)
+        # Skip the update if the row was deleted or its file replaced meanwhile
+        ListingMedia.objects.filter(id=media_id, file=name).update(variants=variants)
+    except Exception as e:
+        print(f"Processing listing media {media_id} failed: {e}")
+    finally:
+        close_old_connections()
+
+
+def schedule_media_processing(media_ids):
+    """Queue processing for the given rows once the current transaction commits."""
+    media_ids = list(media_ids)
+
+    def submit():
+        for media_id in media_ids:
+            get_media_processor().submit(process_listing_media, media_id)
+
+    transaction.on_commit(submit)
+
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of the tokenizer in listing.search_index as of this migration,
+# so later changes to the live code do not alter what this migration builds.
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in",
+    "is", "it", "of", "on", "or", "the", "to", "with",
+])
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:64] for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def term_weights(title, description):
+    weights = {}
+    for token in tokenize(title):
+        weights[token] = weights.get(token, 0) + 3
+    for token in tokenize(description):
+        weights[token] = weights.get(token, 0) + 1
+    return weights
+
+
+def build_search_index(apps, schema_editor):
+    Listing = apps.get_model('listing', 'Listing')
+    ListingSearchTerm = apps.get_model('listing', 'ListingSearchTerm')
+    for listing in Listing.objects.only('id', 'title', 'description').iterator():
+        ListingSearchTerm.objects.bulk_create([
+            ListingSearchTerm(listing_id=listing.id, term=term, weight=weight)
+            for term, weight in term_weights(listing.title, listing.description).items()
+        ])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0006_rename_saves_listing_saved_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.IntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='listing.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'listing'], name='listing_search_term_idx')],
+                'unique_together': {('listing', 'term')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
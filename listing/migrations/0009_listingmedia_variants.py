@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0008_listing_filter_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingmedia',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listing', '0009_listingmedia_variants'),
+        ('user', '0013_storagedeletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingStatBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('saves', models.IntegerField(default=0)),
+                ('chats', models.IntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stat_buckets', to='listing.listing')),
+            ],
+            options={
+                'unique_together': {('listing', 'granularity', 'start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SellerStatBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('saves', models.IntegerField(default=0)),
+                ('chats', models.IntegerField(default=0)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stat_buckets', to='user.user')),
+            ],
+            options={
+                'unique_together': {('seller', 'granularity', 'start')},
+            },
+        ),
+    ]
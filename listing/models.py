@@ -22,6 +22,21 @@ class Listing(models.Model):
     sold = models.BooleanField(default=False)
     views = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Keyset order for each browse sort key. `hidden` is left out on
+            # purpose: almost every row is visible, so walking the ordered
+            # index and skipping hidden rows beats a low-selectivity prefix.
+            models.Index(fields=['dateListed', 'id'], name='listing_date_idx'),
+            models.Index(fields=['price', 'id'], name='listing_price_idx'),
+            models.Index(fields=['views', 'id'], name='listing_views_idx'),
+            # Category/location filters and recommendations, newest first
+            models.Index(fields=['category', 'dateListed'], name='listing_category_date_idx'),
+            models.Index(fields=['location', 'dateListed'], name='listing_location_date_idx'),
+            # Admin active/sold/hidden counts
+            models.Index(fields=['sold', 'hidden'], name='listing_status_idx'),
+        ]
+
 class ListingMedia(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='media')
     file = models.FileField(
@@ -29,3 +44,61 @@ class ListingMedia(models.Model):
         storage=S3Boto3Storage(),
         validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'mp4', 'mov'])]
     )
+    # Resized/re-encoded copies written by the media processor, see server.media
+    variants = models.JSONField(default=dict, blank=True)
+
+class ListingSearchTerm(models.Model):
+    """
+    Inverted index row: one normalized token that appears in a listing's
+    title or description, weighted by where and how often it appears.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('listing', 'term')
+        indexes = [
+            models.Index(fields=['term', 'listing'], name='listing_search_term_idx'),
+        ]
+
+class StatBucket(models.Model):
+    """
+    Event counts for one hour or one day (starting at `start`, UTC), rolled
+    up from the analytics event log by listing.analytics.
+    """
+    HOUR = "hour"
+    DAY = "day"
+    GRANULARITIES = [(HOUR, "Hour"), (DAY, "Day")]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITIES)
+    start = models.DateTimeField()
+    views = models.IntegerField(default=0)
+    saves = models.IntegerField(default=0)
+    chats = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class ListingStatBucket(StatBucket):
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='stat_buckets')
+
+    class Meta:
+        # Also the index for reading a listing's series in time order
+        unique_together = ('listing', 'granularity', 'start')
+
+class SellerStatBucket(StatBucket):
+    """The same counts summed over all of a seller's listings."""
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stat_buckets')
+
+    class Meta:
+        unique_together = ('seller', 'granularity', 'start')
+
+class ViewFlush(models.Model):
+    """
+    A batch of buffered view counts already added to Listing.views. Written
+    in the same transaction as the counts, so a batch that is claimed again
+    after its release failed is not added twice. See listing.view_counter.
+    """
+    batch = models.CharField(max_length=32, unique=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
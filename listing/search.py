@@ -0,0 +1,159 @@
+import base64
+import json
+from datetime import timedelta
+
+import django
+from django.db.models import Prefetch, Q
+from django.utils.dateparse import parse_datetime
+
+from listing.cards import CARD_FIELDS, listing_cards, strip_extra_fields
+from listing.models import Listing, ListingMedia
+from listing.search_index import search_listings
+from user.models import User
+
+SORT_KEYS = ("dateListed", "price", "views", "relevance")
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class InvalidSearchParameter(ValueError):
+    pass
+
+
+def with_serializer_relations(listings):
+    """
+    Attach everything ListingSerializer reads so a page of listings is
+    serialized with a fixed number of queries instead of several per row.
+    """
+    return listings.select_related("user").prefetch_related(
+        Prefetch("media", queryset=ListingMedia.objects.order_by("id")),
+        Prefetch("saved_by", queryset=User.objects.only("uid")),
+    )
+
+
+def filter_listings(listings, category=None, location=None, date_range=None, price_range=None, keyword=None):
+    """
+    Apply the browse filters sent by the client to a Listing queryset.
+    """
+    if category:
+        listings = listings.filter(category__iexact=category)
+
+    if location:
+        listings = listings.filter(location__iexact=location)
+
+    if date_range:
+        if date_range == "week":
+            listings = listings.filter(dateListed__gte=django.utils.timezone.now() - timedelta(days=7))
+        elif date_range == "month":
+            listings = listings.filter(dateListed__gte=django.utils.timezone.now() - timedelta(days=30))
+
+    if price_range:
+        try:
+            min_price, max_price = map(float, price_range.split("-"))
+        except ValueError:
+            raise InvalidSearchParameter("Invalid price range format. Use 'min-max' format.")
+        listings = listings.filter(price__gte=min_price, price__lte=max_price)
+
+    if keyword:
+        listings = search_listings(listings, keyword)
+
+    return listings
+
+
+def legacy_sort_keys():
+    """Fields the unpaginated listing endpoint has always been sortable by."""
+    return {field.name for field in Listing._meta.concrete_fields} | {"relevance"}
+
+
+def order_listings(listings, sort, direction, strict=True):
+    """
+    Order by the sort key with the primary key as a tie-breaker so the
+    ordering is total and can be resumed from a cursor. Only SORT_KEYS can
+    be resumed from a cursor; without `strict`, any listing field is
+    accepted, as the unpaginated endpoint always did.
+    """
+    if sort not in (SORT_KEYS if strict else legacy_sort_keys()):
+        raise InvalidSearchParameter(f"Invalid sort key. Use one of: {', '.join(SORT_KEYS)}.")
+    if sort == "relevance" and "relevance" not in listings.query.annotations:
+        raise InvalidSearchParameter("Sorting by relevance requires a keyword.")
+    if direction == "desc":
+        return listings.order_by(f"-{sort}", "-id")
+    return listings.order_by(sort, "id")
+
+
+def encode_cursor(listing, sort):
+    if isinstance(listing, dict):
+        value, last_id = listing[sort], listing["id"]
+    else:
+        value, last_id = getattr(listing, sort), listing.id
+    if sort == "dateListed":
+        value = value.isoformat()
+    payload = json.dumps({"v": value, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value, last_id = payload["v"], int(payload["id"])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidSearchParameter("Invalid cursor.")
+
+    if sort == "dateListed":
+        value = parse_datetime(value) if isinstance(value, str) else None
+        if value is None:
+            raise InvalidSearchParameter("Invalid cursor.")
+    elif not isinstance(value, (int, float)):
+        raise InvalidSearchParameter("Invalid cursor.")
+    return value, last_id
+
+
+def seek_after(listings, sort, direction, cursor):
+    """
+    Keyset pagination: keep only rows strictly after the cursor position in
+    (sort, id) order. This stays an index range scan no matter how deep the
+    client pages, unlike OFFSET.
+    """
+    value, last_id = decode_cursor(cursor, sort)
+    if direction == "desc":
+        return listings.filter(Q(**{f"{sort}__lt": value}) | Q(**{sort: value, "id__lt": last_id}))
+    return listings.filter(Q(**{f"{sort}__gt": value}) | Q(**{sort: value, "id__gt": last_id}))
+
+
+def parse_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidSearchParameter("Invalid limit.")
+    if limit < 1:
+        raise InvalidSearchParameter("Invalid limit.")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def paginate_listings(listings, sort, direction, cursor=None, limit=None, cards=False):
+    """
+    Return one page of an already filtered queryset and the cursor for the
+    next page (None when the last page has been reached). With `cards`, the
+    page is a list of card dicts instead of Listing instances.
+    """
+    limit = parse_limit(limit)
+    listings = order_listings(listings, sort, direction)
+    if cursor:
+        listings = seek_after(listings, sort, direction, cursor)
+
+    # Fetch one extra row to know whether another page exists.
+    listings = listings[:limit + 1]
+    if cards:
+        page = listing_cards(listings, *(() if sort in CARD_FIELDS else (sort,)))
+    else:
+        page = list(with_serializer_relations(listings))
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1], sort)
+    if cards:
+        page = strip_extra_fields(page)
+    return page, next_cursor
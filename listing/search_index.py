@@ -0,0 +1,106 @@
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value, When
+
+from listing.models import ListingSearchTerm
+
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in",
+    "is", "it", "of", "on", "or", "the", "to", "with",
+])
+
+
+def tokenize(text):
+    """
+    Lowercase the text and split it into alphanumeric tokens, dropping stop
+    words. Order and duplicates are preserved so callers can count hits.
+    """
+    if not text:
+        return []
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in _TOKEN_RE.findall(text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+def term_weights(title, description):
+    weights = {}
+    for token in tokenize(title):
+        weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+    for token in tokenize(description):
+        weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+    return weights
+
+
+def index_listing(listing):
+    """
+    Replace the indexed terms of a listing with the terms of its current
+    title and description.
+    """
+    weights = term_weights(listing.title, listing.description)
+    with transaction.atomic():
+        ListingSearchTerm.objects.filter(listing_id=listing.id).delete()
+        ListingSearchTerm.objects.bulk_create([
+            ListingSearchTerm(listing_id=listing.id, term=term, weight=weight)
+            for term, weight in weights.items()
+        ])
+
+
+def query_terms(keyword):
+    terms = []
+    for token in tokenize(keyword):
+        if token not in terms:
+            terms.append(token)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def matching_terms(keyword):
+    """
+    Per-listing relevance for a keyword query, or None if the keyword has no
+    searchable tokens. Every query token must prefix-match at least one
+    indexed term of the listing; relevance is the summed weight of the
+    matched terms.
+    """
+    terms = query_terms(keyword)
+    if not terms:
+        return None
+
+    matches = [Q(term__istartswith=term) for term in terms]
+    required = {
+        f"match_{i}": Max(Case(When(match, then=Value(1)), default=Value(0), output_field=IntegerField()))
+        for i, match in enumerate(matches)
+    }
+    return (
+        ListingSearchTerm.objects.filter(reduce(or_, matches))
+        .values("listing_id")
+        .annotate(relevance=Sum("weight"), **required)
+        .filter(**{name: 1 for name in required})
+    )
+
+
+def search_listings(listings, keyword):
+    """
+    Restrict a Listing queryset to keyword matches and annotate each row with
+    its `relevance` score. A keyword the index cannot search (only stop
+    words, punctuation or non-ASCII text) falls back to a substring match
+    on the title and description with no relevance ranking.
+    """
+    matches = matching_terms(keyword)
+    if matches is None:
+        return listings.filter(Q(title__icontains=keyword) | Q(description__icontains=keyword)).annotate(
+            relevance=Value(0, output_field=IntegerField())
+        )
+    relevance = matches.filter(listing_id=OuterRef("pk")).values("relevance")[:1]
+    return listings.filter(id__in=matches.values("listing_id")).annotate(
+        relevance=Subquery(relevance, output_field=IntegerField())
+    )
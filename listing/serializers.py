@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from listing.models import Listing, ListingMedia
+from server.media import is_video, media_url, variant_name
 from user.models import User
 
 class CreateListingSerializer(serializers.Serializer):
@@ -50,10 +51,41 @@ class ListingSerializer(serializers.ModelSerializer):
 
     def get_profilePicture(self, obj):
         profile_pic = getattr(obj.user, 'profilePicture', None)
-        if profile_pic and hasattr(profile_pic, 'url'):
-            return profile_pic.url
+        if profile_pic:
+            # Shown as a small avatar next to the listing
+            variant = variant_name(obj.user.profilePictureVariants, "thumb")
+            return media_url(profile_pic.storage, variant or profile_pic.name)
         return None
 
     def get_media(self, obj):
-        return [media.file.url for media in obj.media.all()]
+        """
+        Image URLs point at the resized variant (`mediaSize` in the
+        serializer context, "medium" by default) once it exists; videos are
+        always served as uploaded.
+        """
+        size = self.context.get("mediaSize", "medium")
+        urls = []
+        for media in obj.media.all():
+            variant = None if is_video(media.file.name) else variant_name(media.variants, size)
+            urls.append(media_url(media.file.storage, variant or media.file.name))
+        return urls
 
+
+class MediaUploadRequestSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=200)
+    size = serializers.IntegerField(min_value=1)
+
+class RequestMediaUploadsSerializer(serializers.Serializer):
+    files = MediaUploadRequestSerializer(many=True, allow_empty=False)
+
+class UploadedPartSerializer(serializers.Serializer):
+    partNumber = serializers.IntegerField(min_value=1, max_value=10000)
+    etag = serializers.CharField()
+
+class FinalizedUploadSerializer(serializers.Serializer):
+    key = serializers.CharField()
+    uploadId = serializers.CharField(required=False)
+    parts = UploadedPartSerializer(many=True, required=False)
+
+class FinalizeMediaUploadsSerializer(serializers.Serializer):
+    uploads = FinalizedUploadSerializer(many=True, allow_empty=False)
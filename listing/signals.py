@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from listing.media import schedule_media_processing
+from listing.models import Listing, ListingMedia
+from listing.search_index import index_listing
+
+
+@receiver(post_save, sender=Listing)
+def reindex_listing(sender, instance, update_fields=None, **kwargs):
+    """
+    Keep the keyword index in sync with the listing text. Deleting a listing
+    cascades to its terms, so only saves need handling.
+    """
+    if update_fields is not None and not {"title", "description"} & set(update_fields):
+        return
+    index_listing(instance)
+
+
+@receiver(post_save, sender=ListingMedia)
+def process_new_media(sender, instance, created=False, **kwargs):
+    """
+    Resize and re-encode new uploads in the background. Rows added with
+    bulk_create send no signal; their views schedule processing directly.
+    """
+    if created:
+        schedule_media_processing([instance.id])
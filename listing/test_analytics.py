@@ -0,0 +1,218 @@
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.test import SimpleTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from unittest.mock import patch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from listing.analytics import (
+    LocalEventLog, RedisEventLog, add_counts, aggregate_events, bucket_start, get_event_log, listing_series,
+    prune_buckets, record_event
+)
+from listing.models import Listing, ListingStatBucket, SellerStatBucket
+from listing.view_counter import get_view_counter
+from message.models import Room
+from user.models import User
+
+# Dummy token verifier for testing purposes.
+def dummy_verify_id_token(token):
+    return {
+        "uid": "dummy_uid",
+        "email_verified": True
+    }
+
+
+class EventLogBackendTests:
+    """Behaviour shared by both event log backends."""
+
+    def make_log(self, **kwargs):
+        raise NotImplementedError
+
+    def test_events_are_taken_in_batches(self):
+        log = self.make_log()
+        for i in range(5):
+            log.append({"k": "view", "l": i, "t": 0})
+        self.assertEqual([event["l"] for event in log.take(limit=3)], [0, 1, 2])
+        self.assertIsNone(log.take())
+        log.release(done=True)
+        self.assertEqual([event["l"] for event in log.take(limit=3)], [3, 4])
+
+    def test_events_of_a_failed_roll_up_are_taken_again(self):
+        log = self.make_log()
+        log.append({"k": "view", "l": 1, "t": 0})
+        self.assertEqual(len(log.take()), 1)
+        log.release(done=False)
+        log.append({"k": "save", "l": 2, "t": 0})
+        self.assertEqual([event["l"] for event in log.take()], [1])
+        log.release(done=True)
+        self.assertEqual([event["l"] for event in log.take()], [2])
+
+    def test_batch_that_keeps_failing_is_dead_lettered(self):
+        log = self.make_log(max_attempts=2)
+        log.append({"k": "view", "l": 1, "t": 0})
+        log.append({"k": "view", "l": 2, "t": 0})
+        for _ in range(2):
+            self.assertEqual([event["l"] for event in log.take(limit=1)], [1])
+            log.release(done=False)
+        self.assertEqual([event["l"] for event in log.take(limit=1)], [2])
+        self.assertEqual(log.dead_letters(), [{"k": "view", "l": 1, "t": 0}])
+        # The next batch gets its own attempts
+        log.release(done=False)
+        self.assertEqual([event["l"] for event in log.take(limit=1)], [2])
+        log.release(done=True)
+        self.assertEqual(log.take(), [])
+
+
+class LocalEventLogTests(EventLogBackendTests, SimpleTestCase):
+    def make_log(self, **kwargs):
+        return LocalEventLog(**kwargs)
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is required for the Redis event log tests")
+class RedisEventLogTests(EventLogBackendTests, SimpleTestCase):
+    def make_log(self, **kwargs):
+        return RedisEventLog(fakeredis.FakeRedis(), **kwargs)
+
+
+@patch("listing.analytics.get_aggregator")
+@patch("listing.views.get_view_flusher")
+class ListingAnalyticsTests(APITestCase):
+    def setUp(self):
+        get_event_log().clear()
+        get_view_counter().clear()
+        self.client = APIClient()
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            purdueEmail="fake@purdue.edu",
+            purdueEmailVerified=True
+        )
+        self.buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        self.listing = Listing.objects.create(
+            title="Desk", description="A desk", price=10.0, original_price=10.0, category="Test", user=self.user
+        )
+        self.other = Listing.objects.create(
+            title="Lamp", description="A lamp", price=5.0, original_price=5.0, category="Test", user=self.user
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer dummy_token")
+
+    def tearDown(self):
+        get_event_log().clear()
+        get_view_counter().clear()
+
+    def test_events_are_rolled_up_into_hour_and_day_buckets(self, mock_flusher, mock_aggregator):
+        day = datetime(2026, 10, 5, tzinfo=dt_timezone.utc)
+        record_event("view", self.listing.id, at=day + timedelta(hours=9, minutes=5))
+        record_event("view", self.listing.id, at=day + timedelta(hours=9, minutes=50))
+        record_event("save", self.listing.id, at=day + timedelta(hours=14))
+        record_event("chat", self.other.id, at=day + timedelta(hours=14))
+        self.assertEqual(aggregate_events(), 4)
+
+        # A later batch adds to the existing rows
+        record_event("view", self.listing.id, at=day + timedelta(hours=9, minutes=59))
+        self.assertEqual(aggregate_events(), 1)
+
+        hourly = ListingStatBucket.objects.filter(listing=self.listing, granularity="hour").order_by("start")
+        self.assertEqual(
+            [(b.start.hour, b.views, b.saves, b.chats) for b in hourly],
+            [(9, 3, 0, 0), (14, 0, 1, 0)]
+        )
+        daily = SellerStatBucket.objects.get(seller=self.user, granularity="day")
+        self.assertEqual((daily.start, daily.views, daily.saves, daily.chats), (day, 3, 1, 1))
+
+    def test_malformed_events_are_skipped(self, mock_flusher, mock_aggregator):
+        at = datetime(2026, 10, 5, 9, tzinfo=dt_timezone.utc).timestamp()
+        log = get_event_log()
+        for event in ({"k": "view", "l": self.listing.id, "t": at}, {"k": "view", "l": "desk", "t": at},
+                      {"k": "view", "l": self.listing.id}, {"k": "view", "l": self.listing.id, "t": 1e20}, {"l": self.listing.id, "t": at}):
+            log.append(event)
+        self.assertEqual(aggregate_events(), 5)
+        self.assertEqual(ListingStatBucket.objects.get(listing=self.listing, granularity="hour").views, 1)
+
+    def test_bucket_created_by_an_overlapping_roll_up_is_added_to(self, mock_flusher, mock_aggregator):
+        start = datetime(2026, 10, 5, 9, tzinfo=dt_timezone.utc)
+        bulk_create = ListingStatBucket.objects.bulk_create
+
+        def concurrent_bulk_create(objs, **kwargs):
+            # Another roll-up inserts the same bucket first
+            ListingStatBucket.objects.create(listing=self.listing, granularity="hour", start=start, views=3)
+            return bulk_create(objs, **kwargs)
+
+        with patch.object(ListingStatBucket.objects, "bulk_create", side_effect=concurrent_bulk_create):
+            add_counts(ListingStatBucket, "listing", {(self.listing.id, "hour", start): Counter(views=2)})
+        self.assertEqual(ListingStatBucket.objects.get(listing=self.listing).views, 5)
+
+    def test_old_hourly_buckets_are_pruned(self, mock_flusher, mock_aggregator):
+        now = datetime(2026, 10, 5, 9, 30, tzinfo=dt_timezone.utc)
+        hour = timedelta(hours=1)
+        for start in (now - 800 * hour, now - 10 * hour):
+            record_event("view", self.listing.id, at=start)
+        aggregate_events()
+
+        prune_buckets(now)
+        self.assertEqual(
+            list(ListingStatBucket.objects.filter(granularity="hour").values_list("start", flat=True)),
+            [bucket_start(now - 10 * hour, "hour")]
+        )
+        self.assertEqual(SellerStatBucket.objects.filter(granularity="hour").count(), 1)
+        self.assertEqual(ListingStatBucket.objects.filter(granularity="day").count(), 2)
+
+    def test_series_is_read_per_bucket_and_zero_filled(self, mock_flusher, mock_aggregator):
+        day = datetime(2026, 10, 5, tzinfo=dt_timezone.utc)
+        record_event("view", self.listing.id, at=day + timedelta(days=1, hours=3))
+        aggregate_events()
+
+        with self.assertNumQueries(1):
+            series = listing_series(self.listing.id, "day", day, day + timedelta(days=3))
+        self.assertEqual([point["views"] for point in series["buckets"]], [0, 1, 0])
+        self.assertEqual(series["buckets"][1]["start"], (day + timedelta(days=1)).isoformat())
+        self.assertEqual(series["totals"], {"views": 1, "saves": 0, "chats": 0})
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_endpoints_record_events_for_the_seller(self, mock_verify, mock_flusher, mock_aggregator):
+        self.client.post(reverse("increment_listing_view", args=[self.listing.id]))
+        self.client.post(reverse("increment_listing_view", args=[self.other.id]))
+        self.client.post(reverse("save-listing", args=[self.listing.id]))
+        # Saving twice is one save
+        self.client.post(reverse("save-listing", args=[self.listing.id]))
+        # Only a newly created room starts a chat
+        self.client.post(reverse("get_or_create_room"), {"lid": self.other.id, "uid": "buyer_uid"}, format="json")
+        self.client.post(reverse("get_or_create_room"), {"lid": self.other.id, "uid": "buyer_uid"}, format="json")
+        self.assertEqual(Room.objects.count(), 1)
+        aggregate_events()
+
+        response = self.client.get(reverse("get_listing_analytics", args=[self.listing.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data["granularity"], "day")
+        self.assertEqual(len(data["buckets"]), 7)
+        self.assertEqual(data["totals"], {"views": 1, "saves": 1, "chats": 0})
+
+        response = self.client.get(reverse("get_seller_analytics"), {"granularity": "hour"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["totals"], {"views": 2, "saves": 1, "chats": 1})
+
+        response = self.client.get(reverse("get_user_by_uid", args=[self.user.uid]))
+        self.assertEqual(response.json()["viewsThisWeek"], 2)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_analytics_parameters_are_validated(self, mock_verify, mock_flusher, mock_aggregator):
+        url = reverse("get_listing_analytics", args=[self.listing.id])
+        self.assertEqual(self.client.get(url, {"granularity": "minute"}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {"since": "yesterday"}).status_code, status.HTTP_400_BAD_REQUEST)
+        since = (timezone.now() - timedelta(days=400)).isoformat()
+        self.assertEqual(self.client.get(url, {"since": since}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        buyer_listing = Listing.objects.create(
+            title="Chair", description="A chair", price=5.0, original_price=5.0, category="Test", user=self.buyer
+        )
+        response = self.client.get(reverse("get_listing_analytics", args=[buyer_listing.id]))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
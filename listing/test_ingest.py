@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import threading
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from listing.models import Listing, ListingMedia
+from user.models import StorageDeletion, User
+from unittest.mock import patch
+
+# Dummy token verifier for testing purposes.
+def dummy_verify_id_token(token):
+    return {
+        "uid": "dummy_uid",
+        "email_verified": True
+    }
+
+class FlakyStorage(FileSystemStorage):
+    """Fails the first `failures` saves of each file named in `flaky`."""
+
+    def __init__(self, *args, flaky=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flaky = dict(flaky or {})
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def _save(self, name, content):
+        with self.lock:
+            self.threads.add(threading.current_thread().name)
+            # Keys are "<unique prefix>-<uploaded filename>"
+            filename = os.path.basename(name).split("-", 1)[-1]
+            remaining = self.flaky.get(filename, 0)
+            self.flaky[filename] = remaining - 1
+        if remaining > 0:
+            raise ConnectionError("S3 unavailable")
+        return super()._save(name, content)
+
+@patch("listing.ingest.MEDIA_UPLOAD_RETRY_BACKOFF", 0)
+class CreateListingMediaTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.client = APIClient()
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            purdueEmail="fake@purdue.edu",
+            purdueEmailVerified=True
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer dummy_token")
+
+    def create_listing(self, storage, filenames):
+        payload = {
+            "title": "New Listing",
+            "description": "New listing description",
+            "price": "50.00",
+            "category": "Test",
+            "location": "other",
+            "user": self.user.uid,
+            "hidden": False,
+            "media": [SimpleUploadedFile(name, b"content of " + name.encode()) for name in filenames],
+        }
+        with patch.object(ListingMedia._meta.get_field("file"), "storage", storage):
+            return self.client.post(reverse("create_listing"), data=payload, format="multipart")
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        )
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_media_is_uploaded_in_parallel_with_retries(self, mock_verify):
+        storage = FlakyStorage(location=self.media_root, flaky={"b.jpg": 2})
+        response = self.create_listing(storage, ["a.jpg", "b.jpg", "c.png", "d.mp4"])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        listing = Listing.objects.get(id=response.json()["id"])
+        keys = list(listing.media.order_by("id").values_list("file", flat=True))
+        for key, name in zip(keys, ["a.jpg", "b.jpg", "c.png", "d.mp4"]):
+            self.assertRegex(key, rf"^users/dummy_uid/{listing.id}/[0-9a-f]{{12}}-{name}$")
+        self.assertEqual(self.stored_files(), sorted(keys))
+        self.assertGreater(len(storage.threads), 1)
+        self.assertFalse(listing.hidden)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_listing_is_not_created_when_an_upload_keeps_failing(self, mock_verify):
+        storage = FlakyStorage(location=self.media_root, flaky={"b.jpg": 10})
+        response = self.create_listing(storage, ["a.jpg", "b.jpg", "c.png"])
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(Listing.objects.exists())
+        self.assertFalse(ListingMedia.objects.exists())
+        # Files that did upload are removed again
+        self.assertEqual(self.stored_files(), [])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_uploads_are_removed_when_the_listing_cannot_be_saved(self, mock_verify):
+        storage = FlakyStorage(location=self.media_root)
+        with patch.object(ListingMedia.objects, "bulk_create", side_effect=DatabaseError("database unavailable")):
+            response = self.create_listing(storage, ["a.jpg", "b.jpg"])
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.json(), {"error": "Listing could not be created"})
+        self.assertFalse(Listing.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_uploads_that_cannot_be_removed_are_queued_for_deletion(self, mock_verify):
+        storage = FlakyStorage(location=self.media_root, flaky={"b.jpg": 10})
+        with patch.object(storage, "delete", side_effect=ConnectionError("S3 unavailable")):
+            response = self.create_listing(storage, ["a.jpg", "b.jpg"])
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(list(StorageDeletion.objects.values_list("key", flat=True)), self.stored_files())
@@ -2,6 +2,7 @@ import json
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
+from listing.cards import listing_cards
 from listing.models import Listing
 from user.models import User
 from django.utils import timezone
@@ -33,7 +34,7 @@ class ListingEndpointTests(APITestCase):
         self.dummy_token = "dummy_token"
         self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.dummy_token}")
     
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_get_top_listings_public(self, mock_verify):
         """
         User Story #17:
@@ -58,7 +59,7 @@ class ListingEndpointTests(APITestCase):
         data = response.json()
         self.assertLessEqual(len(data), 12)
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_get_all_listings_authenticated(self, mock_verify):
         """
         User Story #18:
@@ -93,7 +94,7 @@ class ListingEndpointTests(APITestCase):
         self.assertTrue(any(listing["title"] == "Listing 2" for listing in data))
 
     # is this a mistake do we have this function
-    # @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    # @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     # def test_get_listings_by_keyword_authenticated(self, mock_verify):
     #     """
     #     User Story #18:
@@ -129,7 +130,7 @@ class ListingEndpointTests(APITestCase):
 
     
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_create_listing_success(self, mock_verify):
         """
         User Story #9:
@@ -161,7 +162,7 @@ class ListingEndpointTests(APITestCase):
         self.assertTrue(Listing.objects.filter(title="New Listing").exists())
 
     
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_delete_listing_success(self, mock_verify):
         """
         User Story #10:
@@ -188,7 +189,7 @@ class ListingEndpointTests(APITestCase):
         self.assertFalse(Listing.objects.filter(id=listing.id).exists())
         
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_create_listing_missing_field(self, mock_verify):
         """
         User Story #9:
@@ -215,7 +216,7 @@ class ListingEndpointTests(APITestCase):
 
 
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_update_listing( self, mock_verify):
         """
         User Story #11:
@@ -254,7 +255,7 @@ class ListingEndpointTests(APITestCase):
         self.assertTrue(Listing.objects.filter(title="New Title").exists())
 
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_view_own_listings( self, mock_verify):
         """
         User Story #12:
@@ -284,7 +285,7 @@ class ListingEndpointTests(APITestCase):
         self.assertIn("Test Listing", str(response.json()))
 
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_view_other_listings( self, mock_verify):
         """
         User Story #13:
@@ -329,7 +330,7 @@ class ListingEndpointTests(APITestCase):
         self.assertIn("Test other Listing", str(response.json()))
 
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_mark_as_sold( self, mock_verify):
         """
         User Story #14:
@@ -366,7 +367,7 @@ class ListingEndpointTests(APITestCase):
         data = response.json()
         self.assertTrue(data["sold"])
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_hide_listing( self, mock_verify):
         """
         User Story #15:
@@ -403,7 +404,7 @@ class ListingEndpointTests(APITestCase):
         data = response.json()
         self.assertTrue(data["hidden"])
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_get_top_listings_verified(self, mock_verify):
         """
         Test that the endpoint returns the top listings for verified users.
@@ -435,7 +436,7 @@ class ListingEndpointTests(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_get_listing_by_lid(self, mock_verify):
 
         """
@@ -460,7 +461,7 @@ class ListingEndpointTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.json()["title"], "Test Listing")
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_save_listing(self, mock_verify):
         """
         User Story #11:
@@ -500,7 +501,7 @@ class ListingEndpointTests(APITestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_unsave_listing(self, mock_verify):
         """
         User Story #11:
@@ -532,7 +533,7 @@ class ListingEndpointTests(APITestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_get_saved_listings(self, mock_verify):
         """
         User Story #11, 19, 20:
@@ -566,7 +567,7 @@ class ListingEndpointTests(APITestCase):
         self.assertEqual(len(response.json()), 1)
         self.assertEqual(response.json()[0]["title"], "Test Listing")
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_filter_listings_by_location_price_category_date(self, mock_verify):
         """
         Test filtering listings by location, price, category, and date/time listed.
@@ -681,7 +682,7 @@ class ListingEndpointTests(APITestCase):
         self.assertIn("Electronics in New York 1", titles)
         self.assertIn("Electronics in New York 2", titles)
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_create_listing_with_video_success(self, mock_verify):
         """
         Test that a listing can be created with a video file.
@@ -712,7 +713,7 @@ class ListingEndpointTests(APITestCase):
         self.assertTrue(media_files[0].file.name.endswith("test_video.mp4"))
 
 
-    @patch("listing.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_create_listing_with_image_and_video_success(self, mock_verify):
         """
         Test that a listing can be created with both an image and a video file.
@@ -743,3 +744,168 @@ class ListingEndpointTests(APITestCase):
         filenames = [m.file.name for m in media_files]
         self.assertTrue(any(filename.endswith("test_image.png") for filename in filenames))
         self.assertTrue(any(filename.endswith("test_video.mp4") for filename in filenames))
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_all_listings_cursor_pagination(self, mock_verify):
+        """
+        Paging through listings with a cursor returns every listing exactly
+        once, in order, even when several listings share the same sort value.
+        """
+        for i in range(7):
+            Listing.objects.create(
+                title=f"Paged Listing {i}",
+                description="Paged listing",
+                price=10.0 if i % 2 else 20.0,
+                original_price=10.0,
+                category="Test",
+                user=self.user,
+                hidden=False
+            )
+        url = reverse("get_all_listings")
+        payload = {"sort": "price", "dir": "asc", "limit": 3}
+        seen = []
+        pages = 0
+        while True:
+            response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertLessEqual(len(data["results"]), 3)
+            seen.extend(data["results"])
+            pages += 1
+            if not data["nextCursor"]:
+                break
+            payload["cursor"] = data["nextCursor"]
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len({listing["id"] for listing in seen}), 7)
+        prices = [listing["price"] for listing in seen]
+        self.assertEqual(prices, sorted(prices))
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_all_listings_invalid_cursor_and_sort(self, mock_verify):
+        """
+        Sort keys a cursor cannot resume from and malformed cursors are
+        rejected in paginated mode; the legacy list keeps sorting by any field.
+        """
+        for title in ("B listing", "A listing"):
+            Listing.objects.create(
+                title=title,
+                description="Sorted listing",
+                price=10.0,
+                original_price=10.0,
+                category="Test",
+                user=self.user,
+                hidden=False
+            )
+        url = reverse("get_all_listings")
+        response = self.client.post(url, data=json.dumps({"sort": "title", "dir": "asc"}), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([listing["title"] for listing in response.json()], ["A listing", "B listing"])
+        response = self.client.post(url, data=json.dumps({"sort": "not_a_field"}), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, data=json.dumps({"sort": "title", "limit": 5}), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, data=json.dumps({"cursor": "not-a-cursor"}), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_all_listings_keyword_search(self, mock_verify):
+        """
+        Keyword search matches word prefixes in both the title and the
+        description, and can rank results by relevance.
+        """
+        Listing.objects.create(
+            title="Desk lamp",
+            description="Bright lamp for a dorm desk",
+            price=15.0,
+            original_price=15.0,
+            category="Test",
+            user=self.user,
+            hidden=False
+        )
+        Listing.objects.create(
+            title="Office chair",
+            description="Comes with a matching desk",
+            price=40.0,
+            original_price=40.0,
+            category="Test",
+            user=self.user,
+            hidden=False
+        )
+        Listing.objects.create(
+            title="Textbook",
+            description="Calculus, barely used",
+            price=30.0,
+            original_price=30.0,
+            category="Test",
+            user=self.user,
+            hidden=False
+        )
+        url = reverse("get_all_listings")
+        payload = {"keyword": "des", "sort": "relevance"}
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = [listing["title"] for listing in response.json()]
+        self.assertEqual(titles, ["Desk lamp", "Office chair"])
+
+        payload = {"keyword": "desk calculus"}
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(response.json(), [])
+
+        # Editing the description keeps the index in sync.
+        textbook = Listing.objects.get(title="Textbook")
+        textbook.description = "Calculus, fits on any desk"
+        textbook.save()
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual([listing["title"] for listing in response.json()], ["Textbook"])
+
+        # Keywords with nothing to index still filter instead of matching everything.
+        payload = {"keyword": "the"}
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(response.json(), [])
+        payload = {"keyword": ","}
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual([listing["title"] for listing in response.json()], ["Textbook"])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_top_listings_card_view(self, mock_verify):
+        """
+        With view=card, list endpoints return compact cards built in a single
+        query instead of full serialized listings.
+        """
+        saver = User.objects.create(uid="saver_uid", email="saver@example.com", displayName="Saver")
+        for i in range(5):
+            listing = Listing.objects.create(
+                title=f"Card Listing {i}",
+                description="A long description that cards leave out",
+                price=10.0 + i,
+                original_price=10.0 + i,
+                category="Test",
+                user=self.user,
+                hidden=False
+            )
+            listing.saved_by.add(self.user, saver)
+        with self.assertNumQueries(1):
+            listing_cards(Listing.objects.all())
+
+        url = reverse("get_top_listings")
+        response = self.client.get(url, {"view": "card"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(len(data), 5)
+        self.assertEqual(
+            set(data[0]),
+            {"id", "title", "price", "thumbnail", "displayName", "saves"}
+        )
+        self.assertEqual(data[0]["displayName"], "Dummy User")
+        self.assertEqual(data[0]["saves"], 2)
+        self.assertIsNone(data[0]["thumbnail"])
+
+        url = reverse("get_all_listings")
+        payload = {"view": "card", "sort": "views", "limit": 3}
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertNotIn("views", response.json()["results"][0])
+        payload["cursor"] = response.json()["nextCursor"]
+        response = self.client.post(url, data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(len(response.json()["results"]), 2)
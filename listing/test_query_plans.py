@@ -0,0 +1,122 @@
+import json
+import re
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from listing.models import Listing
+from user.models import History, User
+from unittest.mock import patch
+
+# Dummy token verifier for testing purposes.
+def dummy_verify_id_token(token):
+    return {
+        "uid": "dummy_uid",
+        "email_verified": True
+    }
+
+class ListingQueryPlanTests(APITestCase):
+    """
+    Query-plan regression tests: every Listing query issued by the hot
+    listing endpoints must be served by an index, never a full scan of
+    listing_listing.
+    """
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            bio="Dummy bio",
+            purdueEmail="fake@purdue.edu",
+            purdueEmailVerified=True,
+            admin=True
+        )
+        self.other_user = User.objects.create(
+            uid="other_uid",
+            email="other@example.com",
+            displayName="Other User",
+            purdueEmail="other@purdue.edu",
+            purdueEmailVerified=True
+        )
+        for i in range(30):
+            Listing.objects.create(
+                title=f"Listing {i}",
+                description="Query plan listing",
+                price=10.0 + i,
+                original_price=10.0 + i,
+                category="Electronics" if i % 3 else "Books",
+                location="chauncy" if i % 2 else "other",
+                user=self.other_user if i % 2 else self.user,
+                hidden=i % 5 == 0,
+                sold=i % 7 == 0
+            )
+        History.objects.create(user=self.user, listing=Listing.objects.filter(user=self.other_user).first())
+        self.dummy_token = "dummy_token"
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.dummy_token}")
+
+    def full_scans(self, sql):
+        """
+        Return the plan lines for `sql` that read listing_listing without an
+        index.
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                lines = [row[-1] for row in cursor.fetchall()]
+                return [line for line in lines if re.fullmatch(r"SCAN listing_listing( AS \w+)?", line)]
+            if connection.vendor == "mysql":
+                cursor.execute(f"EXPLAIN {sql}")
+                columns = [col[0] for col in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                return [str(row) for row in rows if row["table"] == "listing_listing" and row["type"] == "ALL"]
+        self.skipTest(f"No query plan check for {connection.vendor}")
+
+    def assertIndexedListingQueries(self, method, url, payload=None):
+        with CaptureQueriesContext(connection) as ctx:
+            if method == "post":
+                response = self.client.post(url, data=json.dumps(payload or {}), content_type="application/json")
+            else:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        listing_queries = [
+            query["sql"] for query in ctx.captured_queries
+            if query["sql"].startswith("SELECT") and '"listing_listing"' in query["sql"].replace("`", '"')
+        ]
+        self.assertTrue(listing_queries, f"No Listing query captured for {url}")
+        for sql in listing_queries:
+            scans = self.full_scans(sql)
+            self.assertEqual(scans, [], f"Full table scan of listing_listing for {url}:\n{sql}")
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_all_listings_uses_indexes(self, mock_verify):
+        url = reverse("get_all_listings")
+        payloads = [
+            {},
+            {"sort": "price", "dir": "asc"},
+            {"sort": "views", "dir": "desc", "limit": 5},
+            {"sort": "dateListed", "dir": "asc", "dateFilter": "week"},
+            {"categoryFilter": "Electronics", "locationFilter": "chauncy", "priceFilter": "10-30"},
+            {"keyword": "listing", "sort": "price"},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                self.assertIndexedListingQueries("post", url, payload)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_homepage_listings_use_indexes(self, mock_verify):
+        self.assertIndexedListingQueries("get", reverse("get_top_listings"))
+        self.assertIndexedListingQueries("get", reverse("get_top_listings_verified"))
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_admin_listing_counts_use_indexes(self, mock_verify):
+        self.assertIndexedListingQueries("get", reverse("get_active_listings"))
+        self.assertIndexedListingQueries("get", reverse("get_sold_listings"))
+        self.assertIndexedListingQueries("get", reverse("get_hidden_listings"))
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_recommended_listings_use_indexes(self, mock_verify):
+        url = reverse("get_recommended_listings", kwargs={"uid": self.user.uid})
+        self.assertIndexedListingQueries("get", url)
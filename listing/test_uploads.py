@@ -0,0 +1,136 @@
+import unittest
+from django.conf import settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from listing.models import Listing, ListingMedia
+from user.models import User
+from unittest.mock import patch
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+# Dummy token verifier for testing purposes.
+def dummy_verify_id_token(token):
+    return {
+        "uid": "dummy_uid",
+        "email_verified": True
+    }
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class MediaUploadTests(APITestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.addCleanup(self.mock.stop)
+        self.s3 = boto3.client("s3", region_name=settings.AWS_S3_REGION_NAME)
+        self.s3.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+        self.client = APIClient()
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            purdueEmail="fake@purdue.edu",
+            purdueEmailVerified=True
+        )
+        self.other = User.objects.create(uid="other_uid", email="other@example.com", displayName="Other User")
+        self.listing = Listing.objects.create(
+            title="Bike",
+            description="A bike",
+            price=50.0,
+            original_price=50.0,
+            category="Test",
+            user=self.user
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer dummy_token")
+
+    def request_uploads(self, files, listing=None):
+        url = reverse("request_media_uploads", args=[(listing or self.listing).id])
+        return self.client.post(url, {"files": files}, format="json")
+
+    def finalize(self, uploads):
+        url = reverse("finalize_media_uploads", args=[self.listing.id])
+        return self.client.post(url, {"uploads": uploads}, format="json")
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_presigned_post_upload_is_registered(self, mock_verify):
+        response = self.request_uploads([{"filename": "front view.jpg", "size": 5}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload = response.json()["uploads"][0]
+        self.assertEqual(upload["method"], "POST")
+        self.assertTrue(upload["key"].startswith(f"users/dummy_uid/{self.listing.id}/"))
+        self.assertTrue(upload["key"].endswith("-front_view.jpg"))
+        self.assertEqual(upload["fields"]["key"], upload["key"])
+        self.assertEqual(upload["fields"]["Content-Type"], "image/jpeg")
+
+        # Nothing is registered before the file is actually in the bucket
+        response = self.finalize([{"key": upload["key"]}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ListingMedia.objects.exists())
+
+        self.s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=upload["key"], Body=b"image")
+        response = self.finalize([{"key": upload["key"]}])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(self.listing.media.values_list("file", flat=True)), [upload["key"]])
+
+        # Registering the same upload twice is rejected
+        response = self.finalize([{"key": upload["key"]}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.listing.media.count(), 1)
+
+    @patch("listing.uploads.MULTIPART_THRESHOLD", 1024)
+    @patch("listing.uploads.MULTIPART_PART_SIZE", 5 * 1024 * 1024)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_multipart_upload_is_completed_and_registered(self, mock_verify):
+        size = 5 * 1024 * 1024 + 10
+        response = self.request_uploads([{"filename": "tour.mp4", "size": size}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload = response.json()["uploads"][0]
+        self.assertEqual(upload["method"], "MULTIPART")
+        self.assertEqual([part["partNumber"] for part in upload["parts"]], [1, 2])
+
+        body = b"v" * size
+        parts = []
+        for part in upload["parts"]:
+            start = (part["partNumber"] - 1) * upload["partSize"]
+            result = self.s3.upload_part(
+                Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                Key=upload["key"],
+                UploadId=upload["uploadId"],
+                PartNumber=part["partNumber"],
+                Body=body[start:start + upload["partSize"]],
+            )
+            parts.append({"partNumber": part["partNumber"], "etag": result["ETag"]})
+
+        response = self.finalize([{"key": upload["key"], "uploadId": upload["uploadId"], "parts": parts[::-1]}])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        head = self.s3.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=upload["key"])
+        self.assertEqual(head["ContentLength"], size)
+        self.assertEqual(self.listing.media.count(), 1)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_uploads_are_validated(self, mock_verify):
+        response = self.request_uploads([{"filename": "notes.pdf", "size": 5}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Keys outside the listing's prefix are never registered
+        other_key = f"users/other_uid/{self.listing.id}/photo.jpg"
+        self.s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=other_key, Body=b"image")
+        response = self.finalize([{"key": other_key}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ListingMedia.objects.exists())
+
+        other_listing = Listing.objects.create(
+            title="Lamp",
+            description="A lamp",
+            price=5.0,
+            original_price=5.0,
+            category="Test",
+            user=self.other
+        )
+        response = self.request_uploads([{"filename": "photo.jpg", "size": 5}], listing=other_listing)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,165 @@
+import unittest
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from unittest.mock import patch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from listing.models import Listing
+from listing.view_counter import LocalViewCounter, RedisViewCounter, apply_view_deltas, flush_views, get_view_counter
+from user.models import User
+
+
+class ViewCounterBackendTests:
+    """Behaviour shared by both view counter backends."""
+
+    def make_counter(self, dedup_window=0):
+        raise NotImplementedError
+
+    def test_views_are_buffered_until_taken(self):
+        counter = self.make_counter()
+        self.assertEqual(counter.record(1), (True, 1))
+        self.assertEqual(counter.record(1), (True, 2))
+        self.assertEqual(counter.record(2), (True, 1))
+
+        self.assertEqual(counter.take(), {1: 2, 2: 1})
+        # Claimed counts still show as pending until they are written
+        self.assertEqual(counter.record(1), (True, 3))
+        counter.release(flushed=True)
+        self.assertEqual(counter.pending(1), 1)
+        self.assertEqual(counter.take(), {1: 1})
+
+    def test_failed_flush_is_taken_again(self):
+        counter = self.make_counter()
+        counter.record(1)
+        self.assertEqual(counter.take(), {1: 1})
+        counter.release(flushed=False)
+        counter.record(1)
+        self.assertEqual(counter.take(), {1: 1})
+        counter.release(flushed=True)
+        self.assertEqual(counter.take(), {1: 1})
+
+    def test_batch_id_is_kept_until_the_batch_is_dropped(self):
+        counter = self.make_counter()
+        counter.record(1)
+        counter.take()
+        batch = counter.batch
+        self.assertTrue(batch)
+        counter.release(flushed=False)
+        counter.take()
+        self.assertEqual(counter.batch, batch)
+        counter.release(flushed=True)
+        counter.record(1)
+        counter.take()
+        self.assertNotEqual(counter.batch, batch)
+
+    def test_only_one_flush_at_a_time(self):
+        counter = self.make_counter()
+        counter.record(1)
+        self.assertEqual(counter.take(), {1: 1})
+        self.assertIsNone(counter.take())
+        counter.release(flushed=True)
+        self.assertEqual(counter.take(), {})
+
+    def test_repeat_views_within_the_window_are_not_counted(self):
+        counter = self.make_counter(dedup_window=60)
+        self.assertEqual(counter.record(1, "uid:buyer"), (True, 1))
+        self.assertEqual(counter.record(1, "uid:buyer"), (False, 1))
+        self.assertEqual(counter.record(1, "ip:10.0.0.1"), (True, 2))
+        self.assertEqual(counter.record(2, "uid:buyer"), (True, 1))
+
+
+class LocalViewCounterTests(ViewCounterBackendTests, SimpleTestCase):
+    def make_counter(self, dedup_window=0):
+        return LocalViewCounter(dedup_window=dedup_window)
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is required for the Redis view counter tests")
+class RedisViewCounterTests(ViewCounterBackendTests, SimpleTestCase):
+    def make_counter(self, dedup_window=0):
+        return RedisViewCounter(fakeredis.FakeRedis(), dedup_window=dedup_window)
+
+
+@patch("listing.views.get_view_flusher")
+class IncrementListingViewTests(APITestCase):
+    def setUp(self):
+        get_view_counter().clear()
+        self.client = APIClient()
+        self.user = User.objects.create(uid="seller_uid", email="seller@example.com", displayName="Seller")
+        self.listing = Listing.objects.create(
+            title="Desk",
+            description="A desk",
+            price=10.0,
+            original_price=10.0,
+            category="Test",
+            user=self.user,
+            views=5
+        )
+
+    def tearDown(self):
+        get_view_counter().clear()
+
+    def view(self, listing_id=None, **extra):
+        return self.client.post(reverse("increment_listing_view", args=[listing_id or self.listing.id]), **extra)
+
+    def test_views_are_counted_without_writing_the_listing(self, mock_flusher):
+        with self.assertNumQueries(1):
+            response = self.view()
+        self.assertEqual(response.json(), {"views": 6})
+        self.assertEqual(self.view().json(), {"views": 7})
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 5)
+
+        self.assertEqual(flush_views(), 1)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 7)
+        self.assertEqual(self.view().json(), {"views": 8})
+
+    def test_flush_updates_many_listings_in_one_statement(self, mock_flusher):
+        other = Listing.objects.create(
+            title="Lamp", description="A lamp", price=5.0, original_price=5.0, category="Test", user=self.user
+        )
+        self.view()
+        self.view()
+        self.view(other.id)
+        with CaptureQueriesContext(connection) as queries:
+            flush_views()
+        self.assertEqual([q["sql"].split()[0] for q in queries if "listing_listing" in q["sql"]], ["UPDATE"])
+        self.assertEqual(
+            dict(Listing.objects.values_list("id", "views")),
+            {self.listing.id: 7, other.id: 1}
+        )
+
+    def test_batch_claimed_again_after_a_lost_release_is_not_added_twice(self, mock_flusher):
+        self.view()
+        self.view()
+        counter = get_view_counter()
+        deltas = counter.take()
+        self.assertTrue(apply_view_deltas(deltas, counter.batch))
+        # The counts were written but the release never dropped them
+        counter.release(flushed=False)
+
+        self.assertEqual(flush_views(), 1)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.views, 7)
+        self.assertEqual(counter.pending(self.listing.id), 0)
+
+    def test_refreshes_by_the_same_viewer_count_once(self, mock_flusher):
+        with patch.object(get_view_counter(), "dedup_window", 60):
+            self.assertEqual(self.view(REMOTE_ADDR="10.0.0.1").json(), {"views": 6})
+            self.assertEqual(self.view(REMOTE_ADDR="10.0.0.1").json(), {"views": 6})
+            self.assertEqual(self.view(REMOTE_ADDR="10.0.0.2").json(), {"views": 7})
+            # Clients behind the same proxy are told apart by X-Forwarded-For
+            self.assertEqual(self.view(REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="203.0.113.1").json(), {"views": 8})
+            self.assertEqual(self.view(REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="203.0.113.2").json(), {"views": 9})
+            self.assertEqual(self.view(REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="203.0.113.1").json(), {"views": 9})
+
+    def test_missing_listing(self, mock_flusher):
+        response = self.view(999)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,130 @@
+import math
+import os
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils.text import get_valid_filename
+
+from listing.models import ListingMedia, listing_media_upload_path
+
+MEDIA_EXTENSIONS = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+}
+UPLOAD_URL_EXPIRES = getattr(settings, "MEDIA_UPLOAD_URL_EXPIRES", 60 * 60)
+MAX_UPLOAD_SIZE = getattr(settings, "MEDIA_MAX_UPLOAD_SIZE", 1024 * 1024 * 1024)
+# Files larger than this are uploaded in parts of MULTIPART_PART_SIZE
+# (S3 requires parts of at least 5 MB, except the last one)
+MULTIPART_THRESHOLD = getattr(settings, "MEDIA_MULTIPART_THRESHOLD", 64 * 1024 * 1024)
+MULTIPART_PART_SIZE = getattr(settings, "MEDIA_MULTIPART_PART_SIZE", 16 * 1024 * 1024)
+MAX_FILES_PER_LISTING = getattr(settings, "MEDIA_MAX_FILES_PER_LISTING", 10)
+
+
+class InvalidUpload(ValueError):
+    pass
+
+
+def s3_client():
+    """A client for the media bucket, honouring a local endpoint (e.g. moto)."""
+    return boto3.client(
+        "s3",
+        region_name=settings.AWS_S3_REGION_NAME,
+        endpoint_url=getattr(settings, "AWS_S3_ENDPOINT_URL", None),
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    )
+
+
+def media_extension(filename):
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    if extension not in MEDIA_EXTENSIONS:
+        raise InvalidUpload(f"Unsupported file type: {filename}")
+    return extension
+
+
+def listing_media_prefix(listing):
+    return listing_media_upload_path(ListingMedia(listing=listing), "")
+
+
+def new_media_key(listing, filename):
+    """
+    Object key for a new upload, under the same users/<uid>/<listing>/
+    prefix ListingMedia uses, made unique so uploads never overwrite. Both
+    create_listing and presigned uploads use it, so every media key passes
+    finalize_upload's prefix check and is removed with its listing or user.
+    """
+    name = get_valid_filename(os.path.basename(filename))
+    return listing_media_upload_path(ListingMedia(listing=listing), f"{uuid.uuid4().hex[:12]}-{name}")
+
+
+def presign_upload(client, listing, filename, size):
+    """
+    Upload instructions for one file: a presigned POST for ordinary files,
+    or a multipart upload with one presigned PUT URL per part for large ones.
+    """
+    content_type = MEDIA_EXTENSIONS[media_extension(filename)]
+    if size > MAX_UPLOAD_SIZE:
+        raise InvalidUpload(f"{filename} is larger than {MAX_UPLOAD_SIZE} bytes.")
+    key = new_media_key(listing, filename)
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+
+    if size <= MULTIPART_THRESHOLD:
+        post = client.generate_presigned_post(
+            bucket,
+            key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, size]],
+            ExpiresIn=UPLOAD_URL_EXPIRES,
+        )
+        return {"key": key, "method": "POST", "url": post["url"], "fields": post["fields"]}
+
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]
+    parts = [
+        {
+            "partNumber": number,
+            "url": client.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": bucket, "Key": key, "UploadId": upload_id, "PartNumber": number},
+                ExpiresIn=UPLOAD_URL_EXPIRES,
+            ),
+        }
+        for number in range(1, math.ceil(size / MULTIPART_PART_SIZE) + 1)
+    ]
+    return {"key": key, "method": "MULTIPART", "uploadId": upload_id, "partSize": MULTIPART_PART_SIZE, "parts": parts}
+
+
+def finalize_upload(client, listing, upload):
+    """
+    Complete a multipart upload if needed and check that the object exists
+    under this listing's prefix. Returns the key to store on ListingMedia.
+    """
+    key = upload["key"]
+    if not key.startswith(listing_media_prefix(listing)) or "/" in key[len(listing_media_prefix(listing)):]:
+        raise InvalidUpload(f"{key} does not belong to this listing.")
+    media_extension(key)
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+
+    try:
+        if upload.get("uploadId"):
+            parts = sorted(upload.get("parts") or [], key=lambda part: part["partNumber"])
+            if not parts:
+                raise InvalidUpload(f"No parts were sent for {key}.")
+            client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload["uploadId"],
+                MultipartUpload={"Parts": [{"PartNumber": part["partNumber"], "ETag": part["etag"]} for part in parts]},
+            )
+        head = client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        raise InvalidUpload(f"{key} was not uploaded: {e.response.get('Error', {}).get('Code', e)}")
+
+    if head["ContentLength"] > MAX_UPLOAD_SIZE:
+        client.delete_object(Bucket=bucket, Key=key)
+        raise InvalidUpload(f"{key} is larger than {MAX_UPLOAD_SIZE} bytes.")
+    return key
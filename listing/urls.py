@@ -13,7 +13,11 @@ from listing.views import (get_all_listings,
     get_top_listings_verified,
     get_active_listings,
     get_sold_listings,
-    get_hidden_listings
+    get_hidden_listings,
+    request_media_uploads,
+    finalize_media_uploads,
+    get_listing_analytics,
+    get_seller_analytics
 )
 
 
@@ -32,5 +36,9 @@ urlpatterns = [
     path("incrementView/<int:listing_id>/", increment_listing_view, name="increment_listing_view" ),
     path("getActiveListings/", get_active_listings, name="get_active_listings" ),
     path("getSoldListings/", get_sold_listings, name="get_sold_listings" ),
+    path("requestUploads/<int:listing_id>/", request_media_uploads, name="request_media_uploads" ),
+    path("finalizeUploads/<int:listing_id>/", finalize_media_uploads, name="finalize_media_uploads" ),
+    path("getListingAnalytics/<int:listing_id>/", get_listing_analytics, name="get_listing_analytics" ),
+    path("getSellerAnalytics/", get_seller_analytics, name="get_seller_analytics" ),
     path("getHiddenListings/", get_hidden_listings, name="get_hidden_listings" ),
 ]
@@ -0,0 +1,271 @@
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from rest_framework.throttling import BaseThrottle
+
+from listing.models import Listing, ViewFlush
+from server.backends import RedisClaim, shared_backend
+
+# Seconds between flushes of the buffered view counts to Listing.views
+VIEW_FLUSH_INTERVAL = getattr(settings, "LISTING_VIEW_FLUSH_INTERVAL", 10)
+# Repeat views of a listing by the same viewer within this many seconds
+# are not counted; 0 counts every view
+VIEW_DEDUP_WINDOW = getattr(settings, "LISTING_VIEW_DEDUP_WINDOW", 0)
+# Listings updated per UPDATE statement when flushing
+VIEW_FLUSH_CHUNK = 500
+FLUSH_LOCK_TTL = 60
+# How long written batches are remembered; a batch is only claimed again
+# when its release failed, which the next flush retries
+VIEW_FLUSH_RECORD_RETENTION = timedelta(days=1)
+
+PENDING_KEY = "views:pending"
+FLUSHING_KEY = "views:flushing"
+FLUSH_LOCK_KEY = "views:flush_lock"
+FLUSH_BATCH_KEY = "views:flushing:batch"
+
+
+def seen_key(lid, viewer):
+    return f"views:seen:{lid}:{viewer}"
+
+
+def viewer_key(request):
+    """
+    Who is viewing, for de-duplication: the user if signed in, else the
+    client address. Behind a proxy that is taken from X-Forwarded-For the
+    way DRF's throttles do (see its NUM_PROXIES setting), so anonymous
+    viewers are not all seen as the proxy.
+    """
+    if request.user.is_authenticated:
+        return f"uid:{request.user.username}"
+    return f"ip:{BaseThrottle().get_ident(request)}"
+
+
+# KEYS: pending hash, flushing hash, seen key. ARGV: listing id, window,
+# whether to de-duplicate. Returns {counted, views not yet in the database}.
+RECORD = """
+local counted = 1
+if ARGV[3] == '1' and not redis.call('SET', KEYS[3], 1, 'NX', 'EX', ARGV[2]) then
+    counted = 0
+end
+local pending
+if counted == 1 then
+    pending = redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+else
+    pending = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or 0)
+end
+return {counted, pending + tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or 0)}
+"""
+
+# Moves the pending counts aside for flushing under a new batch id. A
+# flushing hash left by a failed flush is returned again instead, with its
+# batch id, so no counts are lost and none are written twice.
+# KEYS: pending hash, flushing hash, batch id. ARGV: new batch id.
+# Returns {batch id, field, count, ...}.
+TAKE = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('SET', KEYS[3], ARGV[1])
+end
+local batch = redis.call('GET', KEYS[3])
+if not batch then
+    batch = ARGV[1]
+    redis.call('SET', KEYS[3], batch)
+end
+local claimed = redis.call('HGETALL', KEYS[2])
+table.insert(claimed, 1, batch)
+return claimed
+"""
+
+class RedisViewCounter:
+    """
+    View counts buffered in Redis and shared by every worker: one hash
+    maps listing id to views not yet written to Listing.views. Recording a
+    view is a single script call; the database is only written by flushes.
+    Each claimed batch has an id that the flush records with the counts, so
+    a batch whose release failed is dropped, not added again, when it is
+    claimed the next time.
+    """
+
+    def __init__(self, client, dedup_window=VIEW_DEDUP_WINDOW):
+        self.client = client
+        self.dedup_window = dedup_window
+        self.record_script = client.register_script(RECORD)
+        self.take_script = client.register_script(TAKE)
+        self.claim = RedisClaim(client, FLUSH_LOCK_KEY, [FLUSHING_KEY, FLUSH_BATCH_KEY], FLUSH_LOCK_TTL)
+        self.batch = None
+
+    def record(self, lid, viewer=None):
+        """Count a view. Returns (counted, views of the listing not yet flushed)."""
+        dedup = bool(self.dedup_window and viewer)
+        counted, pending = self.record_script(
+            keys=[PENDING_KEY, FLUSHING_KEY, seen_key(lid, viewer)],
+            args=[lid, self.dedup_window or 1, "1" if dedup else "0"],
+        )
+        return bool(counted), int(pending)
+
+    def pending(self, lid):
+        pipe = self.client.pipeline()
+        pipe.hget(PENDING_KEY, lid)
+        pipe.hget(FLUSHING_KEY, lid)
+        return sum(int(count or 0) for count in pipe.execute())
+
+    def take(self):
+        """
+        Claim the buffered counts for flushing as {lid: delta}, or None when
+        another worker is flushing. Their batch id is left in `batch`.
+        """
+        token = self.claim.acquire()
+        if token is None:
+            return None
+        values = self.take_script(keys=[PENDING_KEY, FLUSHING_KEY, FLUSH_BATCH_KEY], args=[token])
+        if not values:
+            self.batch = None
+            return {}
+        batch, values = values[0], values[1:]
+        self.batch = batch.decode() if isinstance(batch, bytes) else batch
+        return {int(values[i]): int(values[i + 1]) for i in range(0, len(values), 2)}
+
+    def release(self, flushed):
+        """End a flush; the claimed counts are dropped only if they were written."""
+        self.claim.release(flushed)
+        self.batch = None
+
+
+class LocalViewCounter:
+    """The view counts of RedisViewCounter, buffered in this process."""
+
+    def __init__(self, dedup_window=VIEW_DEDUP_WINDOW):
+        self.dedup_window = dedup_window
+        self._pending = {}
+        self._flushing = {}
+        self._seen = {}
+        self._flushing_now = False
+        self._lock = threading.Lock()
+        self.batch = None
+
+    def record(self, lid, viewer=None):
+        with self._lock:
+            now = time.monotonic()
+            counted = True
+            if self.dedup_window and viewer:
+                key = (lid, viewer)
+                counted = self._seen.get(key, 0) <= now
+                if counted:
+                    self._seen[key] = now + self.dedup_window
+            if counted:
+                self._pending[lid] = self._pending.get(lid, 0) + 1
+            return counted, self._pending.get(lid, 0) + self._flushing.get(lid, 0)
+
+    def pending(self, lid):
+        with self._lock:
+            return self._pending.get(lid, 0) + self._flushing.get(lid, 0)
+
+    def take(self):
+        with self._lock:
+            if self._flushing_now:
+                return None
+            self._flushing_now = True
+            if not self._flushing:
+                self._flushing, self._pending = self._pending, {}
+                self.batch = uuid.uuid4().hex if self._flushing else None
+            now = time.monotonic()
+            self._seen = {key: expires for key, expires in self._seen.items() if expires > now}
+            return dict(self._flushing)
+
+    def release(self, flushed):
+        with self._lock:
+            if flushed:
+                self._flushing = {}
+                self.batch = None
+            self._flushing_now = False
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._flushing.clear()
+            self._seen.clear()
+            self._flushing_now = False
+            self.batch = None
+
+
+get_view_counter = shared_backend(RedisViewCounter, LocalViewCounter)
+
+
+def apply_view_deltas(deltas, batch):
+    """
+    Add {lid: delta} to Listing.views, one UPDATE per VIEW_FLUSH_CHUNK
+    listings, unless `batch` was already written. Returns whether it was.
+    """
+    lids = sorted(deltas)
+    with transaction.atomic():
+        _, created = ViewFlush.objects.get_or_create(batch=batch)
+        if not created:
+            print(f"View batch {batch} was already written, dropping it")
+            return False
+        ViewFlush.objects.filter(createdAt__lt=timezone.now() - VIEW_FLUSH_RECORD_RETENTION).delete()
+        for i in range(0, len(lids), VIEW_FLUSH_CHUNK):
+            chunk = lids[i:i + VIEW_FLUSH_CHUNK]
+            increment = Case(
+                *[When(id=lid, then=Value(deltas[lid])) for lid in chunk],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            Listing.objects.filter(id__in=chunk).update(views=F("views") + increment)
+    return True
+
+
+def flush_views(counter=None):
+    """Write the buffered view counts to the database. Returns the number of listings updated."""
+    counter = counter or get_view_counter()
+    deltas = counter.take()
+    if deltas is None:
+        return 0
+    flushed = False
+    try:
+        if deltas:
+            apply_view_deltas(deltas, counter.batch)
+        flushed = True
+    finally:
+        counter.release(flushed)
+    return len(deltas)
+
+
+class ViewFlusher:
+    """Background thread flushing the buffered view counts every `interval` seconds."""
+
+    def __init__(self, interval=VIEW_FLUSH_INTERVAL):
+        self.interval = interval
+        self.thread = threading.Thread(target=self.run, name="view-flusher", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                flush_views()
+            except Exception as e:
+                print(f"Flushing listing views failed: {e}")
+            finally:
+                close_old_connections()
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def get_view_flusher():
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = ViewFlusher()
+    return _flusher
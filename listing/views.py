@@ -1,18 +1,25 @@
-import django
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import status
-from django.db.models import F
-
-from datetime import timedelta
-
-from firebase_admin import auth as firebase_admin_auth
+from django.db import transaction
 
 from server.authentication import AdminFirebaseAuthentication, FirebaseAuthentication, FirebaseEmailVerifiedAuthentication
+from listing.analytics import InvalidAnalyticsParameter, listing_series, parse_range, record_event, seller_series
+from listing.cards import listing_cards, wants_cards
+from listing.ingest import MediaUploadError, discard_uploads, upload_listing_media
+from listing.media import schedule_media_processing
 from listing.models import Listing, ListingMedia
-from listing.serializers import CreateListingSerializer, ListingSerializer, DeleteListingSerializer, UpdateListingSerializer
+from listing.search import InvalidSearchParameter, filter_listings, order_listings, paginate_listings, with_serializer_relations
+from listing.serializers import (
+    CreateListingSerializer, ListingSerializer, DeleteListingSerializer, UpdateListingSerializer,
+    RequestMediaUploadsSerializer, FinalizeMediaUploadsSerializer
+)
+from listing.view_counter import get_view_counter, get_view_flusher, viewer_key
+from listing.uploads import MAX_FILES_PER_LISTING, InvalidUpload, finalize_upload, presign_upload, s3_client
+from server.media import variant_keys
 from user.models import User
+from user.storage_cleanup import enqueue_deletions
 
 
 @api_view(["GET"])
@@ -53,56 +60,56 @@ def get_active_listings(request):
 @permission_classes([IsAuthenticated])
 def get_all_listings(request):
     """
-    Fetch all listings
+    Fetch all listings matching the browse filters.
+    - If `cursor` or `limit` is provided, return one keyset-paginated page as
+      {"results": [...], "nextCursor": ...}.
+    - Otherwise fall back to the legacy unpaginated list response.
+    - With `view` set to "card", listings are returned as compact cards.
     """
 
     sort = request.data.get("sort", "dateListed")
     direction = request.data.get("dir", "desc")
-    category = request.data.get("categoryFilter", None)
-    date_range = request.data.get("dateFilter", None)
-    price_range = request.data.get("priceFilter", None)
-    location = request.data.get("locationFilter", None)
-    keyword = request.data.get("keyword", None)
-
-    if direction == "desc":
-        sort = f"-{sort}"
+    cursor = request.data.get("cursor", None)
+    limit = request.data.get("limit", None)
+    cards = wants_cards(request)
 
     listings = Listing.objects.filter(hidden=False)
 
-    if category:
-        listings = listings.filter(category__iexact=category)
-
-    if location:
-        listings = listings.filter(location__iexact=location)
-
-    if date_range:
-        if date_range == "week":
-            listings = listings.filter(dateListed__gte=django.utils.timezone.now() - timedelta(days=7))
-        elif date_range == "month":
-            listings = listings.filter(dateListed__gte=django.utils.timezone.now() - timedelta(days=30))
-
-    if price_range:
-        try:
-            min_price, max_price = map(float, price_range.split("-"))
-            listings = listings.filter(price__gte=min_price, price__lte=max_price)
-        except ValueError:
-            return Response({"error": "Invalid price range format. Use 'min-max' format."}, status=status.HTTP_400_BAD_REQUEST)
-
-    if keyword:
-        listings = listings.filter(title__icontains=keyword)
-
-    listings = listings.order_by(sort)
-    serializer = ListingSerializer(listings, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    try:
+        listings = filter_listings(
+            listings,
+            category=request.data.get("categoryFilter", None),
+            location=request.data.get("locationFilter", None),
+            date_range=request.data.get("dateFilter", None),
+            price_range=request.data.get("priceFilter", None),
+            keyword=request.data.get("keyword", None),
+        )
+
+        if cursor is None and limit is None:
+            # Compatibility mode for clients that expect the whole result set
+            listings = order_listings(listings, sort, direction, strict=False)
+            if cards:
+                return Response(listing_cards(listings), status=status.HTTP_200_OK)
+            serializer = ListingSerializer(with_serializer_relations(listings), many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        page, next_cursor = paginate_listings(listings, sort, direction, cursor=cursor, limit=limit, cards=cards)
+    except InvalidSearchParameter as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = page if cards else ListingSerializer(page, many=True).data
+    return Response({"results": results, "nextCursor": next_cursor}, status=status.HTTP_200_OK)
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def get_top_listings(request):
-    user = User.objects.get(uid=request.user) if request.user.is_authenticated else None
+    user = request.user.account if request.user.is_authenticated else None
     print(user)
     blocked_users = user.blockedUsers.all() if user else []
     print(blocked_users)
     listings = Listing.objects.exclude(user__in=blocked_users).order_by("-dateListed")[:12]
+    if wants_cards(request):
+        return Response(listing_cards(listings), status=status.HTTP_200_OK)
     serializer = ListingSerializer(listings, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -110,9 +117,11 @@ def get_top_listings(request):
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([AllowAny])
 def get_top_listings_verified(request):
-    user = User.objects.get(uid=request.user) if request.user.is_authenticated else None
+    user = request.user.account if request.user.is_authenticated else None
     blocked_users = user.blockedUsers.all() if user else []
     listings = Listing.objects.exclude(user__in=blocked_users).order_by("-dateListed")[:12]
+    if wants_cards(request):
+        return Response(listing_cards(listings), status=status.HTTP_200_OK)
     serializer = ListingSerializer(listings, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -124,6 +133,8 @@ def get_listings_by_user(request, uid):
     Fetch all listings that a user owns
     """
     listings = Listing.objects.filter(user=uid)
+    if wants_cards(request):
+        return Response(listing_cards(listings), status=status.HTTP_200_OK)
     serializer = ListingSerializer(listings, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -155,6 +166,9 @@ def create_listing(request):
     validated_data = serializer.validated_data
     user = User.objects.get(uid=validated_data['user'])
 
+    # The listing is written first so its media can be uploaded under its
+    # own prefix, and kept hidden until the media is attached. No
+    # transaction is held open while the uploads run.
     listing = Listing.objects.create(
         title=validated_data['title'],
         description=validated_data['description'],
@@ -163,38 +177,177 @@ def create_listing(request):
         category=validated_data['category'],
         location=validated_data['location'],
         user=user,
-        hidden=validated_data['hidden']
+        hidden=True
     )
+    files = request.FILES.getlist('media')
+    try:
+        keys = upload_listing_media(listing, files)
+    except MediaUploadError as e:
+        discard_listing(listing)
+        return Response({"error": "Media upload failed", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    # Save each media file
-    media_files = request.FILES.getlist('media')
-    for f in media_files:
-        ListingMedia.objects.create(listing=listing, file=f)
+    try:
+        with transaction.atomic():
+            ListingMedia.objects.bulk_create([ListingMedia(listing=listing, file=key) for key in keys])
+            Listing.objects.filter(id=listing.id).update(hidden=validated_data['hidden'])
+            # bulk_create sends no post_save (and sets no ids on MySQL)
+            schedule_media_processing(listing.media.values_list("id", flat=True))
+    except Exception as e:
+        print(f"Creating listing failed: {e}")
+        # Nothing references the uploads now
+        discard_uploads(ListingMedia._meta.get_field("file").storage, keys)
+        discard_listing(listing)
+        return Response({"error": "Listing could not be created"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return Response({"message": "Listing created"}, status=status.HTTP_201_CREATED)
+    return Response({"message": "Listing created", "id": listing.id}, status=status.HTTP_201_CREATED)
 
 
-@api_view(["DELETE"])
+def discard_listing(listing):
+    """Remove a listing whose creation failed; it is still hidden if this fails too."""
+    try:
+        listing.delete()
+    except Exception as e:
+        print(f"Removing listing {listing.id} failed: {e}")
+
+
+def owned_listing(request, listing_id):
+    """The listing if the requesting user owns it, otherwise an error Response."""
+    user = request.user.account
+    if user is None:
+        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        listing = Listing.objects.get(id=listing_id)
+    except Listing.DoesNotExist:
+        return Response({"error": "Listing not found"}, status=status.HTTP_404_NOT_FOUND)
+    if listing.user_id != user.uid:
+        return Response({"error": "User does not own this listing"}, status=status.HTTP_401_UNAUTHORIZED)
+    return listing
+
+
+@api_view(["POST"])
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([IsAuthenticated])
-def delete_listing(request, listing_id):
+def request_media_uploads(request, listing_id):
     """
-    Delete a listing and its associated media from S3
+    Presigned upload instructions for a listing's media, so the files go
+    straight from the client to S3 instead of through this server.
+    - Body: {"files": [{"filename": ..., "size": ...}, ...]}
+    - Each file gets a presigned POST, or for large files a multipart
+      upload with one presigned PUT URL per part.
+    - Call finalizeUploads with the returned keys once the uploads finish.
     """
-    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
-    token = ""
-    if auth_header.startswith("Bearer "):
-        token = auth_header.split("Bearer ")[1]
-    
+    listing = owned_listing(request, listing_id)
+    if isinstance(listing, Response):
+        return listing
+
+    serializer = RequestMediaUploadsSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    files = serializer.validated_data["files"]
+    if listing.media.count() + len(files) > MAX_FILES_PER_LISTING:
+        return Response({"error": f"A listing can have at most {MAX_FILES_PER_LISTING} media files"}, status=status.HTTP_400_BAD_REQUEST)
+
+    client = s3_client()
     try:
-        decoded_token = firebase_admin_auth.verify_id_token(token)
-        token_uid = decoded_token.get("uid")
-    except Exception:
-        return Response({"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED)
-    
+        uploads = [presign_upload(client, listing, f["filename"], f["size"]) for f in files]
+    except InvalidUpload as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"uploads": uploads}, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+@authentication_classes([FirebaseEmailVerifiedAuthentication])
+@permission_classes([IsAuthenticated])
+def finalize_media_uploads(request, listing_id):
+    """
+    Register directly uploaded files as the listing's media.
+    - Body: {"uploads": [{"key": ..., "uploadId": ..., "parts": [{"partNumber": ..., "etag": ...}]}]}
+      (uploadId and parts only for multipart uploads)
+    - Every object must exist under the listing's prefix; nothing is
+      registered unless all of them do.
+    """
+    listing = owned_listing(request, listing_id)
+    if isinstance(listing, Response):
+        return listing
+
+    serializer = FinalizeMediaUploadsSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    uploads = serializer.validated_data["uploads"]
+
+    keys = [upload["key"] for upload in uploads]
+    if len(set(keys)) != len(keys) or ListingMedia.objects.filter(listing=listing, file__in=keys).exists():
+        return Response({"error": "Uploads were already registered"}, status=status.HTTP_400_BAD_REQUEST)
+    if listing.media.count() + len(uploads) > MAX_FILES_PER_LISTING:
+        return Response({"error": f"A listing can have at most {MAX_FILES_PER_LISTING} media files"}, status=status.HTTP_400_BAD_REQUEST)
+
+    client = s3_client()
+    try:
+        keys = [finalize_upload(client, listing, upload) for upload in uploads]
+    except InvalidUpload as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    ListingMedia.objects.bulk_create([ListingMedia(listing=listing, file=key) for key in keys])
+    # bulk_create sends no post_save (and sets no ids on MySQL)
+    schedule_media_processing(ListingMedia.objects.filter(listing=listing, file__in=keys).values_list("id", flat=True))
+    return Response({"message": "Media added", "media": keys}, status=status.HTTP_201_CREATED)
+
+
+@api_view(["GET"])
+@authentication_classes([FirebaseEmailVerifiedAuthentication])
+@permission_classes([IsAuthenticated])
+def get_listing_analytics(request, listing_id):
+    """
+    Views, saves and chats started for one of the user's listings, per hour
+    or per day.
+    - `granularity` is "day" (default, last 7 days) or "hour" (last 48 hours).
+    - `since`/`until` (ISO 8601) pick another range.
+    - Returns {"granularity", "buckets": [{"start", "views", "saves", "chats"}], "totals"}.
+    """
+    listing = owned_listing(request, listing_id)
+    if isinstance(listing, Response):
+        return listing
     try:
-        user = User.objects.get(uid=token_uid)
-    except User.DoesNotExist:
+        granularity, since, until = parse_range(**analytics_params(request))
+    except InvalidAnalyticsParameter as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(listing_series(listing.id, granularity, since, until), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@authentication_classes([FirebaseEmailVerifiedAuthentication])
+@permission_classes([IsAuthenticated])
+def get_seller_analytics(request):
+    """
+    The same series as getListingAnalytics, summed over all of the user's
+    listings.
+    """
+    try:
+        granularity, since, until = parse_range(**analytics_params(request))
+    except InvalidAnalyticsParameter as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(seller_series(request.user.username, granularity, since, until), status=status.HTTP_200_OK)
+
+
+def analytics_params(request):
+    return {
+        "granularity": request.query_params.get("granularity", None),
+        "since": request.query_params.get("since", None),
+        "until": request.query_params.get("until", None),
+    }
+
+
+@api_view(["DELETE"])
+@authentication_classes([FirebaseEmailVerifiedAuthentication])
+@permission_classes([IsAuthenticated])
+def delete_listing(request, listing_id):
+    """
+    Delete a listing and queue its associated media for removal from S3
+    """
+    # The authentication class has already verified the token and loaded the user
+    user = request.user.account
+    if user is None:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
     
     try:
@@ -205,13 +358,14 @@ def delete_listing(request, listing_id):
     if listing.user != user:
         return Response({"error": "User does not own this listing"}, status=status.HTTP_401_UNAUTHORIZED)
 
-    if hasattr(listing, 'media'):
-        for media in listing.media.all():
-            media.file.delete(save=False)
-            media.delete()
-
-
-    listing.delete()
+    # The media objects are removed from S3 in the background once the
+    # rows are gone; deleting the listing cascades to its media rows
+    keys = []
+    for file, variants in listing.media.values_list("file", "variants"):
+        keys += [file, *variant_keys(variants)]
+    with transaction.atomic():
+        enqueue_deletions(keys)
+        listing.delete()
 
     return Response({"message": "Listing deleted"}, status=status.HTTP_200_OK)
 
@@ -219,20 +373,9 @@ def delete_listing(request, listing_id):
 @authentication_classes([FirebaseAuthentication])
 @permission_classes([IsAuthenticated])
 def update_listing(request, listing_id):
-    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
-    token = ""
-    if auth_header.startswith("Bearer "):
-        token = auth_header.split("Bearer ")[1]
-    
-    try:
-        decoded_token = firebase_admin_auth.verify_id_token(token)
-        token_uid = decoded_token.get("uid")
-    except Exception as e:
-        return Response({"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    try:
-        user = User.objects.get(uid=token_uid)
-    except User.DoesNotExist:
+    # The authentication class has already verified the token and loaded the user
+    user = request.user.account
+    if user is None:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
     
     try:
@@ -259,13 +402,18 @@ def save_listing(request, listing_id):
     """
     Have a user save a listing
     """
+    user = request.user.account
     try:
-        user = User.objects.get(uid=request.user)
         listing = Listing.objects.get(id=listing_id)
-    except (User.DoesNotExist, Listing.DoesNotExist):
+    except Listing.DoesNotExist:
         return Response({"error": "User or Listing not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    listing.saved_by.add(user)
+    if user is None:
+        return Response({"error": "User or Listing not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if not listing.saved_by.filter(uid=user.uid).exists():
+        listing.saved_by.add(user)
+        record_event("save", listing.id)
     return Response({"message": "Listing saved"}, status=status.HTTP_200_OK)
 
 
@@ -276,10 +424,13 @@ def unsave_listing(request, listing_id):
     """
     Have a user un save a listing
     """
+    user = request.user.account
     try:
-        user = User.objects.get(uid=request.user)
         listing = Listing.objects.get(id=listing_id)
-    except (User.DoesNotExist, Listing.DoesNotExist):
+    except Listing.DoesNotExist:
+        return Response({"error": "User or Listing not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if user is None:
         return Response({"error": "User or Listing not found"}, status=status.HTTP_404_NOT_FOUND)
 
     listing.saved_by.remove(user)
@@ -292,10 +443,12 @@ def get_saved_listings(request):
     """
     Get all saved listings for a user
     """
-    user = User.objects.get(uid=request.user)
+    user = request.user.account
     blocked_users = user.blockedUsers.all() if user else []
 
     listings = Listing.objects.filter(saved_by=user).exclude(user__in=blocked_users)
+    if wants_cards(request):
+        return Response(listing_cards(listings), status=status.HTTP_200_OK)
     serializer = ListingSerializer(listings, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -305,16 +458,22 @@ def get_saved_listings(request):
 @permission_classes([AllowAny])
 def increment_listing_view(request, listing_id):
     """
-    Increment the `views` field on the given listing and return the new count.
+    Count a view of the given listing and return its view count.
+    - Views are buffered and added to `views` by periodic bulk flushes,
+      so the count returned is the stored value plus the pending views.
+    - With LISTING_VIEW_DEDUP_WINDOW set, repeat views by the same viewer
+      within the window are not counted.
     """
     try:
-        # Use an F() expression to avoid race conditions
-        Listing.objects.filter(id=listing_id).update(views=F("views") + 1)
-        listing = Listing.objects.get(id=listing_id)
+        views = Listing.objects.values_list("views", flat=True).get(id=listing_id)
     except Listing.DoesNotExist:
         return Response({"error": "Listing not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    return Response({"views": listing.views}, status=status.HTTP_200_OK)
+    counted, pending = get_view_counter().record(listing_id, viewer_key(request))
+    get_view_flusher()
+    if counted:
+        record_event("view", listing_id)
+    return Response({"views": views + pending}, status=status.HTTP_200_OK)
 
 # @api_view(["GET"])
 # @permission_classes([AllowAny]) 
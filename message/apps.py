@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MessageConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'message'
+
+    def ready(self):
+        import message.signals  # noqa: F401
@@ -0,0 +1,144 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from server.backends import shared_backend
+
+# A worker's count is dropped this many seconds after its last heartbeat
+NODE_LEASE_TTL = getattr(settings, "CONNECTED_USERS_LEASE_TTL", 90)
+NODE_HEARTBEAT = getattr(settings, "CONNECTED_USERS_HEARTBEAT", 30)
+# Minutes of per-minute samples kept for the time series
+SERIES_RETENTION = getattr(settings, "CONNECTED_USERS_SERIES_RETENTION", 24 * 60)
+
+NODES_KEY = "connections:nodes"
+
+
+def node_id():
+    """Identifies this worker process (computed per call so forks differ)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_key(node):
+    return f"connections:lease:{node}"
+
+
+def series_key(minute):
+    return f"connections:series:{minute}"
+
+
+def current_minute(now=None):
+    return int((now if now is not None else time.time()) // 60)
+
+
+def minute_label(minute):
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc).isoformat()
+
+
+class RedisConnectionCounter:
+    """
+    Connected-users counter shared by every worker. Each worker owns one
+    field of a hash holding its full local count and is the only one
+    writing it, so concurrent connects never lose updates. A worker also
+    holds a lease key it refreshes on every write and heartbeat; when a
+    worker dies its lease expires and its count is discarded on the next
+    read instead of drifting forever. A live worker whose lease lapsed
+    (a stalled event loop) writes its full count back on the next write
+    or heartbeat rather than applying deltas to a field that is gone.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._counts = {}
+        # Held across the write so this worker's writes reach Redis in order
+        self._lock = threading.Lock()
+
+    def register(self, node, count):
+        pipe = self.client.pipeline()
+        pipe.hset(NODES_KEY, node, count)
+        pipe.set(lease_key(node), 1, ex=NODE_LEASE_TTL)
+        pipe.execute()
+
+    def incr(self, node, amount):
+        with self._lock:
+            count = self._counts[node] = self._counts.get(node, 0) + amount
+            self.register(node, count)
+
+    def heartbeat(self, node, now=None):
+        minute = current_minute(now)
+        with self._lock:
+            count = self._counts.get(node, 0)
+            self.register(node, count)
+        pipe = self.client.pipeline()
+        pipe.hset(series_key(minute), node, count)
+        pipe.expire(series_key(minute), SERIES_RETENTION * 60)
+        pipe.execute()
+
+    def snapshot(self, minutes=60, now=None):
+        nodes = {
+            (node.decode() if isinstance(node, bytes) else node): int(count)
+            for node, count in self.client.hgetall(NODES_KEY).items()
+        }
+        names = list(nodes)
+        leases = self.client.mget([lease_key(node) for node in names]) if names else []
+        dead = [node for node, lease in zip(names, leases) if lease is None]
+        if dead:
+            self.client.hdel(NODES_KEY, *dead)
+        live = {node: nodes[node] for node in names if node not in dead}
+
+        last = current_minute(now)
+        window = list(range(last - minutes + 1, last + 1))
+        pipe = self.client.pipeline()
+        for minute in window:
+            pipe.hvals(series_key(minute))
+        series = [
+            {"minute": minute_label(minute), "connected_users": sum(int(value) for value in values)}
+            for minute, values in zip(window, pipe.execute())
+        ]
+        return {"connected_users": sum(live.values()), "nodes": live, "series": series}
+
+
+class LocalConnectionCounter:
+    """The counts of RedisConnectionCounter, kept in this process."""
+
+    def __init__(self):
+        self._counts = {}
+        self._leases = {}
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incr(self, node, amount):
+        with self._lock:
+            self._counts[node] = self._counts.get(node, 0) + amount
+            self._leases[node] = time.time() + NODE_LEASE_TTL
+
+    def heartbeat(self, node, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._leases[node] = now + NODE_LEASE_TTL
+            self._series.setdefault(current_minute(now), {})[node] = self._counts.get(node, 0)
+
+    def snapshot(self, minutes=60, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            for node in [node for node, expires_at in self._leases.items() if expires_at <= now]:
+                self._leases.pop(node)
+            live = {node: self._counts.get(node, 0) for node in self._leases}
+            last = current_minute(now)
+            series = [
+                {"minute": minute_label(minute), "connected_users": sum(self._series.get(minute, {}).values())}
+                for minute in range(last - minutes + 1, last + 1)
+            ]
+        return {"connected_users": sum(live.values()), "nodes": live, "series": series}
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._leases.clear()
+            self._series.clear()
+
+
+get_connection_counter = shared_backend(RedisConnectionCounter, LocalConnectionCounter)
@@ -1,15 +1,71 @@
+import asyncio
 import json
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from django.core.cache import cache
+from channels.db import database_sync_to_async
 
-from message.models import Message, Room
-from user.models import User
-from datetime import datetime
+from django.utils import timezone
 
-ACTIVE_USERS = {}
+from message.connection_stats import NODE_HEARTBEAT, get_connection_counter, node_id
+from message.ephemeral import MAX_WATCHED_USERS, TYPING_REFRESH, RateLimiter, get_ephemeral_coalescer, presence_group
+from message.ids import get_mid_allocator
+from message.models import Room, RoomMembership
+from message.notifications import get_notification_dispatcher
+from message.persistence import get_message_writer
+from message.presence import ONLINE_KEY, PRESENCE_HEARTBEAT, get_presence, online_users, room_key
+from message.protocol import (
+    PROTOCOL_VERSION, ConnectionOptions, ProtocolError, chat_contents, chat_frames, decode_frame, drop_messages, encode
+)
+from message.replay import amissed_messages, get_replay_buffer
+from message.unread import READ_FLUSH_INTERVAL, amark_read, apublish_read
 
-class GlobalNotificationConsumer(AsyncWebsocketConsumer):
+logger = logging.getLogger(__name__)
+
+
+class PresenceMixin:
+    """
+    Registers this socket (by its channel name) under a presence key for as
+    long as it is open, refreshing it on a heartbeat so the entry expires by
+    itself if this worker dies. The user stays present while any of their
+    sockets is.
+    """
+    presence_key = None
+    presence_task = None
+
+    async def start_presence(self, key):
+        self.presence_key = key
+        await self.touch_presence()
+        self.presence_task = asyncio.create_task(self.presence_heartbeat())
+
+    async def stop_presence(self):
+        """Unregister this socket. Returns True if it was the user's last one under the key."""
+        if self.presence_task is not None:
+            self.presence_task.cancel()
+            self.presence_task = None
+        if self.presence_key is None:
+            return False
+        left = await sync_to_async(get_presence().leave, thread_sensitive=False)(
+            self.presence_key, self.user.username, self.channel_name
+        )
+        self.presence_key = None
+        return left
+
+    async def touch_presence(self):
+        await sync_to_async(get_presence().touch, thread_sensitive=False)(
+            self.presence_key, self.user.username, self.channel_name
+        )
+
+    async def presence_heartbeat(self):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT)
+            try:
+                await self.touch_presence()
+            except Exception as e:
+                logger.debug("Presence heartbeat failed for %s: %s", self.user.username, e)
+
+class GlobalNotificationConsumer(PresenceMixin, AsyncWebsocketConsumer):
     async def connect(self):
         """User connects to receive notifications from all chat rooms."""
 
@@ -27,33 +83,116 @@ class GlobalNotificationConsumer(AsyncWebsocketConsumer):
         await self.channel_layer.group_add(self.user_group_name, self.channel_name)
         await self.accept()
 
+        await self.start_presence(ONLINE_KEY)
         await self.increment_connected_users()
 
+        self.watched = set()
+        self.rate_limiter = RateLimiter()
+        get_ephemeral_coalescer().publish(
+            presence_group(self.user.username), ("online", self.user.username),
+            {"type": "online", "uid": self.user.username, "online": True}
+        )
+
     async def disconnect(self, close_code):
         """User disconnects from notification WebSocket."""
+        if not hasattr(self, "user_group_name"):
+            return
 
+        offline = await self.stop_presence()
         await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+        for uid in self.watched:
+            await self.channel_layer.group_discard(presence_group(uid), self.channel_name)
         await self.decrement_connected_users()
+        # Another tab or device may still be connected
+        if offline:
+            get_ephemeral_coalescer().publish(
+                presence_group(self.user.username), ("online", self.user.username),
+                {"type": "online", "uid": self.user.username, "online": False}
+            )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        {"type": "watch", "uids": [...]} subscribes this socket to those
+        users' online/offline events and answers with their current state.
+        """
+        if not self.rate_limiter.allow():
+            return
+        try:
+            data = decode_frame(text_data, bytes_data)
+        except ProtocolError:
+            return
+        uids = data.get("uids")
+        if data.get("type") != "watch" or not isinstance(uids, list):
+            return
+
+        requested = list(dict.fromkeys(uid for uid in uids if isinstance(uid, str)))[:MAX_WATCHED_USERS]
+        # Only people this user chats with, so a socket cannot probe anyone's online state
+        uids = await database_sync_to_async(self.contacts_among)(requested)
+        for uid in self.watched - uids:
+            await self.channel_layer.group_discard(presence_group(uid), self.channel_name)
+        for uid in uids - self.watched:
+            await self.channel_layer.group_add(presence_group(uid), self.channel_name)
+        self.watched = uids
+
+        online = await sync_to_async(online_users, thread_sensitive=False)(uids)
+        await self.send(text_data=json.dumps({"type": "online", "users": {uid: uid in online for uid in sorted(uids)}}))
+
+    def contacts_among(self, uids):
+        """The users in `uids` who share a room with this user."""
+        if not uids:
+            return set()
+        return set(RoomMembership.objects.filter(
+            room__memberships__user_id=self.user.username, user_id__in=uids
+        ).values_list("user_id", flat=True))
+
+    async def ephemeral_event(self, event):
+        await self.send(text_data=json.dumps(event["payload"]))
 
     async def send_notification(self, event):
         """Send notification event to the client."""
         print(f"Sending notification to {self.user.username}: {event}")
-        await self.send(text_data=json.dumps({"sender": event["sender"], "message": event["message"], "room": event["room"]}))
+        await self.send(text_data=json.dumps({
+            "sender": event["sender"], "message": event["message"], "room": event["room"], "count": event.get("count", 1)
+        }))
+
+    async def unread_update(self, event):
+        """Send a room's new unread count to the client."""
+        await self.send(text_data=json.dumps({"type": "unread", "room": event["room"], "unreadCount": event["unreadCount"]}))
 
     async def increment_connected_users(self):
-        """Increment the connected users count in Redis."""
-        connected_users = cache.get("connected_users", 0)
-        print(f"Connected users before increment: {connected_users}")
-        cache.set("connected_users", connected_users + 1, timeout=None)
+        """Atomically count this connection against this worker in Redis."""
+        await sync_to_async(get_connection_counter().incr, thread_sensitive=False)(node_id(), 1)
+        ensure_node_heartbeat()
 
     async def decrement_connected_users(self):
-        """Decrement the connected users count in Redis."""
-        connected_users = cache.get("connected_users", 0)
-        print(f"Connected users before decrement: {connected_users}")
-        if connected_users > 0:
-            cache.set("connected_users", connected_users - 1, timeout=None)
+        """Atomically release this connection's count in Redis."""
+        await sync_to_async(get_connection_counter().incr, thread_sensitive=False)(node_id(), -1)
+
+
+_node_heartbeat_task = None
+
+
+def ensure_node_heartbeat():
+    """
+    Start (once per worker event loop) the task that keeps this worker's
+    connected-users lease alive and records its per-minute sample.
+    """
+    global _node_heartbeat_task
+    loop = asyncio.get_running_loop()
+    if _node_heartbeat_task is not None and not _node_heartbeat_task.done() and _node_heartbeat_task.get_loop() is loop:
+        return
+    _node_heartbeat_task = loop.create_task(node_heartbeat())
+
+
+async def node_heartbeat():
+    while True:
+        try:
+            await sync_to_async(get_connection_counter().heartbeat, thread_sensitive=False)(node_id())
+        except Exception as e:
+            logger.debug("Connected users heartbeat failed: %s", e)
+        await asyncio.sleep(NODE_HEARTBEAT)
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(PresenceMixin, AsyncWebsocketConsumer):
     async def connect(self):
         if self.scope["user"].is_anonymous:
             await self.close()
@@ -64,107 +203,237 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.user = self.scope["user"]
 
         # Check if user is part of the room
-        room, seller_uid, buyer_uid = await self.get_room(self.room_name)
+        room = await self.get_room(self.room_name)
         if room is None:
             print(f"Room {self.room_name} does not exist")
             await self.close()
             return
 
-        if self.user.username not in [seller_uid, buyer_uid]:
+        if self.user.username not in (room["seller_id"], room["buyer_id"]):
             print(f"User {self.user.username} is not part of room {self.room_name}")
             await self.close()
             return
 
         print(f"User {self.user.username} connected to room {self.room_name}")
 
-        if self.room_name not in ACTIVE_USERS:
-            ACTIVE_USERS[self.room_name] = set()
-        ACTIVE_USERS[self.room_name].add(self.user.username)
+        # Kept for the life of the connection so messages are written and
+        # notified by id without looking the room or sender up again.
+        self.room_id = room["rid"]
+        self.sender_uid = self.user.username
+        self.participants = [room["seller_id"], room["buyer_id"]]
+        self.room_title = room["listing__title"]
+        if self.sender_uid == room["seller_id"]:
+            self.sender_name = room["seller__displayName"]
+        else:
+            self.sender_name = room["buyer__displayName"]
+        self.options = ConnectionOptions(self.scope.get("query_string", b""))
+
+        self.replayed_mids = set()
+        self.rate_limiter = RateLimiter()
+        self.typing_state = False
+        self.typing_sent_at = 0
+        self.read_mid = 0
+        self.pending_read_mid = None
+        self.read_task = None
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
+        await self.start_presence(room_key(self.room_name))
+        self.publish_ephemeral("presence", {"type": "presence", "uid": self.sender_uid, "present": True})
+        if self.options.last_seen_mid is not None:
+            await self.replay_missed(self.options.last_seen_mid)
 
     async def disconnect(self, close_code):
-        from .consumers import ACTIVE_USERS  # Get active users
-        if self.room_name in ACTIVE_USERS:
-            print(f"User {self.user.username} disconnected from room {self.room_name}")
-            ACTIVE_USERS[self.room_name].discard(self.user.username)
-            if not ACTIVE_USERS[self.room_name]:  # If room is empty, remove it
-                del ACTIVE_USERS[self.room_name]
+        if self.presence_key is None:
+            return
+        print(f"User {self.user.username} disconnected from room {self.room_name}")
+        await self.flush_reads(final=True)
+        # The client cannot send typing=false any more
+        if self.typing_state:
+            self.typing_state = False
+            self.publish_ephemeral("typing", {"type": "typing", "uid": self.sender_uid, "typing": False})
+        if await self.stop_presence():
+            self.publish_ephemeral("presence", {"type": "presence", "uid": self.sender_uid, "present": False})
 
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data["message"]
-        sender = data["sender"]
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = decode_frame(text_data, bytes_data)
+            if data.get("type") == "read":
+                await self.read_up_to(data.get("mid"))
+                return
+            if data.get("type") == "typing":
+                self.set_typing(bool(data.get("typing")))
+                return
+            contents = chat_contents(data)
+        except ProtocolError as e:
+            await self.send_error(str(e))
+            return
+
+        current_time = timezone.now()
+        # A Redis call; the database is only read when the counter is reseeded
+        mids = await sync_to_async(get_mid_allocator().allocate, thread_sensitive=False)(len(contents))
+        # Queued for the batched writer; this waits only when the writer is
+        # backed up, which slows this socket down instead of buffering forever.
+        writer = get_message_writer()
+        persisted = [
+            await writer.write(mid, self.room_id, self.sender_uid, content, current_time)
+            for mid, content in zip(mids, contents)
+        ]
+
+        # Nothing is broadcast until its batch has committed: the writer's
+        # queue is in memory, so a message shown before then could be lost
+        # with this worker. The sender's own copy coming back is its ack.
+        results = await asyncio.gather(*persisted, return_exceptions=True)
+        failed = [mid for mid, result in zip(mids, results) if isinstance(result, Exception)]
+        if failed:
+            print(f"Messages {failed} from {self.sender_uid} in room {self.room_name} were not saved")
+            await self.send_error("Message could not be saved", mids=failed)
 
-        current_time = datetime.now()
-        await self.save_message(self.room_name, self.scope["user"].username, message, current_time)
+        messages = [
+            {"mid": mid, "room": self.room_id, "sender": self.sender_uid, "senderName": self.sender_name,
+             "content": content, "timeSent": current_time}
+            for mid, content, result in zip(mids, contents, results) if not isinstance(result, Exception)
+        ]
+        if not messages:
+            return
+        await sync_to_async(get_replay_buffer().append, thread_sensitive=False)(self.room_id, messages)
 
+        # Encoded once here for every wire format; each recipient socket
+        # only picks its own frames.
         await self.channel_layer.group_send(
-            self.room_group_name, {"type": "chat_message", "message": message, "sender": sender, "timeSent": current_time}
+            self.room_group_name,
+            {"type": "chat_message", "mids": [message["mid"] for message in messages], "frames": chat_frames(messages)}
         )
 
-        await self.notify_users(sender, message, self.room_name)
+        for message in messages:
+            await self.notify_users(self.sender_name, message["content"], self.room_name)
 
     async def notify_users(self, sender, message, room_name):
-        from .consumers import ACTIVE_USERS  # Get active users
-        from channels.layers import get_channel_layer
-
-        channel_layer = get_channel_layer()
-
-        chat_room_users, room_title = await self.get_users_and_title(room_name)
-        print(f"Chat room users: {chat_room_users}, Room title: {room_title}")
-        print(f"Active users in room {room_name}: {ACTIVE_USERS.get(room_name, set())}")
-
-        for user in chat_room_users:
-            if user not in ACTIVE_USERS.get(room_name, set()):  # If user is NOT in chat
-                print(f"User {user} is not in chat, sending notification")
-                await channel_layer.group_send(
-                    f"user_notifications_{user}",
-                    {
-                        "type": "send_notification",
-                        "sender": sender,
-                        "message": message,
-                        "room": room_title,
-                    },
-                )
-    
-    async def chat_message(self, event):
-        await self.send(
-            text_data=json.dumps({
-                "message": event["message"], 
-                "sender": event["sender"],
-                "timeSent": event["timeSent"].strftime("%Y-%m-%d %H:%M:%S")
-            })
+        # One round trip for every participant, across all worker processes
+        active_users = await sync_to_async(get_presence().present_among, thread_sensitive=False)(
+            room_key(room_name), self.participants
         )
+        absent_users = [user for user in self.participants if user not in active_users]
 
-    @sync_to_async
-    def get_users_and_title(self, rid):
-        try:
-            room = Room.objects.get(rid=rid)
-            users = [room.seller.uid, room.buyer.uid]
-            title = room.listing.title
-            return users, title
-        except Room.DoesNotExist:
-            return None, None
-
-    @sync_to_async
-    def get_room(self, rid):
-        try:
-            room = Room.objects.get(rid=rid)
-            return room, room.seller.uid, room.buyer.uid
-        except Room.DoesNotExist:
+        # Bursts to the same user are merged and sent once the window closes
+        get_notification_dispatcher().notify(absent_users, self.room_id, self.room_title, sender, message)
+
+    async def chat_message(self, event):
+        mids = event["mids"]
+        frames = event["frames"][self.options.frame_key]
+        # Messages already sent as part of the replay on connect. Broadcasts
+        # can arrive out of order, so this goes by id, not by the highest id.
+        replayed = self.replayed_mids.intersection(mids)
+        if replayed:
+            # Each message is broadcast once
+            self.replayed_mids -= replayed
+            if len(replayed) == len(mids):
+                return
+            frames = drop_messages(frames, mids, replayed)
+        await self.send_frames(frames)
+
+    async def replay_missed(self, last_seen_mid):
+        """Send the client what it missed while disconnected."""
+        messages, complete = await amissed_messages(self.room_id, last_seen_mid)
+        self.replayed_mids = {message["mid"] for message in messages}
+        if messages or not complete:
+            key = self.options.frame_key
+            await self.send_frames(chat_frames(messages, formats=(key,), replay=True, complete=complete)[key])
+
+    async def send_frames(self, frames):
+        if self.options.version == 1:
+            for frame in frames:
+                await self.send(text_data=frame)
+        elif self.options.binary:
+            await self.send(bytes_data=frames)
+        else:
+            await self.send(text_data=frames)
+
+    async def send_payload(self, payload):
+        """Send a control frame (read receipt, error) in this connection's protocol."""
+        if self.options.version == 1:
+            await self.send(text_data=encode(payload))
+        elif self.options.binary:
+            await self.send(bytes_data=encode({"v": PROTOCOL_VERSION, **payload}, binary=True))
+        else:
+            await self.send(text_data=encode({"v": PROTOCOL_VERSION, **payload}))
+
+    async def send_error(self, error, **details):
+        if self.options.version == 1:
+            await self.send_payload({"error": error, **details})
+        else:
+            await self.send_payload({"type": "error", "error": error, **details})
+
+    async def read_up_to(self, mid):
+        """
+        Read receipt from the client: it has shown messages up to `mid`. The
+        first one is applied right away; those arriving within
+        READ_FLUSH_INTERVAL of it are merged into one update to the highest
+        mid, so a client sending a frame per message costs one write per
+        interval.
+        """
+        if not isinstance(mid, int) or mid <= max(self.read_mid, self.pending_read_mid or 0):
+            return
+        self.pending_read_mid = mid
+        if self.read_task is None or self.read_task.done():
+            self.read_task = asyncio.create_task(self.flush_reads())
+
+    async def flush_reads(self, final=False):
+        """Apply the pending read receipt, then wait out the interval for more."""
+        if final and self.read_task is not None:
+            self.read_task.cancel()
+            self.read_task = None
+        while self.pending_read_mid is not None:
+            mid, self.pending_read_mid = self.pending_read_mid, None
+            try:
+                count = await amark_read(self.room_id, self.sender_uid, mid)
+                if count is not None:
+                    self.read_mid = mid
+                    await apublish_read(self.room_id, self.sender_uid, mid, count)
+            except Exception as e:
+                print(f"Read receipt from {self.sender_uid} in room {self.room_name} failed: {e}")
+            if final:
+                return
+            await asyncio.sleep(READ_FLUSH_INTERVAL)
+
+    def set_typing(self, typing):
+        """
+        Typing indicator from the client. Never stored; unchanged states are
+        dropped unless due for a refresh, and each connection is rate-limited.
+        """
+        now = time.monotonic()
+        if typing == self.typing_state and now - self.typing_sent_at < TYPING_REFRESH:
+            return
+        if not self.rate_limiter.allow():
+            return
+        self.typing_state = typing
+        self.typing_sent_at = now
+        self.publish_ephemeral("typing", {"type": "typing", "uid": self.sender_uid, "typing": typing})
+
+    def publish_ephemeral(self, kind, payload):
+        get_ephemeral_coalescer().publish(self.room_group_name, (kind, self.sender_uid), payload)
+
+    async def ephemeral_event(self, event):
+        # Version 1 clients only understand chat frames
+        payload = event["payload"]
+        if self.options.version == 1 or payload["uid"] == self.sender_uid:
+            return
+        await self.send_payload(payload)
+
+    async def read_receipt(self, event):
+        await self.send_payload({"type": "read", "uid": event["uid"], "mid": event["mid"]})
+
+    async def get_room(self, rid):
+        """
+        Everything the connection needs about the room, or None: the
+        participants that authorize it, plus the listing title and names
+        used in notifications. Loaded once on connect, so sending messages
+        never goes back to the database from the socket.
+        """
+        if not str(rid).isdigit():
             return None
-        
-    @sync_to_async
-    def save_message(self, rid, sender_uid, message, timeSent):
-        try:
-            room = Room.objects.get(rid=rid)
-            sender = User.objects.get(uid=sender_uid)
-            message = Message.objects.create(sender=sender, content=message, room=room, timeSent=timeSent)
-            message.save()
-        except (Room.DoesNotExist, User.DoesNotExist):
-            raise Exception("Room or user not found")
-    
\ No newline at end of file
+        return await Room.objects.filter(rid=rid).values(
+            "rid", "seller_id", "buyer_id", "listing__title", "seller__displayName", "buyer__displayName"
+        ).afirst()
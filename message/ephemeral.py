@@ -0,0 +1,92 @@
+import asyncio
+import time
+import weakref
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+# Ephemeral events (typing, presence) only ever go through the channel
+# layer: nothing here reads or writes the database.
+
+# Per connection: a burst of this many events, refilled at this rate
+EPHEMERAL_BURST = getattr(settings, "CHAT_EPHEMERAL_BURST", 10)
+EPHEMERAL_RATE = getattr(settings, "CHAT_EPHEMERAL_RATE", 2.0)
+# Events for the same subject within this window are merged, last one wins
+EPHEMERAL_WINDOW = getattr(settings, "CHAT_EPHEMERAL_WINDOW", 0.3)
+# An unchanged typing state is re-sent at most this often
+TYPING_REFRESH = getattr(settings, "CHAT_TYPING_REFRESH", 3.0)
+# Users a notification socket may watch for online/offline events
+MAX_WATCHED_USERS = getattr(settings, "CHAT_MAX_WATCHED_USERS", 100)
+
+
+def presence_group(uid):
+    """Group of the notification sockets watching `uid` come and go."""
+    return f"presence_{uid}"
+
+
+def ephemeral_event(payload):
+    return {"type": "ephemeral_event", "payload": payload}
+
+
+class RateLimiter:
+    """Token bucket; one per connection."""
+
+    def __init__(self, burst=EPHEMERAL_BURST, rate=EPHEMERAL_RATE):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class EphemeralCoalescer:
+    """
+    Merges ephemeral events per (group, subject): only the latest event for
+    a subject queued during a window is sent, so a user toggling typing or
+    flapping their connection costs one broadcast per window.
+    """
+
+    def __init__(self, window=EPHEMERAL_WINDOW):
+        self.window = window
+        self.pending = {}
+        self.task = None
+
+    def publish(self, group, subject, payload):
+        self.pending[(group, subject)] = payload
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        channel_layer = get_channel_layer()
+        results = await asyncio.gather(*(
+            channel_layer.group_send(group, ephemeral_event(payload))
+            for (group, _), payload in pending.items()
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Sending ephemeral event failed: {result}")
+
+
+_coalescers = weakref.WeakKeyDictionary()
+
+
+def get_ephemeral_coalescer():
+    """The coalescer for the running event loop (one per worker process)."""
+    loop = asyncio.get_running_loop()
+    coalescer = _coalescers.get(loop)
+    if coalescer is None:
+        coalescer = _coalescers[loop] = EphemeralCoalescer()
+    return coalescer
@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from message.models import Message
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Seconds within which a message sent earlier may still be waiting in a
+# worker's batched writer queue; comfortably above its flush and retry time
+SINCE_SETTLE_WINDOW = getattr(settings, "CHAT_HISTORY_SETTLE_WINDOW", 5)
+
+
+class InvalidHistoryParameter(ValueError):
+    pass
+
+
+def parse_mid(value, name):
+    try:
+        mid = int(value)
+    except (TypeError, ValueError):
+        raise InvalidHistoryParameter(f"Invalid {name} cursor.")
+    if mid < 1:
+        raise InvalidHistoryParameter(f"Invalid {name} cursor.")
+    return mid
+
+
+def parse_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidHistoryParameter("Invalid limit.")
+    if limit < 1:
+        raise InvalidHistoryParameter("Invalid limit.")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def room_messages(room):
+    """
+    Messages of a room in chronological (timeSent, mid) order, with the
+    sender joined in so serializing a page does not query per row.
+    """
+    return Message.objects.filter(room=room).select_related("sender").order_by("timeSent", "mid")
+
+
+def cursor_position(room, mid):
+    """The (timeSent, mid) position of a cursor message in this room."""
+    time_sent = Message.objects.filter(room=room, mid=mid).values_list("timeSent", flat=True).first()
+    if time_sent is None:
+        raise InvalidHistoryParameter("Cursor message not found in this room.")
+    return time_sent, mid
+
+
+def messages_before(room, before=None, limit=None):
+    """
+    One page of history, newest first: the `limit` latest messages, or the
+    `limit` latest ones older than the message `before`. Returns the page
+    and whether older messages remain.
+    """
+    limit = parse_limit(limit)
+    messages = room_messages(room).reverse()
+    if before is not None:
+        time_sent, mid = cursor_position(room, parse_mid(before, "before"))
+        messages = messages.filter(Q(timeSent__lt=time_sent) | Q(timeSent=time_sent, mid__lt=mid))
+    page = list(messages[:limit + 1])
+    return page[:limit], len(page) > limit
+
+
+def messages_since(room, since, limit=None):
+    """
+    The messages after the message `since` in allocation (mid) order,
+    oldest first, so a client reconnecting only fetches what it missed.
+    Returns the page, whether more newer messages remain, and the cursor to
+    pass as the next `since`.
+
+    Messages are written behind, so a message with a lower mid can commit
+    after one with a higher mid. The returned cursor therefore only moves
+    past messages older than SINCE_SETTLE_WINDOW; the ones after it are
+    sent again on the next call and clients de-duplicate them by mid.
+    """
+    limit = parse_limit(limit)
+    since = parse_mid(since, "since")
+    cursor_position(room, since)
+    messages = Message.objects.filter(room=room, mid__gt=since).select_related("sender").order_by("mid")
+    page = list(messages[:limit + 1])
+    page, has_more = page[:limit], len(page) > limit
+
+    settled = timezone.now() - timedelta(seconds=SINCE_SETTLE_WINDOW)
+    next_since = since
+    for message in page:
+        if message.timeSent > settled:
+            break
+        next_since = message.mid
+    return page, has_more, next_since
+
+
+def serialize_message(message):
+    return {
+        "mid": message.mid,
+        "sender": message.sender.displayName,
+        "content": message.content,
+        "timeSent": message.timeSent,
+    }
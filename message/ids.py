@@ -0,0 +1,80 @@
+import threading
+
+from django.conf import settings
+from django.db.models import Max
+
+from message.models import Message
+from server.backends import shared_backend
+
+MID_KEY = "message:mid"
+# Redis URL for the counter, for a server (or db) running with
+# maxmemory-policy noeviction. Unset, the counter shares the default cache's
+# Redis, where it can be evicted and is then reseeded.
+MID_REDIS_URL = getattr(settings, "CHAT_MID_REDIS_URL", None)
+# A reseeded counter skips this many ids past the highest stored mid: ids
+# handed out before the counter was lost may still be queued in the writers
+# (up to CHAT_WRITE_MAX_PENDING per worker), so the margin must exceed that
+# in-flight window across all workers.
+MID_RESEED_MARGIN = getattr(settings, "CHAT_MID_RESEED_MARGIN", 100000)
+
+# INCRBY the counter, seeding it first if it is missing (new or flushed Redis)
+ALLOCATE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if ARGV[2] == '' then
+        return false
+    end
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+
+def highest_mid():
+    return Message.objects.aggregate(highest=Max("mid"))["highest"] or 0
+
+
+class RedisMidAllocator:
+    """
+    Hands out message ids before the messages are written, so a broadcast
+    can carry the id even though the row is inserted later by the batched
+    writer. The counter lives in Redis and is shared by every worker. When
+    it is missing (new, flushed or evicted Redis) it is seeded from the
+    highest stored mid plus `reseed_margin`, so it cannot go back over ids
+    that were allocated but not written yet.
+    """
+
+    def __init__(self, client, reseed_margin=MID_RESEED_MARGIN):
+        self.client = client
+        self.reseed_margin = reseed_margin
+        self.allocate_script = client.register_script(ALLOCATE)
+
+    def allocate(self, count=1):
+        last = self.allocate_script(keys=[MID_KEY], args=[count, ""])
+        if last is None:
+            seed = highest_mid() + self.reseed_margin
+            last = self.allocate_script(keys=[MID_KEY], args=[count, seed])
+        last = int(last)
+        return list(range(last - count + 1, last + 1))
+
+
+class LocalMidAllocator:
+    """
+    The counter of RedisMidAllocator, kept in this process. The highest
+    stored mid is read once, on the first allocation; after that ids come
+    from memory.
+    """
+
+    def __init__(self):
+        self._last = None
+        self._lock = threading.Lock()
+
+    def allocate(self, count=1):
+        with self._lock:
+            if self._last is None:
+                self._last = highest_mid()
+            first = self._last + 1
+            self._last += count
+        return list(range(first, first + count))
+
+
+get_mid_allocator = shared_backend(RedisMidAllocator, LocalMidAllocator, redis_url=MID_REDIS_URL)
@@ -0,0 +1,101 @@
+import base64
+import json
+
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils.dateparse import parse_datetime
+
+from message.models import Message, RoomMembership
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidInboxParameter(ValueError):
+    pass
+
+
+def parse_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidInboxParameter("Invalid limit.")
+    if limit < 1:
+        raise InvalidInboxParameter("Invalid limit.")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(entry):
+    payload = json.dumps({"v": entry["timeSent"].isoformat(), "id": entry["rid"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value, rid = parse_datetime(payload["v"]), int(payload["id"])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidInboxParameter("Invalid cursor.")
+    if value is None:
+        raise InvalidInboxParameter("Invalid cursor.")
+    return value, rid
+
+
+def inbox_entries(user):
+    """
+    The user's rooms that have messages, most recent first, as dicts with
+    the room, listing and latest message fields plus the unread count. The
+    whole inbox page is one query: the latest message is a correlated
+    subquery evaluated only for the rows returned.
+    """
+    latest = Message.objects.filter(room=OuterRef("room_id")).order_by("-timeSent", "-mid")
+    return (
+        RoomMembership.objects.filter(user=user, lastMessageAt__isnull=False)
+        .order_by("-lastMessageAt", "-room_id")
+        .values(
+            "unreadCount",
+            rid=F("room_id"),
+            seller=F("room__seller__displayName"),
+            buyer=F("room__buyer__displayName"),
+            sellerId=F("room__seller_id"),
+            buyerId=F("room__buyer_id"),
+            listingName=F("room__listing__title"),
+            listingId=F("room__listing_id"),
+            recentMessage=Subquery(latest.values("content")[:1]),
+            timeSent=F("lastMessageAt"),
+        )
+    )
+
+
+def inbox_page(user, cursor=None, limit=None):
+    """
+    One keyset-paginated page of the inbox and the cursor for the next page
+    (None on the last page).
+    """
+    limit = parse_limit(limit)
+    entries = inbox_entries(user)
+    if cursor:
+        time_sent, rid = decode_cursor(cursor)
+        entries = entries.filter(Q(lastMessageAt__lt=time_sent) | Q(lastMessageAt=time_sent, room_id__lt=rid))
+    page = list(entries[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1])
+    return page, next_cursor
+
+
+def record_latest_messages(messages):
+    """
+    Move each room's inbox entries forward to the newest of `messages`.
+    Called by the message writer after every batch insert.
+    """
+    latest = {}
+    for message in messages:
+        if message.room_id not in latest or message.timeSent > latest[message.room_id]:
+            latest[message.room_id] = message.timeSent
+    for room_id, time_sent in latest.items():
+        RoomMembership.objects.filter(
+            Q(lastMessageAt__isnull=True) | Q(lastMessageAt__lt=time_sent), room_id=room_id
+        ).update(lastMessageAt=time_sent)
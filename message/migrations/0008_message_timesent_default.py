@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0007_remove_message_recipient'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='timeSent',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
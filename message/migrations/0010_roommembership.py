@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def create_memberships(apps, schema_editor):
+    Room = apps.get_model('message', 'Room')
+    RoomMembership = apps.get_model('message', 'RoomMembership')
+    # Existing history counts as read; new messages start the unread counts
+    for room in Room.objects.annotate(last_mid=Max('message__mid'), last_at=Max('message__timeSent')).iterator():
+        RoomMembership.objects.bulk_create([
+            RoomMembership(room_id=room.rid, user_id=uid, lastReadMid=room.last_mid or 0, lastMessageAt=room.last_at)
+            for uid in {room.seller_id, room.buyer_id}
+        ])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0009_message_room_time_idx'),
+        ('user', '0011_merge_20261018_0119'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lastReadMid', models.IntegerField(default=0)),
+                ('lastMessageAt', models.DateTimeField(blank=True, null=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='message.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_memberships', to='user.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'lastMessageAt', 'room'], name='room_membership_inbox_idx')],
+                'unique_together': {('room', 'user')},
+            },
+        ),
+        migrations.RunPython(create_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:40
+
+from django.db import migrations, models
+
+
+def count_unread(apps, schema_editor):
+    Message = apps.get_model('message', 'Message')
+    RoomMembership = apps.get_model('message', 'RoomMembership')
+    for membership in RoomMembership.objects.iterator():
+        unread = (
+            Message.objects.filter(room_id=membership.room_id, mid__gt=membership.lastReadMid)
+            .exclude(sender_id=membership.user_id)
+            .count()
+        )
+        if unread:
+            RoomMembership.objects.filter(pk=membership.pk).update(unreadCount=unread)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0010_roommembership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommembership',
+            name='unreadCount',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,18 @@
 from django.db import models
+from django.utils import timezone
 
 class Message(models.Model):
     mid = models.AutoField(primary_key=True)
     sender = models.ForeignKey('user.User', on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
-    timeSent = models.DateTimeField(auto_now_add=True)
+    # Set when the server receives the message, not when its batch is written
+    timeSent = models.DateTimeField(default=timezone.now)
     room = models.ForeignKey('Room', on_delete=models.CASCADE)
+    class Meta:
+        indexes = [
+            # Room history and latest-message lookups in (timeSent, mid) order
+            models.Index(fields=['room', 'timeSent', 'mid'], name='message_room_time_idx'),
+        ]
 
 class Room(models.Model):
     rid = models.AutoField(primary_key=True)
@@ -13,4 +20,23 @@ class Room(models.Model):
     buyer = models.ForeignKey('user.User', on_delete=models.CASCADE, related_name='buyer_room')
     listing = models.ForeignKey('listing.Listing', on_delete=models.CASCADE)
     class Meta:
-        unique_together = ('seller', 'buyer', 'listing')
\ No newline at end of file
+        unique_together = ('seller', 'buyer', 'listing')
+
+class RoomMembership(models.Model):
+    """
+    One row per participant of a room: the user's inbox entry and read cursor.
+    `lastMessageAt` mirrors the room's latest message so the inbox is read
+    straight off the (user, lastMessageAt) index.
+    """
+    room = models.ForeignKey('Room', on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey('user.User', on_delete=models.CASCADE, related_name='room_memberships')
+    lastReadMid = models.IntegerField(default=0)
+    # Messages from the other participant after lastReadMid, kept up to date
+    # as messages are saved instead of being counted on read
+    unreadCount = models.IntegerField(default=0)
+    lastMessageAt = models.DateTimeField(null=True, blank=True)
+    class Meta:
+        unique_together = ('room', 'user')
+        indexes = [
+            models.Index(fields=['user', 'lastMessageAt', 'room'], name='room_membership_inbox_idx'),
+        ]
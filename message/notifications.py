@@ -0,0 +1,71 @@
+import asyncio
+import weakref
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+# Seconds during which notifications to the same user about the same room
+# are merged into one
+NOTIFICATION_WINDOW = getattr(settings, "CHAT_NOTIFICATION_WINDOW", 1.0)
+
+
+def notification_event(sender, message, room, count):
+    """
+    Channel layer event for a user's notification socket. A burst of
+    several messages becomes one "N new messages from X" notification.
+    """
+    text = message if count == 1 else f"{count} new messages from {sender}"
+    return {"type": "send_notification", "sender": sender, "message": text, "room": room, "count": count}
+
+
+class NotificationDispatcher:
+    """
+    Coalesces chat notifications per (recipient, room). The first
+    notification opens a window; everything queued until it closes is sent
+    as one event per recipient and room, all dispatched to the channel
+    layer together.
+    """
+
+    def __init__(self, window=NOTIFICATION_WINDOW):
+        self.window = window
+        self.pending = {}
+        self.task = None
+
+    def notify(self, recipients, room_id, room_title, sender, message):
+        for uid in recipients:
+            entry = self.pending.get((uid, room_id))
+            if entry is None:
+                self.pending[(uid, room_id)] = {"sender": sender, "message": message, "room": room_title, "count": 1}
+            else:
+                entry.update(sender=sender, message=message, count=entry["count"] + 1)
+        if self.pending and (self.task is None or self.task.done()):
+            self.task = asyncio.get_running_loop().create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        channel_layer = get_channel_layer()
+        results = await asyncio.gather(*(
+            channel_layer.group_send(f"user_notifications_{uid}", notification_event(**entry))
+            for (uid, _), entry in pending.items()
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Sending notification failed: {result}")
+
+
+_dispatchers = weakref.WeakKeyDictionary()
+
+
+def get_notification_dispatcher():
+    """The dispatcher for the running event loop (one per worker process)."""
+    loop = asyncio.get_running_loop()
+    dispatcher = _dispatchers.get(loop)
+    if dispatcher is None:
+        dispatcher = _dispatchers[loop] = NotificationDispatcher()
+    return dispatcher
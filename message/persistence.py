@@ -0,0 +1,137 @@
+import asyncio
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from message.inbox import record_latest_messages
+from message.models import Message
+from message.unread import apublish_unread, count_new_messages
+
+# Flush when this many messages are pending...
+WRITE_BATCH_SIZE = getattr(settings, "CHAT_WRITE_BATCH_SIZE", 100)
+# ...or when the oldest pending message has waited this many seconds.
+WRITE_FLUSH_INTERVAL = getattr(settings, "CHAT_WRITE_FLUSH_INTERVAL", 0.05)
+# Senders wait for room in the queue once this many messages are unflushed.
+WRITE_MAX_PENDING = getattr(settings, "CHAT_WRITE_MAX_PENDING", 1000)
+WRITE_MAX_RETRIES = getattr(settings, "CHAT_WRITE_MAX_RETRIES", 3)
+WRITE_RETRY_BACKOFF = getattr(settings, "CHAT_WRITE_RETRY_BACKOFF", 0.2)
+
+
+class MessagePersistenceError(Exception):
+    pass
+
+
+class MessageWriter:
+    """
+    Batched writer for chat messages. Consumers hand messages over with
+    `write()` and a background task inserts them with one bulk_create per
+    batch.
+
+    The returned future resolves once the message's batch has committed, and
+    fails with MessagePersistenceError if it still cannot be written after
+    the retries or the database rejects that row; one rejected row never
+    fails the other messages of its batch. Consumers broadcast a message
+    only after that. Until then it exists only in this process's queue, so
+    a worker that dies before the flush loses it, and its sender never gets
+    it back. Back-pressure: the queue is bounded, so when the database falls
+    behind, `write()` waits instead of buffering without limit.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL,
+                 max_pending=WRITE_MAX_PENDING, max_retries=WRITE_MAX_RETRIES):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.task = None
+
+    def ensure_started(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def write(self, mid, room_id, sender_id, content, time_sent):
+        self.ensure_started()
+        message = Message(mid=mid, room_id=room_id, sender_id=sender_id, content=content, timeSent=time_sent)
+        persisted = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, persisted))
+        return persisted
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        failed = {}
+        updates = await self.insert([message for message, _ in batch], failed)
+
+        for message, persisted in batch:
+            if persisted.done():
+                continue
+            if message.mid in failed:
+                persisted.set_exception(MessagePersistenceError(str(failed[message.mid])))
+            else:
+                persisted.set_result(None)
+
+        try:
+            await apublish_unread(updates)
+        except Exception as e:
+            print(f"Pushing unread counts failed: {e}")
+
+    async def insert(self, messages, failed):
+        """
+        Insert `messages`, recording the ones that could not be saved in
+        `failed` (mid -> error). A row the database rejects (duplicate mid,
+        room deleted meanwhile) only fails itself: the batch is split in
+        halves until that row is isolated. Other errors are retried for the
+        whole batch.
+        """
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                return await database_sync_to_async(self.bulk_insert)(messages)
+            except IntegrityError as e:
+                if len(messages) == 1:
+                    print(f"Chat message {messages[0].mid} was rejected: {e}")
+                    failed[messages[0].mid] = e
+                    return []
+                half = len(messages) // 2
+                return await self.insert(messages[:half], failed) + await self.insert(messages[half:], failed)
+            except Exception as e:
+                error = e
+                print(f"Saving {len(messages)} chat messages failed (attempt {attempt + 1}): {e}")
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(WRITE_RETRY_BACKOFF * 2 ** attempt)
+        for message in messages:
+            failed[message.mid] = error
+        return []
+
+    def bulk_insert(self, messages):
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.batch_size)
+            record_latest_messages(messages)
+            return count_new_messages(messages)
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_message_writer():
+    """The writer for the running event loop (one per worker process)."""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter()
+    return writer
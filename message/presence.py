@@ -0,0 +1,146 @@
+import threading
+import time
+
+from django.conf import settings
+
+from server.backends import shared_backend
+
+PRESENCE_TTL = getattr(settings, "PRESENCE_TTL", 90)
+PRESENCE_HEARTBEAT = getattr(settings, "PRESENCE_HEARTBEAT", 30)
+
+ONLINE_KEY = "presence:online"
+
+
+def room_key(rid):
+    return f"presence:room:{rid}"
+
+
+def connections_key(key, uid):
+    return f"{key}:connections:{uid}"
+
+
+# Drops one connection of a user; the user leaves the key only with their
+# last live connection. KEYS: presence key, the user's connections.
+# ARGV: uid, connection, now. Returns 1 if the user left.
+LEAVE = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+if redis.call('ZCARD', KEYS[2]) > 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class RedisPresence:
+    """
+    Presence shared by every worker process. Each key is a sorted set of
+    uids scored by the time their presence expires, so a crashed worker's
+    users age out on their own, and "is X in R" is a single ZSCORE. Next to
+    it, every uid has a sorted set of its open connections (one per socket,
+    tab or device), so closing one of them does not hide the others.
+    """
+
+    def __init__(self, client, ttl=PRESENCE_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.leave_script = client.register_script(LEAVE)
+
+    def touch(self, key, uid, connection):
+        now = time.time()
+        connections = connections_key(key, uid)
+        pipe = self.client.pipeline()
+        pipe.zadd(connections, {connection: now + self.ttl})
+        pipe.zremrangebyscore(connections, "-inf", now)
+        pipe.expire(connections, self.ttl)
+        pipe.zadd(key, {uid: now + self.ttl})
+        pipe.zremrangebyscore(key, "-inf", now)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def leave(self, key, uid, connection):
+        """Close one connection. Returns True if it was the user's last one."""
+        return bool(self.leave_script(keys=[key, connections_key(key, uid)], args=[uid, connection, time.time()]))
+
+    def is_present(self, key, uid):
+        expires_at = self.client.zscore(key, uid)
+        return expires_at is not None and expires_at > time.time()
+
+    def present_among(self, key, uids):
+        uids = list(uids)
+        if not uids:
+            return set()
+        pipe = self.client.pipeline()
+        for uid in uids:
+            pipe.zscore(key, uid)
+        now = time.time()
+        return {uid for uid, expires_at in zip(uids, pipe.execute()) if expires_at is not None and expires_at > now}
+
+    def members(self, key):
+        return {
+            uid.decode() if isinstance(uid, bytes) else uid
+            for uid in self.client.zrangebyscore(key, time.time(), "+inf")
+        }
+
+
+class LocalPresence:
+    """Presence as tracked by RedisPresence, kept in this process."""
+
+    def __init__(self, ttl=PRESENCE_TTL):
+        self.ttl = ttl
+        # key -> uid -> connection -> expiry
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def touch(self, key, uid, connection):
+        with self._lock:
+            self._keys.setdefault(key, {}).setdefault(uid, {})[connection] = time.time() + self.ttl
+
+    def leave(self, key, uid, connection):
+        now = time.time()
+        with self._lock:
+            entries = self._keys.get(key, {})
+            connections = entries.get(uid, {})
+            connections.pop(connection, None)
+            if any(expires_at > now for expires_at in connections.values()):
+                return False
+            entries.pop(uid, None)
+            if not entries:
+                self._keys.pop(key, None)
+            return True
+
+    def is_present(self, key, uid):
+        return uid in self.members(key)
+
+    def present_among(self, key, uids):
+        return set(uids) & self.members(key)
+
+    def members(self, key):
+        now = time.time()
+        with self._lock:
+            return {
+                uid for uid, connections in self._keys.get(key, {}).items()
+                if any(expires_at > now for expires_at in connections.values())
+            }
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+get_presence = shared_backend(RedisPresence, LocalPresence)
+
+
+def is_in_room(rid, uid):
+    return get_presence().is_present(room_key(rid), uid)
+
+
+def online_users(uids=None):
+    """
+    Uids with a live global notification socket. With `uids`, only those
+    uids are checked (one round trip for the whole batch).
+    """
+    if uids is None:
+        return get_presence().members(ONLINE_KEY)
+    return get_presence().present_among(ONLINE_KEY, uids)
@@ -0,0 +1,122 @@
+import json
+from urllib.parse import parse_qs
+
+import msgpack
+
+# Version 1 is the original protocol: one JSON text frame per message, in
+# both directions. Version 2 adds message ids, batching and binary frames.
+PROTOCOL_VERSION = 2
+MAX_MESSAGES_PER_FRAME = 50
+V1_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class ConnectionOptions:
+    """
+    Protocol options picked by the client in the websocket URL:
+    `?v=2` selects version 2 and `&format=msgpack` binary frames;
+    `last_seen_mid` asks for the messages missed since that one.
+    """
+
+    def __init__(self, query_string=b""):
+        params = parse_qs(query_string.decode() if isinstance(query_string, bytes) else query_string)
+        version = params.get("v", ["1"])[0]
+        self.version = PROTOCOL_VERSION if version == str(PROTOCOL_VERSION) else 1
+        self.binary = self.version == PROTOCOL_VERSION and params.get("format", [""])[0] == "msgpack"
+        last_seen_mid = params.get("last_seen_mid", [""])[0]
+        self.last_seen_mid = int(last_seen_mid) if last_seen_mid.isdigit() else None
+
+    @property
+    def frame_key(self):
+        """Key of this connection's encoding in a broadcast's frames."""
+        if self.version == 1:
+            return "v1"
+        return "msgpack" if self.binary else "json"
+
+
+def encode(payload, binary=False):
+    if binary:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def decode_frame(text_data=None, bytes_data=None):
+    """Decode a client frame (JSON text or msgpack binary) into a dict."""
+    try:
+        if bytes_data is not None:
+            data = msgpack.unpackb(bytes_data, raw=False)
+        else:
+            data = json.loads(text_data)
+    except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError):
+        raise ProtocolError("Frame could not be decoded.")
+    if not isinstance(data, dict):
+        raise ProtocolError("Frame must be an object.")
+    return data
+
+
+def chat_contents(data):
+    """
+    The chat message texts carried by a client frame. Version 2 frames send
+    {"type": "chat", "messages": [{"content": ...}, ...]} (or a single
+    "content"); version 1 frames send {"message": ...}. Any client-supplied
+    sender is ignored.
+    """
+    if "messages" in data:
+        items = data["messages"]
+        if not isinstance(items, list):
+            raise ProtocolError("messages must be a list.")
+        contents = [item.get("content") if isinstance(item, dict) else None for item in items]
+    else:
+        contents = [data.get("content", data.get("message"))]
+    if not contents or len(contents) > MAX_MESSAGES_PER_FRAME:
+        raise ProtocolError(f"A frame carries 1 to {MAX_MESSAGES_PER_FRAME} messages.")
+    if any(not isinstance(content, str) or not content for content in contents):
+        raise ProtocolError("Message content must be a non-empty string.")
+    return contents
+
+
+def chat_frames(messages, formats=("v1", "json", "msgpack"), **extra):
+    """
+    Encode a broadcast once per wire format, so every recipient socket just
+    sends the bytes for its own format. `messages` are dicts with mid, room,
+    sender, senderName, content and timeSent (a datetime). `extra` keys are
+    added to version 2 payloads.
+    """
+    payload = {
+        "v": PROTOCOL_VERSION,
+        "type": "chat",
+        "messages": [{**message, "timeSent": message["timeSent"].isoformat()} for message in messages],
+        **extra,
+    }
+    frames = {}
+    if "v1" in formats:
+        frames["v1"] = [
+            encode({
+                "message": message["content"],
+                "sender": message["senderName"],
+                "timeSent": message["timeSent"].strftime(V1_TIME_FORMAT),
+            })
+            for message in messages
+        ]
+    if "json" in formats:
+        frames["json"] = encode(payload)
+    if "msgpack" in formats:
+        frames["msgpack"] = encode(payload, binary=True)
+    return frames
+
+
+def drop_messages(frames, mids, skip):
+    """
+    One connection's frames for a broadcast of `mids` (as picked from
+    chat_frames by ConnectionOptions.frame_key), re-encoded without the
+    messages whose ids are in `skip`.
+    """
+    if isinstance(frames, list):
+        return [frame for mid, frame in zip(mids, frames) if mid not in skip]
+    binary = isinstance(frames, bytes)
+    payload = msgpack.unpackb(frames, raw=False) if binary else json.loads(frames)
+    payload["messages"] = [message for message in payload["messages"] if message["mid"] not in skip]
+    return encode(payload, binary=binary)
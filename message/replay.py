@@ -0,0 +1,155 @@
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from message.models import Message
+from server.backends import shared_backend
+
+# Recent messages kept per room for reconnecting clients
+REPLAY_BUFFER_SIZE = getattr(settings, "CHAT_REPLAY_BUFFER_SIZE", 200)
+REPLAY_BUFFER_TTL = getattr(settings, "CHAT_REPLAY_BUFFER_TTL", 24 * 60 * 60)
+# Most messages replayed on connect; a client further behind is told to
+# page through get_messages instead
+REPLAY_MAX_MESSAGES = getattr(settings, "CHAT_REPLAY_MAX_MESSAGES", 500)
+
+
+def buffer_key(rid):
+    return f"replay:room:{rid}"
+
+
+def floor_key(rid):
+    return f"replay:floor:{rid}"
+
+
+def dump_message(message):
+    return json.dumps({**message, "timeSent": message["timeSent"].isoformat()}, separators=(",", ":"))
+
+
+def load_message(data):
+    message = json.loads(data)
+    message["timeSent"] = parse_datetime(message["timeSent"])
+    return message
+
+
+# ARGV: size, ttl, then (mid, encoded message) pairs. The floor is the
+# highest mid the buffer no longer holds: a new buffer starts just below
+# its first message and the floor rises as old messages are trimmed.
+APPEND = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SET', KEYS[2], tonumber(ARGV[3]) - 1)
+end
+for i = 3, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if excess > 0 then
+    local evicted = redis.call('ZRANGE', KEYS[1], excess - 1, excess - 1, 'WITHSCORES')
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+    redis.call('SET', KEYS[2], evicted[2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return excess
+"""
+
+
+class RedisReplayBuffer:
+    """
+    Bounded per-room ring buffer of the latest chat messages, shared by
+    every worker: a sorted set scored by mid, trimmed to `size` entries.
+    Messages are added when they are broadcast, before the batched writer
+    stores them, so a reconnecting client can be caught up from Redis alone.
+    """
+
+    def __init__(self, client, size=REPLAY_BUFFER_SIZE, ttl=REPLAY_BUFFER_TTL):
+        self.client = client
+        self.size = size
+        self.ttl = ttl
+        self.append_script = client.register_script(APPEND)
+
+    def append(self, rid, messages):
+        args = [self.size, self.ttl]
+        for message in messages:
+            args += [message["mid"], dump_message(message)]
+        self.append_script(keys=[buffer_key(rid), floor_key(rid)], args=args)
+
+    def since(self, rid, mid):
+        """
+        Buffered messages after `mid` in mid order, and whether the buffer
+        holds all of the room's messages after `mid`.
+        """
+        pipe = self.client.pipeline()
+        pipe.get(floor_key(rid))
+        pipe.zrangebyscore(buffer_key(rid), f"({mid}", "+inf")
+        floor, entries = pipe.execute()
+        covered = floor is not None and mid >= int(floor)
+        return [load_message(entry) for entry in entries], covered
+
+
+class LocalReplayBuffer:
+    """The replay buffers of RedisReplayBuffer, kept in this process."""
+
+    def __init__(self, size=REPLAY_BUFFER_SIZE):
+        self.size = size
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def append(self, rid, messages):
+        with self._lock:
+            room = self._rooms.get(rid)
+            if room is None:
+                room = self._rooms[rid] = {"floor": messages[0]["mid"] - 1, "messages": {}}
+            for message in messages:
+                room["messages"][message["mid"]] = dict(message)
+            mids = sorted(room["messages"])
+            for evicted in mids[:max(len(mids) - self.size, 0)]:
+                del room["messages"][evicted]
+                room["floor"] = evicted
+
+    def since(self, rid, mid):
+        with self._lock:
+            room = self._rooms.get(rid)
+            if room is None:
+                return [], False
+            messages = [dict(room["messages"][m]) for m in sorted(room["messages"]) if m > mid]
+            return messages, mid >= room["floor"]
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+
+
+get_replay_buffer = shared_backend(RedisReplayBuffer, LocalReplayBuffer)
+
+
+async def amissed_messages(rid, last_seen_mid, limit=REPLAY_MAX_MESSAGES):
+    """
+    The room's messages after `last_seen_mid`, oldest first, and whether
+    that is all of them (False when more than `limit` were missed). Served
+    from the replay buffer when it covers the gap; otherwise from the
+    (room, mid) range of the message table, topped up with buffered
+    messages the writer has not stored yet.
+    """
+    buffered, covered = await sync_to_async(get_replay_buffer().since, thread_sensitive=False)(rid, last_seen_mid)
+    if covered:
+        return buffered[:limit], len(buffered) <= limit
+
+    rows = Message.objects.filter(room_id=rid, mid__gt=last_seen_mid).order_by("mid").values(
+        "mid", "room_id", "sender_id", "sender__displayName", "content", "timeSent"
+    )
+    messages = {
+        row["mid"]: {
+            "mid": row["mid"], "room": row["room_id"], "sender": row["sender_id"],
+            "senderName": row["sender__displayName"], "content": row["content"], "timeSent": row["timeSent"],
+        }
+        async for row in rows[:limit + 1]
+    }
+    if len(messages) <= limit:
+        # Rows still queued in the batched writer are only in the buffer
+        for message in buffered:
+            messages.setdefault(message["mid"], message)
+    ordered = [messages[mid] for mid in sorted(messages)]
+    return ordered[:limit], len(ordered) <= limit
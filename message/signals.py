@@ -0,0 +1,29 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from message.inbox import record_latest_messages
+from message.models import Message, Room, RoomMembership
+from message.unread import count_new_messages
+
+
+@receiver(post_save, sender=Room)
+def create_memberships(sender, instance, created, **kwargs):
+    """Give the seller and the buyer an inbox entry for every new room."""
+    if not created:
+        return
+    RoomMembership.objects.bulk_create([
+        RoomMembership(room=instance, user_id=instance.seller_id),
+        RoomMembership(room=instance, user_id=instance.buyer_id),
+    ], ignore_conflicts=True)
+
+
+@receiver(post_save, sender=Message)
+def update_inbox(sender, instance, created, **kwargs):
+    """
+    Keep the inbox order and unread counts current for messages saved one
+    at a time. The batched message writer uses bulk_create, which sends no
+    signals, and does the same itself.
+    """
+    if created:
+        record_latest_messages([instance])
+        count_new_messages([instance])
@@ -0,0 +1,208 @@
+import asyncio
+import multiprocessing
+import socket
+import threading
+import unittest
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase, override_settings
+
+# Worker processes are spawned and import this module before Django is set
+# up, so app code is only imported inside functions.
+
+try:
+    from fakeredis import TcpFakeServer
+except ImportError:  # fakeredis[lua] is only needed for this test
+    TcpFakeServer = None
+
+WORKERS = 2
+MESSAGES = 50
+CAPACITY = 1000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_redis_stand_in():
+    """Start an in-process, TCP-speaking fake Redis and return its URL."""
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"redis://127.0.0.1:{port}/0"
+
+
+def channel_layers(hosts):
+    return {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": hosts, "capacity": CAPACITY},
+        }
+    }
+
+
+def shared_presence(url):
+    """Presence kept on the fake Redis, as every worker would share it in production."""
+    import redis
+    from message.presence import RedisPresence
+    return RedisPresence(redis.Redis.from_url(url))
+
+
+def buyer_worker(hosts, presence_url, room, ready, results):
+    """
+    Worker process: the buyer's chat and notification sockets, served by the
+    real consumers. The worker has no access to the parent's test database,
+    so the room lookup that authorizes the chat socket is answered with the
+    parent's room; everything else runs unchanged. Presence is kept on
+    `presence_url`, shared with the parent process.
+    """
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.CHANNEL_LAYERS = channel_layers(hosts)
+
+    from unittest.mock import patch
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from message.consumers import ChatConsumer
+    from message.notifications import NOTIFICATION_WINDOW
+    from message.routing import websocket_urlpatterns
+    from server.principals import FirebasePrincipal
+
+    buyer = FirebasePrincipal(room["buyer_id"], {
+        "uid": room["buyer_id"], "banned": False, "admin": False, "purdueEmailVerified": True
+    })
+
+    def communicator(path):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope["user"] = buyer
+        return communicator
+
+    async def get_room(self, rid):
+        return room
+
+    async def run():
+        chat = communicator(f"/ws/chat/{room['rid']}/")
+        notifications = communicator("/ws/global/")
+        assert (await chat.connect())[0]
+        assert (await notifications.connect())[0]
+        ready.release()
+
+        received = []
+        while len(received) < MESSAGES:
+            received.append((await chat.receive_json_from(timeout=30))["message"])
+        # The buyer has the room open, so no notification may follow, even
+        # once a coalescing window would have closed. Unread count updates
+        # still arrive on this socket.
+        notified = 0
+        while not await notifications.receive_nothing(timeout=NOTIFICATION_WINDOW * 2):
+            frame = await notifications.receive_json_from()
+            if "type" not in frame:
+                notified += frame["count"]
+        await chat.disconnect()
+        await notifications.disconnect()
+        return received, notified
+
+    presence = shared_presence(presence_url)
+    with patch.object(ChatConsumer, "get_room", get_room), patch("message.consumers.get_presence", lambda: presence):
+        results.put(asyncio.run(run()))
+
+
+@unittest.skipIf(TcpFakeServer is None, "fakeredis[lua] is required for the channel layer load test")
+class ConsumerFanOutLoadTest(TransactionTestCase):
+    """
+    Multi-process load test: ChatConsumer instances living in separate
+    worker processes must all receive every chat message, in order, when the
+    channel layer is sharded over two Redis hosts, and a buyer who has the
+    room open in another process must not be sent notifications for it.
+    """
+    def setUp(self):
+        from listing.models import Listing
+        from message.models import Room
+        from user.models import User
+
+        self.servers = []
+        hosts = []
+        for _ in range(2):
+            server, url = start_redis_stand_in()
+            self.servers.append(server)
+            hosts.append(url)
+        self.hosts = hosts
+        # Presence gets a host of its own, like a cache Redis next to the
+        # channel layer's
+        server, self.presence_url = start_redis_stand_in()
+        self.servers.append(server)
+        # The fake server drops connections that load a script while another
+        # connection does, so its Lua is loaded once before the workers start
+        import redis
+        from message.presence import LEAVE
+        redis.Redis.from_url(self.presence_url).script_load(LEAVE)
+
+        seller = User.objects.create(uid="seller_uid", email="seller@example.com", displayName="Seller")
+        buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        listing = Listing.objects.create(
+            title="Desk", description="A desk", price=10.0, original_price=10.0, category="Test", user=seller
+        )
+        self.room = Room.objects.create(seller=seller, buyer=buyer, listing=listing)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_consumers_in_every_process_receive_the_broadcast(self):
+        from unittest.mock import patch
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from message.models import Message
+        from message.notifications import get_notification_dispatcher
+        from message.presence import room_key
+        from message.routing import websocket_urlpatterns
+        from server.principals import get_principal
+
+        room = {
+            "rid": self.room.rid, "seller_id": "seller_uid", "buyer_id": "buyer_uid",
+            "listing__title": "Desk", "seller__displayName": "Seller", "buyer__displayName": "Buyer",
+        }
+        ctx = multiprocessing.get_context("spawn")
+        ready = ctx.Semaphore(0)
+        results = ctx.Queue()
+        workers = [ctx.Process(target=buyer_worker, args=(self.hosts, self.presence_url, room, ready, results)) for _ in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            self.assertTrue(ready.acquire(timeout=60), "worker did not connect")
+
+        seller = get_principal("seller_uid")
+        presence = shared_presence(self.presence_url)
+        self.assertTrue(presence.is_present(room_key(self.room.rid), "buyer_uid"))
+
+        async def send_as_seller():
+            chat = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{self.room.rid}/")
+            chat.scope["user"] = seller
+            connected, _ = await chat.connect()
+            self.assertTrue(connected)
+            for seq in range(MESSAGES):
+                await chat.send_json_to({"message": f"message {seq}"})
+                # The sender's own copy comes back through the layer too
+                self.assertEqual((await chat.receive_json_from(timeout=10))["message"], f"message {seq}")
+            # Both participants are in the room, so nothing was queued
+            dispatcher = get_notification_dispatcher()
+            self.assertEqual(dispatcher.pending, {})
+            self.assertIsNone(dispatcher.task)
+            await chat.disconnect()
+
+        with override_settings(CHANNEL_LAYERS=channel_layers(self.hosts)), \
+                patch("message.consumers.get_presence", lambda: presence):
+            async_to_sync(send_as_seller)()
+
+        received = [results.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=30)
+            self.assertEqual(worker.exitcode, 0)
+        for messages, notified in received:
+            self.assertEqual(messages, [f"message {seq}" for seq in range(MESSAGES)])
+            self.assertEqual(notified, 0)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), MESSAGES)
@@ -0,0 +1,79 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from django.test import SimpleTestCase
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from message.connection_stats import NODE_LEASE_TTL, LocalConnectionCounter, RedisConnectionCounter
+
+class ConnectionCounterTests:
+    """Behaviour shared by every connected-users counter backend."""
+
+    def make_counter(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.counter = self.make_counter()
+
+    def test_concurrent_connects_are_not_lost(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: self.counter.incr("node-a", 1), range(200)))
+            list(pool.map(lambda _: self.counter.incr("node-a", -1), range(50)))
+        self.assertEqual(self.counter.snapshot()["connected_users"], 150)
+
+    def test_per_node_breakdown_and_dead_node_expiry(self):
+        self.counter.incr("node-a", 1)
+        self.counter.incr("node-a", 1)
+        self.counter.incr("node-b", 1)
+        snapshot = self.counter.snapshot()
+        self.assertEqual(snapshot["connected_users"], 3)
+        self.assertEqual(snapshot["nodes"], {"node-a": 2, "node-b": 1})
+
+        self.expire_lease("node-b")
+        snapshot = self.counter.snapshot()
+        self.assertEqual(snapshot["connected_users"], 2)
+        self.assertEqual(snapshot["nodes"], {"node-a": 2})
+
+    def test_live_node_with_lapsed_lease_reports_its_full_count(self):
+        self.counter.incr("node-a", 1)
+        self.counter.incr("node-a", 1)
+        self.expire_lease("node-a")
+        self.assertEqual(self.counter.snapshot()["nodes"], {})
+
+        # The node was only slow: its next write brings back its real count
+        self.counter.incr("node-a", -1)
+        self.assertEqual(self.counter.snapshot()["nodes"], {"node-a": 1})
+        self.expire_lease("node-a")
+        self.counter.snapshot()
+        self.counter.heartbeat("node-a")
+        self.assertEqual(self.counter.snapshot()["nodes"], {"node-a": 1})
+
+    def test_time_series(self):
+        now = time.time()
+        self.counter.incr("node-a", 1)
+        self.counter.incr("node-b", 1)
+        self.counter.heartbeat("node-a", now=now - 60)
+        self.counter.heartbeat("node-a", now=now)
+        self.counter.heartbeat("node-b", now=now)
+        series = self.counter.snapshot(minutes=3, now=now)["series"]
+        self.assertEqual([point["connected_users"] for point in series], [0, 1, 2])
+
+class LocalConnectionCounterTests(ConnectionCounterTests, SimpleTestCase):
+    def make_counter(self):
+        return LocalConnectionCounter()
+
+    def expire_lease(self, node):
+        self.counter._leases[node] = time.time() - NODE_LEASE_TTL
+
+@unittest.skipIf(fakeredis is None, "fakeredis is required for the Redis counter tests")
+class RedisConnectionCounterTests(ConnectionCounterTests, SimpleTestCase):
+    def make_counter(self):
+        self.client = fakeredis.FakeRedis()
+        return RedisConnectionCounter(self.client)
+
+    def expire_lease(self, node):
+        self.client.delete(f"connections:lease:{node}")
@@ -0,0 +1,367 @@
+import msgpack
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import IntegrityError
+from django.test import TransactionTestCase
+from django.utils import timezone
+from listing.models import Listing
+from message.connection_stats import get_connection_counter
+from message.models import Message, Room, RoomMembership
+from message.persistence import MessageWriter
+from message.presence import get_presence, online_users
+from message.protocol import chat_frames
+from message.routing import websocket_urlpatterns
+from message.replay import get_replay_buffer
+from message.unread import amark_read, get_unread_counters
+from server.principals import get_principal
+from user.models import User
+
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        get_presence().clear()
+        get_connection_counter().clear()
+        get_unread_counters().clear()
+        get_replay_buffer().clear()
+        self.seller = User.objects.create(uid="seller_uid", email="seller@example.com", displayName="Seller")
+        self.buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        self.listing = Listing.objects.create(
+            title="Desk",
+            description="A desk",
+            price=10.0,
+            original_price=10.0,
+            category="Test",
+            user=self.seller
+        )
+        self.room = Room.objects.create(seller=self.seller, buyer=self.buyer, listing=self.listing)
+        self.principals = {uid: get_principal(uid) for uid in ("seller_uid", "buyer_uid")}
+
+    def tearDown(self):
+        get_presence().clear()
+        get_connection_counter().clear()
+        get_unread_counters().clear()
+
+    async def receive_frame(self, communicator, frame_type):
+        """Next frame of the given type, skipping presence/typing events."""
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            if frame.get("type") == frame_type:
+                return frame
+
+    def communicator(self, path, uid):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope["user"] = self.principals[uid]
+        return communicator
+
+    def test_chat_message_is_saved_and_only_absent_users_are_notified(self):
+        async def scenario():
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "seller_uid")
+            connected, _ = await seller_chat.connect()
+            self.assertTrue(connected)
+
+            buyer_notifications = self.communicator("/ws/global/", "buyer_uid")
+            connected, _ = await buyer_notifications.connect()
+            self.assertTrue(connected)
+            seller_notifications = self.communicator("/ws/global/", "seller_uid")
+            connected, _ = await seller_notifications.connect()
+            self.assertTrue(connected)
+
+            await seller_chat.send_json_to({"message": "Still available?", "sender": "Seller"})
+            event = await seller_chat.receive_json_from(timeout=5)
+            self.assertEqual(event["message"], "Still available?")
+
+            # The buyer is not in the room, so they get a notification and
+            # their new unread count; the seller is in the room and gets
+            # neither.
+            frames = [await buyer_notifications.receive_json_from(timeout=5) for _ in range(2)]
+            notification = next(frame for frame in frames if "type" not in frame)
+            self.assertEqual(notification["room"], "Desk")
+            unread = next(frame for frame in frames if frame.get("type") == "unread")
+            self.assertEqual(unread, {"type": "unread", "room": self.room.rid, "unreadCount": 1})
+            self.assertTrue(await seller_notifications.receive_nothing(timeout=0.5))
+
+            self.assertEqual(get_connection_counter().snapshot()["connected_users"], 2)
+            for communicator in (seller_chat, buyer_notifications, seller_notifications):
+                await communicator.disconnect()
+            self.assertEqual(get_connection_counter().snapshot()["connected_users"], 0)
+
+        async_to_sync(scenario)()
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+    def test_unsaved_message_is_not_broadcast(self):
+        def rejecting_bulk_insert(writer, messages):
+            raise IntegrityError("rejected")
+
+        async def scenario():
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "seller_uid")
+            connected, _ = await seller_chat.connect()
+            self.assertTrue(connected)
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+
+            await seller_chat.send_json_to({"message": "Still available?"})
+            error = await seller_chat.receive_json_from(timeout=5)
+            self.assertEqual(error["error"], "Message could not be saved")
+            self.assertTrue(await buyer_chat.receive_nothing(timeout=0.5))
+            for communicator in (seller_chat, buyer_chat):
+                await communicator.disconnect()
+
+        with patch.object(MessageWriter, "bulk_insert", rejecting_bulk_insert):
+            async_to_sync(scenario)()
+        self.assertEqual(get_replay_buffer().since(self.room.rid, 0), ([], False))
+
+    def test_read_frame_moves_cursor_and_sends_receipt(self):
+        message = Message.objects.create(room=self.room, sender=self.seller, content="Still available?")
+
+        async def scenario():
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "seller_uid")
+            connected, _ = await seller_chat.connect()
+            self.assertTrue(connected)
+
+            await buyer_chat.send_json_to({"type": "read", "mid": message.mid})
+            receipt = await seller_chat.receive_json_from(timeout=5)
+            self.assertEqual(receipt, {"type": "read", "uid": "buyer_uid", "mid": message.mid})
+            for communicator in (buyer_chat, seller_chat):
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        membership = RoomMembership.objects.get(room=self.room, user=self.buyer)
+        self.assertEqual((membership.lastReadMid, membership.unreadCount), (message.mid, 0))
+
+    @patch("message.consumers.READ_FLUSH_INTERVAL", 0.2)
+    def test_read_frames_are_merged_per_interval(self):
+        messages = [Message.objects.create(room=self.room, sender=self.seller, content=f"{i}") for i in range(20)]
+        calls = []
+
+        async def counting_mark_read(room_id, uid, mid):
+            calls.append(mid)
+            return await amark_read(room_id, uid, mid)
+
+        async def scenario():
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+            for message in messages:
+                await buyer_chat.send_json_to({"type": "read", "mid": message.mid})
+            # Stale and repeated receipts are dropped
+            await buyer_chat.send_json_to({"type": "read", "mid": messages[0].mid})
+            await buyer_chat.disconnect()
+
+        with patch("message.consumers.amark_read", counting_mark_read):
+            async_to_sync(scenario)()
+        self.assertLessEqual(len(calls), 3)
+        self.assertEqual(calls[-1], messages[-1].mid)
+        membership = RoomMembership.objects.get(room=self.room, user=self.buyer)
+        self.assertEqual((membership.lastReadMid, membership.unreadCount), (messages[-1].mid, 0))
+
+    def test_non_participant_is_rejected(self):
+        User.objects.create(uid="other_uid", email="other@example.com", displayName="Other")
+        self.principals["other_uid"] = get_principal("other_uid")
+
+        async def scenario():
+            communicator = self.communicator(f"/ws/chat/{self.room.rid}/", "other_uid")
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(scenario)()
+
+    def test_missing_room_is_rejected(self):
+        async def scenario():
+            for path in (f"/ws/chat/{self.room.rid + 100}/", "/ws/chat/not_a_room/"):
+                communicator = self.communicator(path, "seller_uid")
+                connected, _ = await communicator.connect()
+                self.assertFalse(connected)
+
+        async_to_sync(scenario)()
+
+    def test_protocol_v2_batches_and_binary_frames(self):
+        async def scenario():
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2", "seller_uid")
+            connected, _ = await seller_chat.connect()
+            self.assertTrue(connected)
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2&format=msgpack", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+            legacy_chat = self.communicator(f"/ws/chat/{self.room.rid}/", "buyer_uid")
+            connected, _ = await legacy_chat.connect()
+            self.assertTrue(connected)
+
+            # The client-supplied sender is ignored
+            await seller_chat.send_json_to({
+                "type": "chat", "sender": "Someone else", "messages": [{"content": "First"}, {"content": "Second"}]
+            })
+            frame = await self.receive_frame(seller_chat, "chat")
+            self.assertEqual(frame["v"], 2)
+            self.assertEqual([m["content"] for m in frame["messages"]], ["First", "Second"])
+            self.assertEqual({m["senderName"] for m in frame["messages"]}, {"Seller"})
+            self.assertEqual({m["sender"] for m in frame["messages"]}, {"seller_uid"})
+            mids = [m["mid"] for m in frame["messages"]]
+            self.assertEqual(mids[1], mids[0] + 1)
+
+            binary = await buyer_chat.receive_output(timeout=5)
+            self.assertEqual(msgpack.unpackb(binary["bytes"]), frame)
+
+            # Version 1 clients get one frame per message, as before
+            legacy = [await legacy_chat.receive_json_from(timeout=5) for _ in range(2)]
+            self.assertEqual([f["message"] for f in legacy], ["First", "Second"])
+            self.assertEqual(legacy[0]["sender"], "Seller")
+
+            await seller_chat.send_json_to({"type": "chat", "messages": []})
+            error = await self.receive_frame(seller_chat, "error")
+            self.assertEqual(error["error"], "A frame carries 1 to 50 messages.")
+
+            for communicator in (seller_chat, buyer_chat, legacy_chat):
+                await communicator.disconnect()
+            return mids
+
+        mids = async_to_sync(scenario)()
+        stored = Message.objects.filter(room=self.room).order_by("mid")
+        self.assertEqual([(m.mid, m.content) for m in stored], list(zip(mids, ["First", "Second"])))
+
+    def test_reconnect_replays_only_missed_messages(self):
+        async def scenario():
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2", "seller_uid")
+            connected, _ = await seller_chat.connect()
+            self.assertTrue(connected)
+            await seller_chat.send_json_to({"type": "chat", "messages": [{"content": f"{i}"} for i in range(4)]})
+            sent = (await self.receive_frame(seller_chat, "chat"))["messages"]
+
+            # The buyer last saw the second message
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2&last_seen_mid={sent[1]['mid']}", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+            replay = await self.receive_frame(buyer_chat, "chat")
+            self.assertTrue(replay["replay"])
+            self.assertTrue(replay["complete"])
+            self.assertEqual([m["content"] for m in replay["messages"]], ["2", "3"])
+
+            for communicator in (seller_chat, buyer_chat):
+                await communicator.disconnect()
+            return sent
+
+        sent = async_to_sync(scenario)()
+
+        # With the buffer gone, the same replay comes from the database
+        get_replay_buffer().clear()
+
+        async def from_database():
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2&last_seen_mid={sent[0]['mid']}", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+            replay = await self.receive_frame(buyer_chat, "chat")
+            self.assertEqual([m["content"] for m in replay["messages"]], ["1", "2", "3"])
+            self.assertEqual(replay["messages"][0]["senderName"], "Seller")
+            await buyer_chat.disconnect()
+
+        async_to_sync(from_database)()
+
+    def test_live_broadcasts_skip_only_the_replayed_messages(self):
+        async def scenario():
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2", "seller_uid")
+            await seller_chat.connect()
+            await seller_chat.send_json_to({"type": "chat", "messages": [{"content": f"{i}"} for i in range(3)]})
+            sent = (await self.receive_frame(seller_chat, "chat"))["messages"]
+
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2&last_seen_mid={sent[0]['mid']}", "buyer_uid")
+            await buyer_chat.connect()
+            replay = await self.receive_frame(buyer_chat, "chat")
+            self.assertEqual([m["mid"] for m in replay["messages"]], [sent[1]["mid"], sent[2]["mid"]])
+
+            def broadcast(mids):
+                messages = [
+                    {"mid": mid, "room": self.room.rid, "sender": "seller_uid", "senderName": "Seller",
+                     "content": str(mid), "timeSent": timezone.now()}
+                    for mid in mids
+                ]
+                return get_channel_layer().group_send(
+                    f"chat_{self.room.rid}", {"type": "chat_message", "mids": mids, "frames": chat_frames(messages)}
+                )
+
+            # Partly covered by the replay: only the new message is sent
+            newer = sent[2]["mid"] + 1
+            await broadcast([sent[2]["mid"], newer])
+            frame = await self.receive_frame(buyer_chat, "chat")
+            self.assertEqual([m["mid"] for m in frame["messages"]], [newer])
+
+            # A late broadcast for an id below the replayed ones still arrives
+            await broadcast([sent[0]["mid"]])
+            frame = await self.receive_frame(buyer_chat, "chat")
+            self.assertEqual([m["mid"] for m in frame["messages"]], [sent[0]["mid"]])
+
+            for communicator in (seller_chat, buyer_chat):
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_typing_and_presence_events_are_coalesced_and_not_stored(self):
+        async def scenario():
+            seller_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2", "seller_uid")
+            connected, _ = await seller_chat.connect()
+            self.assertTrue(connected)
+            buyer_chat = self.communicator(f"/ws/chat/{self.room.rid}/?v=2", "buyer_uid")
+            connected, _ = await buyer_chat.connect()
+            self.assertTrue(connected)
+
+            presence = await self.receive_frame(seller_chat, "presence")
+            self.assertEqual(presence, {"v": 2, "type": "presence", "uid": "buyer_uid", "present": True})
+
+            for typing in (True, True, False, True, True):
+                await buyer_chat.send_json_to({"type": "typing", "typing": typing})
+            # Only the last state of the window goes out
+            typing = await self.receive_frame(seller_chat, "typing")
+            self.assertEqual(typing, {"v": 2, "type": "typing", "uid": "buyer_uid", "typing": True})
+            self.assertTrue(await seller_chat.receive_nothing(timeout=0.5))
+            # Nobody is sent their own events
+            frames = []
+            while not await buyer_chat.receive_nothing(timeout=0.1):
+                frames.append(await buyer_chat.receive_json_from())
+            self.assertTrue(all(frame["uid"] != "buyer_uid" for frame in frames))
+
+            # Leaving mid-sentence clears the indicator
+            await buyer_chat.disconnect()
+            typing = await self.receive_frame(seller_chat, "typing")
+            self.assertFalse(typing["typing"])
+            presence = await self.receive_frame(seller_chat, "presence")
+            self.assertFalse(presence["present"])
+            await seller_chat.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(Message.objects.count(), 0)
+
+    def test_notification_socket_watches_users_coming_online(self):
+        async def scenario():
+            seller_notifications = self.communicator("/ws/global/", "seller_uid")
+            connected, _ = await seller_notifications.connect()
+            self.assertTrue(connected)
+            # Users the seller has no room with are left out
+            await seller_notifications.send_json_to({"type": "watch", "uids": ["buyer_uid", "stranger_uid"]})
+            state = await seller_notifications.receive_json_from(timeout=5)
+            self.assertEqual(state, {"type": "online", "users": {"buyer_uid": False}})
+
+            buyer_notifications = self.communicator("/ws/global/", "buyer_uid")
+            connected, _ = await buyer_notifications.connect()
+            self.assertTrue(connected)
+            event = await seller_notifications.receive_json_from(timeout=5)
+            self.assertEqual(event, {"type": "online", "uid": "buyer_uid", "online": True})
+
+            # Closing one of two tabs keeps the buyer online
+            second_tab = self.communicator("/ws/global/", "buyer_uid")
+            connected, _ = await second_tab.connect()
+            self.assertTrue(connected)
+            await seller_notifications.receive_json_from(timeout=5)
+            await buyer_notifications.disconnect()
+            self.assertTrue(await seller_notifications.receive_nothing(timeout=0.6))
+            self.assertEqual(online_users(["buyer_uid"]), {"buyer_uid"})
+
+            await second_tab.disconnect()
+            event = await seller_notifications.receive_json_from(timeout=5)
+            self.assertEqual(event, {"type": "online", "uid": "buyer_uid", "online": False})
+            await seller_notifications.disconnect()
+
+        async_to_sync(scenario)()
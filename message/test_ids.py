@@ -0,0 +1,68 @@
+import unittest
+from django.test import TestCase
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from listing.models import Listing
+from message.ids import MID_KEY, LocalMidAllocator, RedisMidAllocator
+from message.models import Message, Room
+from user.models import User
+
+
+class MidAllocatorTests:
+    """Behaviour shared by both message id allocators."""
+
+    def make_allocator(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.seller = User.objects.create(uid="seller_uid", email="seller@example.com", displayName="Seller")
+        self.buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        listing = Listing.objects.create(
+            title="Desk", description="A desk", price=10.0, original_price=10.0, category="Test", user=self.seller
+        )
+        self.room = Room.objects.create(seller=self.seller, buyer=self.buyer, listing=listing)
+        self.existing = Message.objects.create(room=self.room, sender=self.seller, content="Hello")
+
+    def test_ids_continue_after_stored_messages(self):
+        allocator = self.make_allocator()
+        first = allocator.allocate()
+        self.assertEqual(first, [self.existing.mid + 1])
+        batch = allocator.allocate(3)
+        self.assertEqual(batch, [first[0] + 1, first[0] + 2, first[0] + 3])
+
+    def test_allocated_ids_can_be_inserted(self):
+        mids = self.make_allocator().allocate(2)
+        Message.objects.bulk_create([
+            Message(mid=mid, room=self.room, sender=self.buyer, content=str(mid)) for mid in mids
+        ])
+        self.assertEqual(list(Message.objects.order_by("mid").values_list("mid", flat=True)), [self.existing.mid, *mids])
+
+    def test_stored_mids_are_read_once(self):
+        allocator = self.make_allocator()
+        allocator.allocate()
+        with self.assertNumQueries(0):
+            allocator.allocate(2)
+
+
+class LocalMidAllocatorTests(MidAllocatorTests, TestCase):
+    def make_allocator(self):
+        return LocalMidAllocator()
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is required for the Redis id allocator tests")
+class RedisMidAllocatorTests(MidAllocatorTests, TestCase):
+    def make_allocator(self):
+        return RedisMidAllocator(fakeredis.FakeRedis(), reseed_margin=0)
+
+    def test_lost_counter_is_reseeded_past_ids_still_in_flight(self):
+        redis = fakeredis.FakeRedis()
+        allocator = RedisMidAllocator(redis, reseed_margin=10)
+        written, in_flight = allocator.allocate(2)
+        Message.objects.create(mid=written, room=self.room, sender=self.seller, content="Written")
+        # Evicted while the second message is still queued in a writer
+        redis.delete(MID_KEY)
+        self.assertEqual(allocator.allocate(), [written + 11])
+        self.assertGreater(written + 11, in_flight)
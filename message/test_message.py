@@ -0,0 +1,188 @@
+from datetime import timedelta
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from listing.models import Listing
+from message.models import Message, Room, RoomMembership
+from message.unread import get_unread_counters
+from user.models import User
+from unittest.mock import patch
+
+# Dummy token verifier for testing purposes.
+def dummy_verify_id_token(token):
+    return {
+        "uid": "seller_uid",
+        "email_verified": True
+    }
+
+class MessageEndpointTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = User.objects.create(
+            uid="seller_uid",
+            email="seller@example.com",
+            displayName="Seller",
+            purdueEmail="seller@purdue.edu",
+            purdueEmailVerified=True
+        )
+        self.buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        self.listing = Listing.objects.create(
+            title="Desk",
+            description="A desk",
+            price=10.0,
+            original_price=10.0,
+            category="Test",
+            user=self.seller
+        )
+        self.room = Room.objects.create(seller=self.seller, buyer=self.buyer, listing=self.listing)
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = [
+            Message.objects.create(
+                room=self.room,
+                sender=self.seller if i % 2 else self.buyer,
+                content=f"Message {i}",
+                timeSent=start + timedelta(seconds=i)
+            )
+            for i in range(10)
+        ]
+        self.url = reverse("get_messages", args=[self.room.rid])
+        get_unread_counters().clear()
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer dummy_token")
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_without_cursor_returns_full_history(self, mock_verify):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        messages = response.json()["messages"]
+        self.assertEqual([m["content"] for m in messages], [f"Message {i}" for i in range(10)])
+        self.assertEqual(messages[0]["sender"], "Buyer")
+        self.assertNotIn("hasMore", response.json())
+        # The legacy history is read-only
+        membership = RoomMembership.objects.get(room=self.room, user_id="seller_uid")
+        self.assertEqual((membership.lastReadMid, membership.unreadCount), (0, 5))
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_pages_newest_first(self, mock_verify):
+        response = self.client.get(self.url, {"limit": 4})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([m["content"] for m in data["messages"]], ["Message 9", "Message 8", "Message 7", "Message 6"])
+        self.assertTrue(data["hasMore"])
+
+        seen = [m["mid"] for m in data["messages"]]
+        while data["hasMore"]:
+            response = self.client.get(self.url, {"limit": 4, "before": data["messages"][-1]["mid"]})
+            data = response.json()
+            seen += [m["mid"] for m in data["messages"]]
+        self.assertEqual(seen, [m.mid for m in reversed(self.messages)])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_since_returns_only_the_delta(self, mock_verify):
+        response = self.client.get(self.url, {"since": self.messages[6].mid})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([m["content"] for m in data["messages"]], ["Message 7", "Message 8", "Message 9"])
+        self.assertFalse(data["hasMore"])
+
+        response = self.client.get(self.url, {"since": self.messages[6].mid, "limit": 2})
+        data = response.json()
+        self.assertEqual([m["content"] for m in data["messages"]], ["Message 7", "Message 8"])
+        self.assertTrue(data["hasMore"])
+        self.assertEqual(data["nextSince"], self.messages[8].mid)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_since_does_not_skip_late_commits(self, mock_verify):
+        last = self.messages[-1].mid
+        # A message from another worker commits before an earlier-allocated one
+        Message.objects.create(mid=last + 2, room=self.room, sender=self.buyer, content="Second")
+        data = self.client.get(self.url, {"since": last}).json()
+        self.assertEqual([m["content"] for m in data["messages"]], ["Second"])
+        self.assertEqual(data["nextSince"], last)
+
+        Message.objects.create(mid=last + 1, room=self.room, sender=self.seller, content="First")
+        data = self.client.get(self.url, {"since": data["nextSince"]}).json()
+        self.assertEqual([m["content"] for m in data["messages"]], ["First", "Second"])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_invalid_cursor(self, mock_verify):
+        other_room = Room.objects.create(seller=self.buyer, buyer=self.seller, listing=self.listing)
+        foreign = Message.objects.create(room=other_room, sender=self.buyer, content="Elsewhere")
+        for params in ({"before": "abc"}, {"since": foreign.mid}, {"limit": 0}, {"before": 1, "since": 1}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("error", response.json())
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_page_query_count(self, mock_verify):
+        # Authentication reads the cached principal, so only the room, the
+        # page itself and the read cursor update run, however many senders
+        # the page has.
+        self.client.get(self.url, {"limit": 4})
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {"limit": 10})
+        self.assertEqual(len(response.json()["messages"]), 10)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_messages_missing_room(self, mock_verify):
+        response = self.client.get(reverse("get_messages", args=[self.room.rid + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_rooms_orders_by_latest_message_with_unread_counts(self, mock_verify):
+        other_buyer = User.objects.create(uid="other_uid", email="other@example.com", displayName="Other")
+        newer_room = Room.objects.create(seller=self.seller, buyer=other_buyer, listing=self.listing)
+        Message.objects.create(room=newer_room, sender=other_buyer, content="Is it free?")
+        Room.objects.create(seller=self.seller, buyer=self.buyer, listing=Listing.objects.create(
+            title="Lamp", description="A lamp", price=5.0, original_price=5.0, category="Test", user=self.seller
+        ))  # no messages, so not in the inbox
+
+        response = self.client.get(reverse("get_rooms"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rooms = response.json()["rooms"]
+        self.assertEqual([room["rid"] for room in rooms], [newer_room.rid, self.room.rid])
+        self.assertEqual(rooms[0]["recentMessage"], "Is it free?")
+        self.assertEqual(rooms[0]["buyer"], "Other")
+        self.assertEqual(rooms[1]["listingName"], "Desk")
+        # Only the buyer's messages count as unread for the seller
+        self.assertEqual(rooms[1]["unreadCount"], 5)
+        self.assertEqual(rooms[0]["unreadCount"], 1)
+        self.assertFalse(rooms[0]["sellerOnline"])
+
+        # Reading the latest messages clears the count
+        self.client.get(self.url, {"limit": 2})
+        rooms = self.client.get(reverse("get_rooms")).json()["rooms"]
+        self.assertEqual(rooms[1]["unreadCount"], 0)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_rooms_pagination_and_query_count(self, mock_verify):
+        for i in range(5):
+            buyer = User.objects.create(uid=f"buyer_{i}", email=f"buyer{i}@example.com", displayName=f"Buyer {i}")
+            room = Room.objects.create(seller=self.seller, buyer=buyer, listing=self.listing)
+            Message.objects.create(room=room, sender=buyer, content=f"Hi {i}")
+
+        self.client.get(reverse("get_rooms"), {"limit": 1})
+        # The whole page is one query, however many rooms the user has
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("get_rooms"), {"limit": 4})
+        data = response.json()
+        self.assertEqual([room["recentMessage"] for room in data["rooms"]], ["Hi 4", "Hi 3", "Hi 2", "Hi 1"])
+
+        response = self.client.get(reverse("get_rooms"), {"limit": 4, "cursor": data["nextCursor"]})
+        data = response.json()
+        self.assertEqual([room["recentMessage"] for room in data["rooms"]], ["Hi 0", "Message 9"])
+        self.assertIsNone(data["nextCursor"])
+
+        response = self.client.get(reverse("get_rooms"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_get_unread_counts(self, mock_verify):
+        response = self.client.get(reverse("get_unread_counts"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"rooms": {str(self.room.rid): 5}, "total": 5})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url, {"limit": 1})
+        response = self.client.get(reverse("get_unread_counts"))
+        self.assertEqual(response.json(), {"rooms": {}, "total": 0})
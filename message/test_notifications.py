@@ -0,0 +1,40 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase
+
+from message.notifications import NotificationDispatcher
+
+
+class NotificationDispatcherTests(SimpleTestCase):
+    def test_burst_is_coalesced_per_recipient_and_room(self):
+        async def scenario():
+            layer = get_channel_layer()
+            buyer = await layer.new_channel()
+            other = await layer.new_channel()
+            await layer.group_add("user_notifications_buyer_uid", buyer)
+            await layer.group_add("user_notifications_other_uid", other)
+
+            dispatcher = NotificationDispatcher(window=0.05)
+            for i in range(3):
+                dispatcher.notify(["buyer_uid"], 1, "Desk", "Seller", f"Message {i}")
+            dispatcher.notify(["buyer_uid", "other_uid"], 2, "Lamp", "Seller", "Lamp?")
+            await dispatcher.task
+
+            events = [await asyncio.wait_for(layer.receive(buyer), 1) for _ in range(2)]
+            by_room = {event["room"]: event for event in events}
+            self.assertEqual(by_room["Desk"]["count"], 3)
+            self.assertEqual(by_room["Desk"]["message"], "3 new messages from Seller")
+            self.assertEqual(by_room["Lamp"]["message"], "Lamp?")
+            self.assertEqual((await asyncio.wait_for(layer.receive(other), 1))["count"], 1)
+
+            # Nothing else was sent
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(buyer), 0.1)
+
+            # A new window opens for the next burst
+            dispatcher.notify(["buyer_uid"], 1, "Desk", "Seller", "Again")
+            await dispatcher.task
+            self.assertEqual((await asyncio.wait_for(layer.receive(buyer), 1))["message"], "Again")
+
+        async_to_sync(scenario)()
@@ -0,0 +1,111 @@
+import asyncio
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase
+from django.utils import timezone
+from listing.models import Listing
+from message.models import Message, Room
+from message.persistence import MessagePersistenceError, MessageWriter
+from user.models import User
+
+class MessageWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.seller = User.objects.create(uid="seller_uid", email="seller@example.com", displayName="Seller")
+        self.buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        self.listing = Listing.objects.create(
+            title="Desk",
+            description="A desk",
+            price=10.0,
+            original_price=10.0,
+            category="Test",
+            user=self.seller
+        )
+        self.room = Room.objects.create(seller=self.seller, buyer=self.buyer, listing=self.listing)
+
+    def test_messages_are_written_in_batches(self):
+        writer = MessageWriter(batch_size=10, flush_interval=0.05)
+        sent_at = timezone.now()
+        calls = []
+        bulk_insert = writer.bulk_insert
+
+        def counting_bulk_insert(messages):
+            calls.append(len(messages))
+            return bulk_insert(messages)
+
+        writer.bulk_insert = counting_bulk_insert
+
+        async def scenario():
+            persisted = [
+                await writer.write(i + 1, self.room.rid, "seller_uid", f"message {i}", sent_at)
+                for i in range(25)
+            ]
+            await asyncio.gather(*persisted)
+            writer.task.cancel()
+
+        async_to_sync(scenario)()
+        self.assertEqual(calls, [10, 10, 5])
+        messages = list(Message.objects.filter(room=self.room).order_by("mid"))
+        self.assertEqual([(m.mid, m.content) for m in messages], [(i + 1, f"message {i}") for i in range(25)])
+        # The receive time is kept, not the time the batch was written
+        self.assertTrue(all(m.timeSent == sent_at for m in messages))
+
+    @patch("message.persistence.WRITE_RETRY_BACKOFF", 0)
+    def test_failed_batch_is_retried_then_reported(self):
+        writer = MessageWriter(batch_size=10, flush_interval=0.01, max_retries=3)
+        attempts = []
+
+        def failing_bulk_insert(messages):
+            attempts.append(len(messages))
+            raise Exception("database unavailable")
+
+        writer.bulk_insert = failing_bulk_insert
+
+        async def scenario():
+            persisted = await writer.write(1, self.room.rid, "seller_uid", "Hello", timezone.now())
+            with self.assertRaises(MessagePersistenceError):
+                await persisted
+            writer.task.cancel()
+
+        async_to_sync(scenario)()
+        self.assertEqual(attempts, [1, 1, 1])
+        self.assertEqual(Message.objects.count(), 0)
+
+    def test_rejected_message_does_not_fail_the_rest_of_the_batch(self):
+        Message.objects.create(mid=3, room=self.room, sender=self.seller, content="Already saved")
+        other_listing = Listing.objects.create(
+            title="Lamp", description="A lamp", price=5.0, original_price=5.0, category="Test", user=self.seller
+        )
+        deleted_room = Room.objects.create(seller=self.seller, buyer=self.buyer, listing=other_listing)
+        deleted_rid = deleted_room.rid
+        deleted_room.delete()
+        writer = MessageWriter(batch_size=10, flush_interval=0.05)
+
+        async def scenario():
+            persisted = [
+                await writer.write(1, self.room.rid, "seller_uid", "one", timezone.now()),
+                await writer.write(2, deleted_rid, "seller_uid", "room is gone", timezone.now()),
+                await writer.write(3, self.room.rid, "seller_uid", "duplicate mid", timezone.now()),
+                await writer.write(4, self.room.rid, "seller_uid", "four", timezone.now()),
+            ]
+            results = await asyncio.gather(*persisted, return_exceptions=True)
+            writer.task.cancel()
+            return results
+
+        results = async_to_sync(scenario)()
+        self.assertEqual([isinstance(result, MessagePersistenceError) for result in results], [False, True, True, False])
+        self.assertEqual(
+            list(Message.objects.order_by("mid").values_list("mid", "content")),
+            [(1, "one"), (3, "Already saved"), (4, "four")]
+        )
+
+    def test_writer_applies_back_pressure_when_full(self):
+        writer = MessageWriter(batch_size=1, flush_interval=0, max_pending=2)
+        writer.ensure_started = lambda: None  # keep the flusher stopped
+
+        async def scenario():
+            await writer.write(1, self.room.rid, "seller_uid", "1", timezone.now())
+            await writer.write(2, self.room.rid, "seller_uid", "2", timezone.now())
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(writer.write(3, self.room.rid, "seller_uid", "3", timezone.now()), 0.1)
+
+        async_to_sync(scenario)()
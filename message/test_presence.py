@@ -0,0 +1,76 @@
+import time
+import unittest
+from django.test import SimpleTestCase
+from unittest.mock import patch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from message.presence import LocalPresence, RedisPresence, room_key
+
+class PresenceBackendTests:
+    """Behaviour shared by every presence backend."""
+
+    def make_presence(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.presence = self.make_presence()
+
+    def test_join_and_leave_room(self):
+        key = room_key(1)
+        self.presence.touch(key, "alice", "tab-1")
+        self.assertTrue(self.presence.is_present(key, "alice"))
+        self.assertFalse(self.presence.is_present(key, "bob"))
+        self.assertFalse(self.presence.is_present(room_key(2), "alice"))
+
+        self.assertTrue(self.presence.leave(key, "alice", "tab-1"))
+        self.assertFalse(self.presence.is_present(key, "alice"))
+
+    def test_user_stays_present_until_their_last_connection_leaves(self):
+        key = room_key(1)
+        self.presence.touch(key, "alice", "tab-1")
+        self.presence.touch(key, "alice", "tab-2")
+        self.assertFalse(self.presence.leave(key, "alice", "tab-1"))
+        self.assertTrue(self.presence.is_present(key, "alice"))
+        self.assertTrue(self.presence.leave(key, "alice", "tab-2"))
+        self.assertFalse(self.presence.is_present(key, "alice"))
+
+    def test_expired_connection_does_not_keep_the_user_present(self):
+        key = room_key(1)
+        self.presence.touch(key, "alice", "crashed-worker")
+        later = time.time() + self.presence.ttl + 1
+        with patch("message.presence.time.time", return_value=later):
+            self.presence.touch(key, "alice", "tab-1")
+            self.assertTrue(self.presence.leave(key, "alice", "tab-1"))
+            self.assertFalse(self.presence.is_present(key, "alice"))
+
+    def test_bulk_lookup(self):
+        key = room_key(1)
+        self.presence.touch(key, "alice", "tab-1")
+        self.presence.touch(key, "bob", "tab-1")
+        self.assertEqual(self.presence.present_among(key, ["alice", "carol"]), {"alice"})
+        self.assertEqual(self.presence.members(key), {"alice", "bob"})
+        self.assertEqual(self.presence.present_among(key, []), set())
+
+    def test_presence_expires_without_heartbeat(self):
+        key = room_key(1)
+        self.presence.touch(key, "alice", "tab-1")
+        later = time.time() + self.presence.ttl + 1
+        with patch("message.presence.time.time", return_value=later):
+            self.assertFalse(self.presence.is_present(key, "alice"))
+            self.assertEqual(self.presence.members(key), set())
+            # A heartbeat brings the user back.
+            self.presence.touch(key, "alice", "tab-1")
+            self.assertTrue(self.presence.is_present(key, "alice"))
+
+class LocalPresenceTests(PresenceBackendTests, SimpleTestCase):
+    def make_presence(self):
+        return LocalPresence(ttl=60)
+
+@unittest.skipIf(fakeredis is None, "fakeredis is required for the Redis presence tests")
+class RedisPresenceTests(PresenceBackendTests, SimpleTestCase):
+    def make_presence(self):
+        return RedisPresence(fakeredis.FakeRedis(), ttl=60)
@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime, timezone
+from django.test import SimpleTestCase
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from message.replay import LocalReplayBuffer, RedisReplayBuffer
+
+
+def message(mid):
+    return {
+        "mid": mid, "room": 1, "sender": "seller_uid", "senderName": "Seller",
+        "content": f"Message {mid}", "timeSent": datetime(2026, 1, 1, tzinfo=timezone.utc),
+    }
+
+
+class ReplayBufferBackendTests:
+    """Behaviour shared by both replay buffer backends."""
+
+    def make_buffer(self, size):
+        raise NotImplementedError
+
+    def test_replays_messages_after_the_last_seen_one(self):
+        buffer = self.make_buffer(size=10)
+        buffer.append(1, [message(5), message(6)])
+        buffer.append(1, [message(9)])
+        messages, covered = buffer.since(1, 5)
+        self.assertTrue(covered)
+        self.assertEqual([m["mid"] for m in messages], [6, 9])
+        self.assertEqual(messages[0], message(6))
+
+    def test_coverage_ends_where_the_buffer_starts_or_was_trimmed(self):
+        buffer = self.make_buffer(size=3)
+        self.assertFalse(buffer.since(1, 0)[1])
+
+        buffer.append(1, [message(10), message(11)])
+        # Messages before the first buffered one may exist only in the database
+        self.assertFalse(buffer.since(1, 8)[1])
+        self.assertTrue(buffer.since(1, 9)[1])
+
+        buffer.append(1, [message(12), message(13), message(14)])
+        messages, covered = buffer.since(1, 10)
+        self.assertFalse(covered)
+        self.assertEqual([m["mid"] for m in messages], [12, 13, 14])
+        self.assertTrue(buffer.since(1, 11)[1])
+
+
+class LocalReplayBufferTests(ReplayBufferBackendTests, SimpleTestCase):
+    def make_buffer(self, size):
+        return LocalReplayBuffer(size=size)
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is required for the Redis replay buffer tests")
+class RedisReplayBufferTests(ReplayBufferBackendTests, SimpleTestCase):
+    def make_buffer(self, size):
+        return RedisReplayBuffer(fakeredis.FakeRedis(), size=size)
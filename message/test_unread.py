@@ -0,0 +1,129 @@
+import unittest
+from django.test import SimpleTestCase, TestCase
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from listing.models import Listing
+from message.models import Message, Room, RoomMembership
+from message.unread import LocalUnreadCounters, RedisUnreadCounters, get_unread_counters, mark_read, unread_counts
+from user.models import User
+
+
+class UnreadCountersBackendTests:
+    """Behaviour shared by both unread counter backends."""
+
+    def make_counters(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.counters = self.make_counters()
+
+    def test_increments_are_skipped_until_loaded(self):
+        self.counters.incr("buyer_uid", 1, 3)
+        self.assertIsNone(self.counters.get("buyer_uid"))
+
+        self.counters.load("buyer_uid", {1: 2}, self.counters.generation("buyer_uid"))
+        self.counters.incr("buyer_uid", 1, 3)
+        self.counters.incr("buyer_uid", 2, 1)
+        self.assertEqual(self.counters.get("buyer_uid"), {1: 5, 2: 1})
+
+    def test_load_is_dropped_if_counts_changed_meanwhile(self):
+        generation = self.counters.generation("buyer_uid")
+        # An increment lands between the database read and the load
+        self.counters.incr("buyer_uid", 1, 1)
+        self.assertFalse(self.counters.load("buyer_uid", {1: 2}, generation))
+        self.assertIsNone(self.counters.get("buyer_uid"))
+
+        self.assertTrue(self.counters.load("buyer_uid", {1: 3}, self.counters.generation("buyer_uid")))
+        self.assertEqual(self.counters.get("buyer_uid"), {1: 3})
+
+    def test_invalidate_forces_a_reload(self):
+        generation = self.counters.generation("buyer_uid")
+        self.counters.load("buyer_uid", {1: 4}, generation)
+        self.counters.invalidate("buyer_uid")
+        self.assertIsNone(self.counters.get("buyer_uid"))
+        self.assertFalse(self.counters.load("buyer_uid", {1: 4}, generation))
+
+    def test_empty_load_is_still_loaded(self):
+        self.counters.load("buyer_uid", {}, self.counters.generation("buyer_uid"))
+        self.assertEqual(self.counters.get("buyer_uid"), {})
+
+
+class LocalUnreadCountersTests(UnreadCountersBackendTests, SimpleTestCase):
+    def make_counters(self):
+        return LocalUnreadCounters()
+
+@unittest.skipIf(fakeredis is None, "fakeredis[lua] is required for the Redis unread counter tests")
+class RedisUnreadCountersTests(UnreadCountersBackendTests, SimpleTestCase):
+    def make_counters(self):
+        return RedisUnreadCounters(fakeredis.FakeRedis())
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        get_unread_counters().clear()
+        self.seller = User.objects.create(uid="seller_uid", email="seller@example.com", displayName="Seller")
+        self.buyer = User.objects.create(uid="buyer_uid", email="buyer@example.com", displayName="Buyer")
+        self.listing = Listing.objects.create(
+            title="Desk",
+            description="A desk",
+            price=10.0,
+            original_price=10.0,
+            category="Test",
+            user=self.seller
+        )
+        self.room = Room.objects.create(seller=self.seller, buyer=self.buyer, listing=self.listing)
+
+    def tearDown(self):
+        get_unread_counters().clear()
+
+    def membership(self, user):
+        return RoomMembership.objects.get(room=self.room, user=user)
+
+    def test_counts_follow_saves_and_reads(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            messages = [Message.objects.create(room=self.room, sender=self.seller, content=f"{i}") for i in range(3)]
+            Message.objects.create(room=self.room, sender=self.buyer, content="reply")
+        self.assertEqual(self.membership(self.buyer).unreadCount, 3)
+        self.assertEqual(self.membership(self.seller).unreadCount, 1)
+        self.assertEqual(unread_counts("buyer_uid"), {self.room.rid: 3})
+
+        # Reading up to the second message leaves one unread
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(mark_read(self.room.rid, "buyer_uid", messages[1].mid), 1)
+        self.assertEqual(self.membership(self.buyer).unreadCount, 1)
+        self.assertEqual(unread_counts("buyer_uid"), {self.room.rid: 1})
+
+        # The cursor never moves backwards, and foreign mids are ignored
+        self.assertIsNone(mark_read(self.room.rid, "buyer_uid", messages[0].mid))
+        self.assertIsNone(mark_read(self.room.rid, "buyer_uid", 10**6))
+        self.assertEqual(self.membership(self.buyer).lastReadMid, messages[1].mid)
+
+    def test_counts_are_served_without_querying_once_loaded(self):
+        Message.objects.create(room=self.room, sender=self.seller, content="Hello")
+        unread_counts("buyer_uid")
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_counts("buyer_uid"), {self.room.rid: 1})
+
+    def test_read_message_committed_late_is_not_counted(self):
+        stored = Message.objects.create(room=self.room, sender=self.seller, content="Stored")
+        # Allocated first but still queued in another worker's writer
+        late_mid = stored.mid + 1
+        with self.captureOnCommitCallbacks(execute=True):
+            newer = Message.objects.create(mid=stored.mid + 2, room=self.room, sender=self.seller, content="Newer")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(mark_read(self.room.rid, "buyer_uid", newer.mid), 0)
+
+        # The buyer read past it, so it is not counted when it is stored
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(mid=late_mid, room=self.room, sender=self.seller, content="Late")
+        self.assertEqual(self.membership(self.buyer).unreadCount, 0)
+        self.assertEqual(unread_counts("buyer_uid"), {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(room=self.room, sender=self.seller, content="Newest")
+        self.assertEqual(self.membership(self.buyer).unreadCount, 1)
+        self.assertEqual(unread_counts("buyer_uid"), {self.room.rid: 1})
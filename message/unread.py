@@ -0,0 +1,277 @@
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from message.models import Message, RoomMembership
+from server.backends import shared_backend
+
+UNREAD_TTL = getattr(settings, "UNREAD_COUNTERS_TTL", 24 * 60 * 60)
+# A chat socket moves its reader's cursor at most once per this many
+# seconds; read frames in between only raise the mid it moves to.
+READ_FLUSH_INTERVAL = getattr(settings, "CHAT_READ_FLUSH_INTERVAL", 1.0)
+# Marks a user's hash as fully loaded from the database
+LOADED_FIELD = "loaded"
+
+
+def unread_key(uid):
+    return f"unread:{uid}"
+
+
+def generation_key(uid):
+    return f"unread:generation:{uid}"
+
+
+# Applies a delta to a loaded hash and bumps the user's generation, so a
+# load that read the database before this change is discarded.
+# KEYS: hash, generation. ARGV: loaded field, room id, delta, ttl.
+INCR = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[2], ARGV[3])
+end
+return false
+"""
+
+# Fills the hash only if nothing changed since the caller read the
+# generation. KEYS: hash, generation. ARGV: generation, ttl, loaded field,
+# then (room id, count) pairs.
+LOAD = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], ARGV[3], 1)
+for i = 4, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class RedisUnreadCounters:
+    """
+    Per-user unread counts shared by every worker: one hash per user mapping
+    room id to count. Hashes are filled from RoomMembership on first read
+    and then kept current with HINCRBY deltas, so reading badges never
+    touches the message tables. Counts are never written as absolute
+    values: every change bumps a per-user generation, and a load whose
+    database read may predate a change is dropped instead of overwriting it.
+    """
+
+    def __init__(self, client, ttl=UNREAD_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.incr_script = client.register_script(INCR)
+        self.load_script = client.register_script(LOAD)
+
+    def incr(self, uid, rid, amount):
+        self.incr_script(keys=[unread_key(uid), generation_key(uid)], args=[LOADED_FIELD, rid, amount, self.ttl])
+
+    def invalidate(self, uid):
+        """Drop the user's counts; the next read loads them from the database."""
+        pipe = self.client.pipeline()
+        pipe.delete(unread_key(uid))
+        pipe.incr(generation_key(uid))
+        pipe.expire(generation_key(uid), self.ttl)
+        pipe.execute()
+
+    def generation(self, uid):
+        return int(self.client.get(generation_key(uid)) or 0)
+
+    def get(self, uid):
+        values = {
+            (field.decode() if isinstance(field, bytes) else field): int(count)
+            for field, count in self.client.hgetall(unread_key(uid)).items()
+        }
+        if values.pop(LOADED_FIELD, None) is None:
+            return None
+        return {int(rid): count for rid, count in values.items()}
+
+    def load(self, uid, counts, generation):
+        """Cache counts read from the database after `generation()` returned `generation`."""
+        args = [generation, self.ttl, LOADED_FIELD]
+        for rid, count in counts.items():
+            args += [rid, count]
+        return bool(self.load_script(keys=[unread_key(uid), generation_key(uid)], args=args))
+
+
+class LocalUnreadCounters:
+    """The unread counts of RedisUnreadCounters, kept in this process."""
+
+    def __init__(self):
+        self._counts = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def incr(self, uid, rid, amount):
+        with self._lock:
+            self._generations[uid] = self._generations.get(uid, 0) + 1
+            if uid in self._counts:
+                self._counts[uid][rid] = self._counts[uid].get(rid, 0) + amount
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._generations[uid] = self._generations.get(uid, 0) + 1
+            self._counts.pop(uid, None)
+
+    def generation(self, uid):
+        with self._lock:
+            return self._generations.get(uid, 0)
+
+    def get(self, uid):
+        with self._lock:
+            counts = self._counts.get(uid)
+            return dict(counts) if counts is not None else None
+
+    def load(self, uid, counts, generation):
+        with self._lock:
+            if self._generations.get(uid, 0) != generation:
+                return False
+            self._counts[uid] = dict(counts)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._generations.clear()
+
+
+get_unread_counters = shared_backend(RedisUnreadCounters, LocalUnreadCounters)
+
+
+def count_new_messages(messages):
+    """
+    Add newly saved messages to the other participants' unread counters.
+    Only messages after a participant's read cursor count, so a message
+    they already read is not added: another worker's batch can commit
+    after a later message was broadcast and read. One UPDATE per (room, sender) in the
+    batch, plus one read-back. Redis gets the deltas once the transaction
+    commits. Returns [(uid, rid, unreadCount), ...] for every counter that
+    changed, for pushing to the clients.
+    """
+    batch = {}
+    for message in messages:
+        batch.setdefault((message.room_id, message.sender_id), []).append(message.mid)
+    if not batch:
+        return []
+    with transaction.atomic():
+        updates, increments = add_unread(batch)
+
+    def incr_counters():
+        for uid, room_id, received in increments:
+            get_unread_counters().incr(uid, room_id, received)
+
+    transaction.on_commit(incr_counters)
+    return updates
+
+
+def add_unread(batch):
+    """
+    Apply {(room id, sender): [mid, ...]} to the memberships. The updated
+    rows stay locked until the caller's transaction ends, so the cursors
+    read back are the ones the UPDATE saw.
+    """
+    for (room_id, sender_id), mids in batch.items():
+        mids.sort()
+        # Members who read up to before mids[i] have len(mids) - i new messages
+        added = Case(
+            *[When(lastReadMid__lt=mid, then=Value(len(mids) - i)) for i, mid in enumerate(mids)],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        RoomMembership.objects.filter(room_id=room_id, lastReadMid__lt=mids[-1]).exclude(user_id=sender_id).update(
+            unreadCount=F("unreadCount") + added
+        )
+
+    updates = []
+    increments = []
+    memberships = RoomMembership.objects.filter(room_id__in={room_id for room_id, _ in batch}).values_list(
+        "room_id", "user_id", "lastReadMid", "unreadCount"
+    )
+    for room_id, uid, last_read_mid, count in memberships:
+        received = sum(
+            1 for (rid, sender_id), mids in batch.items() if rid == room_id and sender_id != uid
+            for mid in mids if mid > last_read_mid
+        )
+        if received:
+            increments.append((uid, room_id, received))
+            updates.append((uid, room_id, count))
+    return updates, increments
+
+
+def mark_read(room_id, uid, mid, verified=False):
+    """
+    Advance the user's read cursor in the room (never backwards) and set
+    their unread count to the messages still after it. The count is
+    computed by the same UPDATE, so a message stored concurrently is never
+    overwritten. `mid` must be a stored message of the room (messages are
+    only broadcast once stored); callers that just read it from the room
+    pass `verified`. Returns the new count, or None when the cursor did not
+    move or `mid` is unknown.
+    """
+    if not verified and not Message.objects.filter(room_id=room_id, mid=mid).exists():
+        return None
+    remaining = Message.objects.filter(room_id=room_id, mid__gt=mid).exclude(sender_id=uid).values(
+        "room_id"
+    ).annotate(count=Count("mid")).values("count")
+    moved = RoomMembership.objects.filter(room_id=room_id, user_id=uid, lastReadMid__lt=mid).update(
+        lastReadMid=mid, unreadCount=Coalesce(Subquery(remaining), 0)
+    )
+    if not moved:
+        return None
+    transaction.on_commit(lambda: get_unread_counters().invalidate(uid))
+    return RoomMembership.objects.filter(room_id=room_id, user_id=uid).values_list("unreadCount", flat=True).first()
+
+
+async def amark_read(room_id, uid, mid):
+    """mark_read for the websocket consumers."""
+    return await database_sync_to_async(mark_read)(room_id, uid, mid)
+
+
+def unread_counts(uid):
+    """Unread count per room id for the user, from Redis when loaded."""
+    counters = get_unread_counters()
+    counts = counters.get(uid)
+    if counts is None:
+        generation = counters.generation(uid)
+        counts = dict(RoomMembership.objects.filter(user_id=uid, unreadCount__gt=0).values_list("room_id", "unreadCount"))
+        counters.load(uid, counts, generation)
+    return {rid: count for rid, count in counts.items() if count > 0}
+
+
+def unread_event(rid, count):
+    """Channel layer event telling a user's notification socket a new count."""
+    return {"type": "unread_update", "room": rid, "unreadCount": count}
+
+
+def read_receipt_event(rid, uid, mid):
+    """Channel layer event telling a chat room that `uid` has read up to `mid`."""
+    return {"type": "read_receipt", "room": rid, "uid": uid, "mid": mid}
+
+
+async def apublish_unread(updates):
+    """Push new unread counts to the users' notification sockets."""
+    channel_layer = get_channel_layer()
+    for uid, rid, count in updates:
+        await channel_layer.group_send(f"user_notifications_{uid}", unread_event(rid, count))
+
+
+async def apublish_read(rid, uid, mid, count):
+    """
+    Tell the room that `uid` read up to `mid` (read receipt), and the user's
+    other devices their new unread count.
+    """
+    await get_channel_layer().group_send(f"chat_{rid}", read_receipt_event(rid, uid, mid))
+    await apublish_unread([(uid, rid, count)])
+
+
+def publish_read(rid, uid, mid, count):
+    async_to_sync(apublish_read)(rid, uid, mid, count)
@@ -1,4 +1,4 @@
-from message.views import get_messages, get_or_create_room, get_rooms, get_room
+from message.views import get_messages, get_or_create_room, get_rooms, get_room, get_unread_counts
 from django.urls import path
 
 urlpatterns = [
@@ -6,4 +6,5 @@ urlpatterns = [
     path('get_room/<int:room_id>/', get_room, name="get_room"),
     path('get_or_create_room/', get_or_create_room, name="get_or_create_room"),
     path('get_messages/<int:room_id>/', get_messages, name="get_messages"),
+    path('get_unread_counts/', get_unread_counts, name="get_unread_counts"),
 ]
\ No newline at end of file
@@ -3,11 +3,16 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 
+from listing.analytics import record_event
 from listing.models import Listing
 from message.serializers import CreateRoomSerializer
 from server.authentication import FirebaseEmailVerifiedAuthentication
 from user.models import User
+from message.inbox import InvalidInboxParameter, inbox_entries, inbox_page
+from message.history import InvalidHistoryParameter, messages_before, messages_since, room_messages, serialize_message
 from message.models import Room, Message
+from message.presence import online_users
+from message.unread import mark_read, publish_read, unread_counts
 
 @api_view(["GET"])
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
@@ -32,24 +37,34 @@ def get_room(request, room_id):
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([IsAuthenticated])
 def get_rooms(request):
-    user = User.objects.get(uid=request.user.username)
-    rooms = Room.objects.filter(seller=user) | Room.objects.filter(buyer=user)
-    response = []
+    """
+    Fetch the user's inbox: rooms with messages, most recent first, each
+    with its latest message and unread count.
+    - If `cursor` or `limit` is provided, return one keyset-paginated page as
+      {"rooms": [...], "nextCursor": ...}.
+    - Otherwise return every room as {"rooms": [...]}.
+    """
+    user = request.user.account
+    cursor = request.query_params.get("cursor", None)
+    limit = request.query_params.get("limit", None)
+
+    next_cursor = None
+    if cursor is None and limit is None:
+        rooms = list(inbox_entries(user))
+    else:
+        try:
+            rooms, next_cursor = inbox_page(user, cursor=cursor, limit=limit)
+        except InvalidInboxParameter as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    online = online_users({uid for room in rooms for uid in (room["sellerId"], room["buyerId"])})
     for room in rooms:
-        recent_message = Message.objects.filter(room=room).order_by('-timeSent').first()
-        if recent_message:
-            response.append({
-                "rid": room.rid,
-                "seller": room.seller.displayName,
-                "buyer": room.buyer.displayName,
-                "listingName": room.listing.title,
-                "listingId": room.listing.id,
-                "recentMessage": recent_message.content if recent_message else None,
-                "timeSent": recent_message.timeSent if recent_message else None,
-            })
+        room["sellerOnline"] = room.pop("sellerId") in online
+        room["buyerOnline"] = room.pop("buyerId") in online
 
-    response.sort(key=lambda x: x["timeSent"], reverse=True)
-    return Response({"rooms": response}, status=status.HTTP_200_OK)
+    if cursor is None and limit is None:
+        return Response({"rooms": rooms}, status=status.HTTP_200_OK)
+    return Response({"rooms": rooms, "nextCursor": next_cursor}, status=status.HTTP_200_OK)
 
 @api_view(["POST"])
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
@@ -71,21 +86,71 @@ def get_or_create_room(request):
     # Create the room
     room = Room.objects.create(seller=seller, buyer=buyer, listing=listing)
     room.save()
+    record_event("chat", listing.id)
     return Response({"rid": room.rid}, status=status.HTTP_201_CREATED)
 
 @api_view(["GET"])
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([IsAuthenticated])
 def get_messages(request, room_id):
-    room = Room.objects.get(rid=room_id)
-    if request.user.username != room.seller.uid and request.user.username != room.buyer.uid:
+    """
+    Fetch the message history of a room.
+    - `since=<mid>` returns the messages after that message, oldest first,
+      as {"messages": [...], "hasMore": ..., "nextSince": <mid>}. Pass
+      `nextSince` as the next `since`; messages after it may be repeated.
+    - `before=<mid>` and/or `limit` return one page, newest first, of the
+      latest messages (older than `before` if given) in the same shape.
+    - Otherwise fall back to the legacy full history, oldest first.
+    """
+    try:
+        room = Room.objects.get(rid=room_id)
+    except Room.DoesNotExist:
+        return Response({"error": "Room not found"}, status=status.HTTP_404_NOT_FOUND)
+    if request.user.username not in (room.seller_id, room.buyer_id):
         return Response({"error": "You are not part of this room"}, status=status.HTTP_400_BAD_REQUEST)
-    messages = Message.objects.filter(room=room).order_by('timeSent')
-    response = []
-    for message in messages:
-        response.append({
-            "sender": message.sender.displayName,
-            "content": message.content,
-            "timeSent": message.timeSent,
-        })
-    return Response({"messages": response}, status=status.HTTP_200_OK)
\ No newline at end of file
+
+    before = request.query_params.get("before", None)
+    since = request.query_params.get("since", None)
+    limit = request.query_params.get("limit", None)
+
+    if before is None and since is None and limit is None:
+        # Compatibility mode for clients that expect the whole history
+        # Read-only, like the endpoint it replaces, so prefetches and retries
+        # leave the read cursor alone
+        messages = [serialize_message(message) for message in room_messages(room)]
+        return Response({"messages": messages}, status=status.HTTP_200_OK)
+
+    try:
+        if since is not None:
+            if before is not None:
+                raise InvalidHistoryParameter("Use either before or since, not both.")
+            page, has_more, next_since = messages_since(room, since, limit)
+            newest = page[-1] if page else None
+            extra = {"nextSince": next_since}
+        else:
+            page, has_more = messages_before(room, before, limit)
+            newest = page[0] if page and before is None else None
+            extra = {}
+    except InvalidHistoryParameter as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Fetching the newest messages of a room marks them read
+    if newest is not None:
+        read_up_to(room, request.user.username, newest.mid)
+
+    messages = [serialize_message(message) for message in page]
+    return Response({"messages": messages, "hasMore": has_more, **extra}, status=status.HTTP_200_OK)
+
+def read_up_to(room, uid, mid):
+    """Move the reader's cursor to a message just read and tell the room and their other devices."""
+    count = mark_read(room.rid, uid, mid, verified=True)
+    if count is not None:
+        publish_read(room.rid, uid, mid, count)
+
+@api_view(["GET"])
+@authentication_classes([FirebaseEmailVerifiedAuthentication])
+@permission_classes([IsAuthenticated])
+def get_unread_counts(request):
+    """Fetch the user's unread message count per room, for badges."""
+    counts = unread_counts(request.user.username)
+    return Response({"rooms": counts, "total": sum(counts.values())}, status=status.HTTP_200_OK)
@@ -96,12 +96,10 @@ def ban_user(request, uid):
     Ban a user by setting their 'banned' flag to True. Admin-only.
     Also deletes all reports against the user.
     """
-    try:
-        requester = User.objects.get(uid=request.user.username)
-    except User.DoesNotExist:
+    if not request.user.exists:
         return Response({"error": "Invalid requester."}, status=status.HTTP_403_FORBIDDEN)
 
-    if not requester.admin:
+    if not request.user.admin:
         return Response({"error": "Permission denied."}, status=status.HTTP_403_FORBIDDEN)
 
     try:
@@ -1,22 +1,18 @@
-import firebase_admin
-from firebase_admin import auth
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from django.contrib.auth.models import User
-from user.models import User as BoilerMarketUser
+from server.firebase_tokens import bearer_token, verify_id_token
+from server.principals import get_principal
 
 
 class FirebaseEmailVerifiedAuthentication(BaseAuthentication):
     def authenticate(self, request):
-        auth_header = request.headers.get("Authorization")
+        id_token = bearer_token(request.headers.get("Authorization"))
 
-        if not auth_header:
+        if not id_token:
             return None
-        
-        id_token = auth_header.split(" ")[-1]
 
         try:
-            decoded_token = auth.verify_id_token(id_token)
+            decoded_token = verify_id_token(id_token)
         except Exception:
             raise AuthenticationFailed("Invalid or expired Firebase token")
         
@@ -25,44 +21,39 @@ class FirebaseEmailVerifiedAuthentication(BaseAuthentication):
 
         if not email_verified:
             raise AuthenticationFailed("Email not verified")
-        boiler_market_user = BoilerMarketUser.objects.get(uid=uid)
-        if not boiler_market_user:
+        principal = get_principal(uid)
+        if not principal.exists:
             raise AuthenticationFailed("User not found")
-        if not boiler_market_user.purdueEmailVerified:
+        if not principal.purdueEmailVerified:
             raise AuthenticationFailed("Purdue email not verified")
         
-        user, created = User.objects.get_or_create(username=uid)
-        return (user, None)
+        return (principal, None)
     
 class AdminFirebaseAuthentication(FirebaseEmailVerifiedAuthentication):
     def authenticate(self, request):
         result = super().authenticate(request)
         if result is None:
             return None
-        user, _ = result
-        boiler_market_user = BoilerMarketUser.objects.get(uid=user.username)
-        if not boiler_market_user.admin:
+        principal, _ = result
+        if not principal.admin:
             raise AuthenticationFailed("User is not an admin")
         return result
 
 class FirebaseAuthentication(BaseAuthentication):
     def authenticate(self, request):
-        auth_header = request.headers.get("Authorization")
+        id_token = bearer_token(request.headers.get("Authorization"))  # Extract token after "Bearer"
 
-        if not auth_header:
+        if not id_token:
             return None  # No token provided
 
-        id_token = auth_header.split(" ")[-1]  # Extract token after "Bearer"
-
         try:
-            decoded_token = auth.verify_id_token(id_token)
+            decoded_token = verify_id_token(id_token)
         except Exception:
             raise AuthenticationFailed("Invalid or expired Firebase token")
 
         uid = decoded_token.get("uid")
 
-        # Check if the user exists in Django's User model, create if not
-        user, created = User.objects.get_or_create(username=uid)
-
-        return (user, None)  # DRF requires (user, auth)
+        # The BoilerMarket account may not exist yet (e.g. during sign-up)
+        principal = get_principal(uid)
 
+        return (principal, None)  # DRF requires (user, auth)
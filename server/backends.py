@@ -0,0 +1,83 @@
+import threading
+import uuid
+
+from django.conf import settings
+
+# Ends a claim if this worker still holds its lock, deleting the claimed
+# keys when their contents were handled. KEYS: lock, claimed keys.
+# ARGV: token, handled.
+RELEASE = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '1' and #KEYS > 1 then
+    redis.call('DEL', unpack(KEYS, 2))
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+
+def redis_enabled():
+    return settings.CACHES["default"]["BACKEND"].startswith("django_redis")
+
+
+def shared_backend(redis_backend, local_backend, redis_url=None):
+    """
+    A get_<backend>() function returning one instance per process, created
+    on first use. State shared by every worker (view counts, presence,
+    unread counters...) lives in Redis: `redis_backend(client)` gets the
+    default cache's connection, or one to `redis_url` when that is set.
+    When the default cache is not Redis (local development and tests),
+    `local_backend()` is used instead; local backends keep the same
+    semantics in process memory.
+    """
+    instance = None
+    lock = threading.Lock()
+
+    def get_backend():
+        nonlocal instance
+        with lock:
+            if instance is None:
+                if redis_url:
+                    import redis
+                    instance = redis_backend(redis.Redis.from_url(redis_url))
+                elif redis_enabled():
+                    from django_redis import get_redis_connection
+                    instance = redis_backend(get_redis_connection("default"))
+                else:
+                    instance = local_backend()
+        return instance
+
+    return get_backend
+
+
+class RedisClaim:
+    """
+    Lets one worker at a time claim a batch of buffered work (view counts
+    to flush, events to roll up). The batch is moved aside under
+    `claimed_keys` by the caller's own script once `acquire()` succeeds,
+    and stays there until `release(done=True)`, so a worker that fails
+    leaves it for the next claim instead of losing it. The lock expires
+    after `ttl` seconds in case the worker dies; a release after that is
+    ignored.
+    """
+
+    def __init__(self, client, lock_key, claimed_keys, ttl):
+        self.client = client
+        self.lock_key = lock_key
+        self.claimed_keys = list(claimed_keys)
+        self.ttl = ttl
+        self.release_script = client.register_script(RELEASE)
+        self.token = None
+
+    def acquire(self):
+        """Take the lock. Returns its token, or None when another worker holds it."""
+        token = uuid.uuid4().hex
+        if not self.client.set(self.lock_key, token, nx=True, ex=self.ttl):
+            return None
+        self.token = token
+        return token
+
+    def release(self, done):
+        self.release_script(keys=[self.lock_key, *self.claimed_keys], args=[self.token, "1" if done else "0"])
+        self.token = None
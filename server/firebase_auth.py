@@ -1,8 +1,7 @@
 # server/authentication.py
-import firebase_admin
-from firebase_admin import auth
 from django.http import JsonResponse
 from functools import wraps
+from server.firebase_tokens import verify_id_token
 from user.models import User
 
 def firebase_required(view_func):
@@ -17,7 +16,7 @@ def firebase_required(view_func):
             if len(parts) != 2 or parts[0] != "Bearer":
                 return JsonResponse({"error": "Invalid Authorization header format. Expected 'Bearer <token>'."}, status=401)
             token = parts[1]
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = verify_id_token(token)
             uid = decoded_token.get("uid") or decoded_token.get("sub")
             user = User.objects.get(uid=uid)
             request.user = user
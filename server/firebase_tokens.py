@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from firebase_admin import auth
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of decoded Firebase ID token claims, keyed by a hash of the
+    token so raw tokens are never kept in memory. Entries expire at the
+    token's own `exp`.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(id_token):
+        return hashlib.sha256(id_token.encode()).hexdigest()
+
+    def get(self, id_token):
+        key = self.key(id_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def set(self, id_token, claims):
+        expires_at = claims.get("exp")
+        # Only tokens that carry an expiry are safe to cache.
+        if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+            return
+        key = self.key(id_token)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = VerifiedTokenCache(getattr(settings, "FIREBASE_TOKEN_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+
+
+def bearer_token(auth_header):
+    """
+    Extract the token from an "Authorization: Bearer <token>" header value.
+    """
+    if not auth_header:
+        return None
+    return auth_header.split(" ")[-1]
+
+
+def verify_id_token(id_token):
+    """
+    Verify a Firebase ID token, reusing the decoded claims for repeat
+    requests with the same token until it expires. Raises whatever
+    firebase_admin raises for invalid tokens.
+
+    Google's signing certificates are fetched by firebase_admin through a
+    Cache-Control aware session, so routing every verification through the
+    default app's verifier keeps those keys cached in-process as well.
+    """
+    claims = token_cache.get(id_token)
+    if claims is not None:
+        return claims
+    claims = auth.verify_id_token(id_token)
+    token_cache.set(id_token, claims)
+    return claims
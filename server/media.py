@@ -0,0 +1,181 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.encoding import filepath_to_uri
+from PIL import Image, ImageOps, features
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name, safe_join
+
+# Longest side, in pixels, of each resized variant
+VARIANT_SIZES = getattr(settings, "MEDIA_VARIANT_SIZES", {"thumb": 320, "medium": 1080})
+# AVIF needs a Pillow built with libavif; WebP and JPEG are always written
+VARIANT_FORMATS = ("avif", "webp", "jpeg") if features.check("avif") else ("webp", "jpeg")
+VARIANT_QUALITY = getattr(settings, "MEDIA_VARIANT_QUALITY", 80)
+DEFAULT_VARIANT_FORMAT = "webp"
+VIDEO_EXTENSIONS = ("mp4", "mov")
+# Frame of a video used as its poster, in seconds from the start
+POSTER_OFFSET = getattr(settings, "MEDIA_POSTER_OFFSET", 1.0)
+PROCESSING_WORKERS = getattr(settings, "MEDIA_PROCESSING_WORKERS", 2)
+# Images beyond either limit are served as uploaded instead of being
+# decoded, which would need width * height * 3 bytes of memory
+MAX_IMAGE_BYTES = getattr(settings, "MEDIA_MAX_IMAGE_BYTES", 25 * 1024 * 1024)
+MAX_IMAGE_PIXELS = getattr(settings, "MEDIA_MAX_IMAGE_PIXELS", 50_000_000)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_video(name):
+    return os.path.splitext(name)[1].lstrip(".").lower() in VIDEO_EXTENSIONS
+
+
+def variant_key(name, version, label, fmt):
+    """
+    users/u/1/photo.jpg -> users/u/1/photo__<version>-thumb.webp, next to
+    the original. Each processing run has its own `version`, so a picture
+    uploaded again under the same name gets new variant URLs instead of
+    ones CDNs and browsers have already cached.
+    """
+    return f"{os.path.splitext(name)[0]}__{version}-{label}.{fmt}"
+
+
+def render_image_variants(source):
+    """
+    Resized copies of an image in every variant format: {label: {format: bytes}}.
+    `source` is a binary file object. Returns None when the image is larger
+    than MEDIA_MAX_IMAGE_PIXELS; only its header is read to find out.
+    """
+    with Image.open(source) as image:
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            return None
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    rendered = {}
+    for label, size in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        rendered[label] = {}
+        for fmt in VARIANT_FORMATS:
+            out = io.BytesIO()
+            resized.save(out, format=fmt.upper(), quality=VARIANT_QUALITY)
+            rendered[label][fmt] = out.getvalue()
+    return rendered
+
+
+def video_poster(source, name):
+    """
+    A JPEG frame of the video read from the file object `source`, or None
+    when ffmpeg is not installed or cannot read it. The video is copied to
+    a temporary file in chunks, never held in memory.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1]) as video:
+        for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+            video.write(chunk)
+        video.flush()
+        for offset in (POSTER_OFFSET, 0):
+            result = subprocess.run(
+                [ffmpeg, "-v", "error", "-ss", str(offset), "-i", video.name,
+                 "-frames:v", "1", "-f", "image2", "-c:v", "mjpeg", "pipe:1"],
+                capture_output=True,
+                timeout=60,
+            )
+            # Clips shorter than the offset produce no frame; retry from the start
+            if result.returncode == 0 and result.stdout:
+                return result.stdout
+    return None
+
+
+def process_media(storage, name):
+    """
+    Write the variants of the stored file `name` next to it and return
+    their keys as {"source": name, label: {format: key}, ...}. Videos are
+    given a poster frame (under "poster") whose resized copies become the
+    variants; without ffmpeg a video only gets {"source": name}, and so
+    does an image over MEDIA_MAX_IMAGE_BYTES or MEDIA_MAX_IMAGE_PIXELS.
+    """
+    variants = {"source": name}
+    version = uuid.uuid4().hex[:8]
+    if is_video(name):
+        with storage.open(name, "rb") as f:
+            poster = video_poster(f, name)
+        if poster is None:
+            return variants
+        variants["poster"] = storage.save(variant_key(name, version, "poster", "jpeg"), ContentFile(poster))
+        rendered = render_image_variants(io.BytesIO(poster))
+    else:
+        if storage.size(name) > MAX_IMAGE_BYTES:
+            print(f"Not resizing {name}: larger than {MAX_IMAGE_BYTES} bytes")
+            return variants
+        with storage.open(name, "rb") as f:
+            rendered = render_image_variants(f)
+    if rendered is None:
+        print(f"Not resizing {name}: larger than {MAX_IMAGE_PIXELS} pixels")
+        return variants
+
+    for label, formats in rendered.items():
+        variants[label] = {
+            fmt: storage.save(variant_key(name, version, label, fmt), ContentFile(content))
+            for fmt, content in formats.items()
+        }
+    return variants
+
+
+def variant_keys(variants):
+    """Every stored key in a variants dict, except the original file."""
+    keys = [variants["poster"]] if "poster" in variants else []
+    for label in VARIANT_SIZES:
+        keys += (variants.get(label) or {}).values()
+    return keys
+
+
+def variant_name(variants, label, fmt=DEFAULT_VARIANT_FORMAT):
+    """
+    Key of the `label` variant in `fmt` (falling back to any format), or
+    None when the file has not been processed yet.
+    """
+    formats = (variants or {}).get(label) or {}
+    return formats.get(fmt) or next(iter(formats.values()), None)
+
+
+@lru_cache(maxsize=8192)
+def public_url(protocol, host, location, name):
+    return f"{protocol}//{host}/{filepath_to_uri(safe_join(location, clean_name(name)))}"
+
+
+def media_url(storage, name):
+    """
+    Public URL of a stored file, built like S3Boto3Storage.url does for a
+    custom domain but memoized and without going through the storage. The
+    MEDIA_CDN_HOST setting, when set, takes precedence over
+    AWS_S3_CUSTOM_DOMAIN. Other storages, and S3 URLs that must be signed,
+    still come from storage.url().
+    """
+    if not name:
+        return None
+    if isinstance(storage, S3Boto3Storage):
+        host = getattr(settings, "MEDIA_CDN_HOST", None) or storage.custom_domain
+        if host and not (storage.querystring_auth and storage.cloudfront_signer):
+            return public_url(storage.url_protocol, host, storage.location, name)
+    return storage.url(name)
+
+
+_processor = None
+
+
+def get_media_processor():
+    """
+    Shared worker pool for media processing. Jobs run off the request
+    thread; Pillow releases the GIL while encoding, so threads scale.
+    """
+    global _processor
+    if _processor is None:
+        _processor = ThreadPoolExecutor(max_workers=PROCESSING_WORKERS, thread_name_prefix="media")
+    return _processor
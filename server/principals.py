@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from user.models import User as BoilerMarketUser
+
+PRINCIPAL_FIELDS = ("uid", "banned", "admin", "purdueEmailVerified")
+PRINCIPAL_CACHE_TTL = getattr(settings, "AUTH_PRINCIPAL_CACHE_TTL", 60)
+_MISSING = "missing"
+
+
+def principal_cache_key(uid):
+    return f"auth_principal:{uid}"
+
+
+class FirebasePrincipal:
+    """
+    The authenticated caller of a request (request.user / scope["user"]).
+
+    Carries the auth-relevant columns of the caller's BoilerMarket User row
+    so permission checks need no query. `account` is that row as a User
+    instance with only the primary key loaded: it can be used in filters and
+    relations, every other field is read fresh on first access, and `save()`
+    writes only the fields assigned since. The cached columns are never
+    copied into it, so a stale cached value cannot be written back.
+    `account` is None when the Firebase user has no BoilerMarket account yet.
+
+    The cache is invalidated by the User save/delete signals only; code that
+    changes banned, admin or purdueEmailVerified with `QuerySet.update()`
+    must call `invalidate_principal` itself or the old values are served
+    for up to PRINCIPAL_CACHE_TTL seconds.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, uid, values=None):
+        self.uid = uid
+        self.values = values
+
+    @property
+    def username(self):
+        return self.uid
+
+    @property
+    def exists(self):
+        return self.values is not None
+
+    @property
+    def banned(self):
+        return bool(self.values and self.values["banned"])
+
+    @property
+    def admin(self):
+        return bool(self.values and self.values["admin"])
+
+    @property
+    def purdueEmailVerified(self):
+        return bool(self.values and self.values["purdueEmailVerified"])
+
+    @property
+    def account(self):
+        if self.values is None:
+            return None
+        if not hasattr(self, "_account"):
+            self._account = BoilerMarketUser.from_db("default", ["uid"], [self.uid])
+        return self._account
+
+    def __str__(self):
+        return self.uid
+
+
+def get_principal(uid):
+    """
+    Build the principal for a verified Firebase uid, reading the User row
+    from the cache when possible.
+    """
+    key = principal_cache_key(uid)
+    values = cache.get(key)
+    if values is None:
+        row = BoilerMarketUser.objects.filter(uid=uid).values(*PRINCIPAL_FIELDS).first()
+        values = row if row is not None else _MISSING
+        cache.set(key, values, timeout=PRINCIPAL_CACHE_TTL)
+    return FirebasePrincipal(uid, None if values == _MISSING else values)
+
+
+def invalidate_principal(uid):
+    """Drop the cached principal of `uid`; needed after `QuerySet.update()` of PRINCIPAL_FIELDS."""
+    cache.delete(principal_cache_key(uid))
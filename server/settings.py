@@ -83,11 +83,40 @@ CACHES = {
 }
 
 ASGI_APPLICATION = "server.asgi.application"
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+
+# Websocket groups only reach consumers in other processes through Redis.
+# CHANNEL_REDIS_HOSTS is a comma-separated list of redis:// URLs; with more
+# than one host, channels and groups are sharded across them. Leave it unset
+# to fall back to the single-process in-memory layer for local development.
+CHANNEL_REDIS_HOSTS = [host.strip() for host in config('CHANNEL_REDIS_HOSTS', default='').split(',') if host.strip()]
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='channels_redis.core.RedisChannelLayer')
+
+if CHANNEL_REDIS_HOSTS:
+    CHANNEL_LAYER_CONFIG = {
+        "hosts": CHANNEL_REDIS_HOSTS,
+        "prefix": config('CHANNEL_LAYER_PREFIX', default='boilermarket'),
+    }
+    if CHANNEL_LAYER_BACKEND == 'channels_redis.core.RedisChannelLayer':
+        CHANNEL_LAYER_CONFIG.update({
+            # Messages buffered per channel before group_send starts dropping
+            "capacity": config('CHANNEL_LAYER_CAPACITY', default=1000, cast=int),
+            # Seconds an undelivered message lives in Redis
+            "expiry": config('CHANNEL_LAYER_EXPIRY', default=60, cast=int),
+            # Seconds before a channel that never left a group is dropped from it
+            "group_expiry": config('CHANNEL_LAYER_GROUP_EXPIRY', default=86400, cast=int),
+        })
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": CHANNEL_LAYER_BACKEND,
+            "CONFIG": CHANNEL_LAYER_CONFIG,
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
     }
-}
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
@@ -195,6 +224,8 @@ AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = 'boilermarket'
 AWS_S3_REGION_NAME = 'us-east-1'
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
+# Optional CDN in front of the bucket; media URLs use it instead when set
+MEDIA_CDN_HOST = config('MEDIA_CDN_HOST', default='')
 AWS_LOCATION = ''
 AWS_QUERYSTRING_AUTH = False
 
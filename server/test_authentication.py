@@ -0,0 +1,81 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIRequestFactory
+from unittest.mock import patch
+from server.authentication import AdminFirebaseAuthentication, FirebaseAuthentication, FirebaseEmailVerifiedAuthentication
+from user.models import User
+
+def dummy_verify_id_token(token):
+    return {
+        "uid": "dummy_uid",
+        "email_verified": True
+    }
+
+class FirebasePrincipalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            purdueEmail="fake@purdue.edu",
+            purdueEmailVerified=True
+        )
+        self.request = APIRequestFactory().get("/", HTTP_AUTHORIZATION="Bearer dummy_token")
+
+    def tearDown(self):
+        cache.clear()
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_warm_authentication_runs_no_queries(self, mock_verify):
+        principal, _ = FirebaseEmailVerifiedAuthentication().authenticate(self.request)
+        self.assertEqual(principal.username, "dummy_uid")
+
+        with self.assertNumQueries(0):
+            principal, _ = FirebaseEmailVerifiedAuthentication().authenticate(self.request)
+            self.assertEqual(principal.account.pk, self.user.pk)
+            self.assertFalse(principal.banned)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_principal_is_invalidated_when_user_changes(self, mock_verify):
+        with self.assertRaises(AuthenticationFailed):
+            AdminFirebaseAuthentication().authenticate(self.request)
+
+        self.user.admin = True
+        self.user.save()
+        principal, _ = AdminFirebaseAuthentication().authenticate(self.request)
+        self.assertTrue(principal.admin)
+
+        self.user.purdueEmailVerified = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            FirebaseEmailVerifiedAuthentication().authenticate(self.request)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_account_never_writes_back_cached_columns(self, mock_verify):
+        self.user.banned = True
+        self.user.save()
+        principal, _ = FirebaseEmailVerifiedAuthentication().authenticate(self.request)
+        self.assertTrue(principal.banned)
+
+        # An unban that bypasses the signals leaves the cached principal stale
+        User.objects.filter(uid="dummy_uid").update(banned=False)
+        account = principal.account
+        account.appeal = "Please unban me"
+        account.save()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.banned, self.user.appeal), (False, "Please unban me"))
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_principal_without_account(self, mock_verify):
+        self.user.delete()
+        principal, _ = FirebaseAuthentication().authenticate(self.request)
+        self.assertTrue(principal.is_authenticated)
+        self.assertIsNone(principal.account)
+        with self.assertRaises(AuthenticationFailed):
+            FirebaseEmailVerifiedAuthentication().authenticate(self.request)
+
+        User.objects.create(uid="dummy_uid", email="dummy@example.com", displayName="Dummy User")
+        principal, _ = FirebaseAuthentication().authenticate(self.request)
+        self.assertEqual(principal.account.pk, "dummy_uid")
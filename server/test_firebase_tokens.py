@@ -0,0 +1,55 @@
+import time
+from django.test import SimpleTestCase
+from unittest.mock import patch
+from server.firebase_tokens import VerifiedTokenCache, token_cache, verify_id_token
+
+def dummy_verify_id_token(token):
+    return {
+        "uid": f"uid_for_{token}",
+        "email_verified": True,
+        "exp": time.time() + 3600
+    }
+
+class FirebaseTokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        token_cache.clear()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_token_verified_once_until_expiry(self, mock_verify):
+        first = verify_id_token("token_a")
+        second = verify_id_token("token_a")
+        self.assertEqual(first, second)
+        self.assertEqual(mock_verify.call_count, 1)
+
+        verify_id_token("token_b")
+        self.assertEqual(mock_verify.call_count, 2)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", return_value={"uid": "no_exp"})
+    def test_token_without_expiry_is_not_cached(self, mock_verify):
+        verify_id_token("token_a")
+        verify_id_token("token_a")
+        self.assertEqual(mock_verify.call_count, 2)
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=Exception("invalid"))
+    def test_invalid_token_is_not_cached(self, mock_verify):
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                verify_id_token("bad_token")
+        self.assertEqual(mock_verify.call_count, 2)
+        self.assertEqual(len(token_cache), 0)
+
+    def test_expired_and_least_recently_used_entries_are_dropped(self):
+        cache = VerifiedTokenCache(max_size=2)
+        cache.set("a", {"uid": "a", "exp": time.time() + 60})
+        cache.set("b", {"uid": "b", "exp": time.time() + 60})
+        cache.get("a")
+        cache.set("c", {"uid": "c", "exp": time.time() + 60})
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+        with patch("server.firebase_tokens.time.time", return_value=time.time() + 120):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
@@ -0,0 +1,212 @@
+import io
+import shutil
+import subprocess
+import tempfile
+from unittest.mock import patch
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from listing.cards import listing_cards
+from listing.models import Listing, ListingMedia
+from listing.search import with_serializer_relations
+from listing.serializers import ListingSerializer
+from server.media import VARIANT_FORMATS, process_media, variant_keys
+from storages.backends.s3boto3 import S3Boto3Storage
+from user.models import User
+
+def jpeg_bytes(size=(2000, 1500)):
+    out = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(out, format="JPEG")
+    return out.getvalue()
+
+class RunNow:
+    """Runs submitted jobs synchronously in place of the worker pool."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+class MediaProcessingTests(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.storage = FileSystemStorage(location=self.media_root, base_url="https://cdn.example.com/")
+        for field in (ListingMedia._meta.get_field("file"), User._meta.get_field("profilePicture")):
+            patcher = patch.object(field, "storage", self.storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for target in ("listing.media.get_media_processor", "user.signals.get_media_processor"):
+            patcher = patch(target, return_value=RunNow())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create(uid="dummy_uid", email="dummy@example.com", displayName="Dummy User")
+        self.listing = Listing.objects.create(
+            title="Chair",
+            description="A chair",
+            price=20.0,
+            original_price=20.0,
+            category="Test",
+            user=self.user
+        )
+
+    def test_image_variants_are_resized_next_to_the_original(self):
+        name = self.storage.save("users/dummy_uid/1/photo.jpg", io.BytesIO(jpeg_bytes()))
+        variants = process_media(self.storage, name)
+
+        self.assertEqual(variants["source"], name)
+        self.assertEqual(set(variants["thumb"]), set(VARIANT_FORMATS))
+        self.assertRegex(variants["thumb"]["webp"], r"^users/dummy_uid/1/photo__[0-9a-f]{8}-thumb\.webp$")
+        with self.storage.open(variants["thumb"]["webp"]) as f, Image.open(f) as thumb:
+            self.assertEqual(thumb.format, "WEBP")
+            self.assertEqual(thumb.size, (320, 240))
+        with self.storage.open(variants["medium"]["jpeg"]) as f, Image.open(f) as medium:
+            self.assertEqual(medium.size, (1080, 810))
+        self.assertEqual(len(variant_keys(variants)), 2 * len(VARIANT_FORMATS))
+        # Processing the file again never reuses a cached URL
+        self.assertNotEqual(process_media(self.storage, name)["thumb"]["webp"], variants["thumb"]["webp"])
+
+    def test_oversized_images_are_not_loaded(self):
+        name = self.storage.save("users/dummy_uid/1/photo.jpg", io.BytesIO(jpeg_bytes()))
+        with patch("server.media.MAX_IMAGE_BYTES", 100):
+            self.assertEqual(process_media(self.storage, name), {"source": name})
+        with patch("server.media.MAX_IMAGE_PIXELS", 1000 * 1000), patch("server.media.ImageOps.exif_transpose") as decode:
+            self.assertEqual(process_media(self.storage, name), {"source": name})
+            decode.assert_not_called()
+        self.assertEqual(self.storage.listdir("users/dummy_uid/1")[1], ["photo.jpg"])
+
+    @patch("server.media.shutil.which", return_value="/usr/bin/ffmpeg")
+    def test_video_is_copied_in_chunks_for_its_poster(self, mock_which):
+        video = b"frame" * 1000
+        name = self.storage.save("users/dummy_uid/1/tour.mp4", io.BytesIO(video))
+
+        def ffmpeg(args, **kwargs):
+            with open(args[args.index("-i") + 1], "rb") as f:
+                self.assertEqual(f.read(), video)
+            return subprocess.CompletedProcess(args, 0, stdout=jpeg_bytes())
+
+        with patch("server.media.COPY_CHUNK_SIZE", 1024), patch("server.media.subprocess.run", side_effect=ffmpeg):
+            variants = process_media(self.storage, name)
+        self.assertRegex(variants["poster"], r"^users/dummy_uid/1/tour__[0-9a-f]{8}-poster\.jpeg$")
+        self.assertRegex(variants["thumb"]["webp"], r"^users/dummy_uid/1/tour__[0-9a-f]{8}-thumb\.webp$")
+
+    @patch("server.media.shutil.which", return_value=None)
+    def test_video_without_ffmpeg_is_left_as_uploaded(self, mock_which):
+        name = self.storage.save("users/dummy_uid/1/tour.mp4", io.BytesIO(b"not really a video"))
+        self.assertEqual(process_media(self.storage, name), {"source": name})
+
+    def test_new_listing_media_is_processed_and_served_resized(self):
+        media = ListingMedia.objects.create(
+            listing=self.listing,
+            file=SimpleUploadedFile("photo.jpg", jpeg_bytes(), content_type="image/jpeg")
+        )
+        media.refresh_from_db()
+        self.assertEqual(media.variants["source"], media.file.name)
+
+        data = ListingSerializer(self.listing).data
+        self.assertEqual(data["media"], [self.storage.url(media.variants["medium"]["webp"])])
+        data = ListingSerializer(self.listing, context={"mediaSize": "thumb"}).data
+        self.assertEqual(data["media"], [self.storage.url(media.variants["thumb"]["webp"])])
+
+        cards = listing_cards(Listing.objects.filter(id=self.listing.id))
+        self.assertEqual(cards[0]["thumbnail"], self.storage.url(media.variants["thumb"]["webp"]))
+        self.assertNotIn("thumbnailVariants", cards[0])
+
+    def test_unprocessed_media_falls_back_to_the_original(self):
+        media = ListingMedia.objects.create(listing=self.listing, file="users/dummy_uid/1/missing.jpg")
+        media.refresh_from_db()
+        self.assertEqual(media.variants, {})
+        data = ListingSerializer(self.listing).data
+        self.assertEqual(data["media"], [media.file.url])
+
+    def test_new_profile_picture_is_processed(self):
+        self.user.profilePicture = SimpleUploadedFile("me.jpg", jpeg_bytes(), content_type="image/jpeg")
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profilePictureVariants["source"], self.user.profilePicture.name)
+
+        data = ListingSerializer(self.listing).data
+        self.assertEqual(data["profilePicture"], self.storage.url(self.user.profilePictureVariants["thumb"]["webp"]))
+
+        # Saving without a new upload does not reprocess
+        with patch("user.signals.process_profile_picture") as process:
+            self.user.bio = "Hello"
+            self.user.save()
+        process.assert_not_called()
+
+        # A replacement gets new variant keys, even when saved with
+        # update_fields that leave out the variants
+        old_thumb = self.user.profilePictureVariants["thumb"]["webp"]
+        with patch("user.signals.process_profile_picture") as process:
+            self.user.profilePicture = SimpleUploadedFile("me.jpg", jpeg_bytes(), content_type="image/jpeg")
+            self.user.save(update_fields=["profilePicture"])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profilePictureVariants, {})
+        process.assert_called_once()
+        self.assertNotEqual(process_media(self.storage, self.user.profilePicture.name)["thumb"]["webp"], old_thumb)
+
+class MediaUrlTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            profilePicture="users/dummy_uid/profile_picture.jpg",
+            profilePictureVariants={"thumb": {"webp": "users/dummy_uid/profile_picture__thumb.webp"}}
+        )
+        for i in range(50):
+            listing = Listing.objects.create(
+                title=f"Listing {i}",
+                description="A listing",
+                price=10.0,
+                original_price=10.0,
+                category="Test",
+                user=self.user
+            )
+            prefix = f"users/dummy_uid/{listing.id}/"
+            ListingMedia.objects.bulk_create([
+                ListingMedia(listing=listing, file=prefix + "photo.jpg", variants={"medium": {"webp": prefix + "photo__medium.webp"}}),
+                ListingMedia(listing=listing, file=prefix + "tour video.mp4"),
+            ])
+
+    def serialize_page(self):
+        with patch.object(S3Boto3Storage, "url", side_effect=AssertionError("storage.url called")):
+            return ListingSerializer(with_serializer_relations(Listing.objects.order_by("id")), many=True).data
+
+    def test_page_serialization_makes_no_storage_calls(self):
+        data = self.serialize_page()
+        self.assertEqual(len(data), 50)
+        base = f"https://{settings.AWS_S3_CUSTOM_DOMAIN}/"
+        prefix = f"users/dummy_uid/{data[0]['id']}/"
+        self.assertEqual(data[0]["media"], [base + prefix + "photo__medium.webp", base + prefix + "tour%20video.mp4"])
+        self.assertEqual(data[0]["profilePicture"], base + "users/dummy_uid/profile_picture__thumb.webp")
+
+    @override_settings(MEDIA_CDN_HOST="cdn.example.com")
+    def test_cdn_host_is_used_when_configured(self):
+        data = self.serialize_page()
+        prefix = f"users/dummy_uid/{data[0]['id']}/"
+        self.assertEqual(data[0]["media"][0], f"https://cdn.example.com/{prefix}photo__medium.webp")
+
+    def test_card_thumbnail_skips_videos_without_a_poster(self):
+        listing = Listing.objects.create(
+            title="Video first", description="A listing", price=10.0, original_price=10.0, category="Test", user=self.user
+        )
+        prefix = f"users/dummy_uid/{listing.id}/"
+        ListingMedia.objects.bulk_create([
+            ListingMedia(listing=listing, file=prefix + "tour.mp4"),
+            ListingMedia(listing=listing, file=prefix + "photo.jpg"),
+        ])
+        video_only = Listing.objects.create(
+            title="Video only", description="A listing", price=10.0, original_price=10.0, category="Test", user=self.user
+        )
+        ListingMedia.objects.bulk_create([ListingMedia(listing=video_only, file=f"users/dummy_uid/{video_only.id}/tour.MOV")])
+
+        base = f"https://{settings.AWS_S3_CUSTOM_DOMAIN}/"
+        cards = {card["id"]: card for card in listing_cards(Listing.objects.filter(id__in=[listing.id, video_only.id]))}
+        self.assertEqual(cards[listing.id]["thumbnail"], base + prefix + "photo.jpg")
+        self.assertIsNone(cards[video_only.id]["thumbnail"])
+
+        # Once the poster frame exists the video is the thumbnail again
+        ListingMedia.objects.filter(file=prefix + "tour.mp4").update(variants={"thumb": {"webp": prefix + "tour__thumb.webp"}})
+        self.assertEqual(listing_cards(Listing.objects.filter(id=listing.id))[0]["thumbnail"], base + prefix + "tour__thumb.webp")
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from user.storage_cleanup import DRAIN_BATCH_SIZE, RECONCILE_GRACE, drain_deletions, reconcile_orphans
+
+
+class Command(BaseCommand):
+    help = "Queue orphaned objects under users/ for deletion and drain the deletion queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list the orphaned keys.")
+        parser.add_argument(
+            "--grace-hours",
+            type=float,
+            default=RECONCILE_GRACE.total_seconds() / 3600,
+            help="Ignore objects modified more recently than this.",
+        )
+
+    def handle(self, *args, dry_run=False, grace_hours=None, **options):
+        orphans = reconcile_orphans(grace=timedelta(hours=grace_hours), dry_run=dry_run)
+        for key in orphans:
+            self.stdout.write(key)
+        if dry_run:
+            self.stdout.write(f"{len(orphans)} orphaned objects found")
+            return
+
+        deleted = drain_deletions()
+        total = deleted
+        while deleted == DRAIN_BATCH_SIZE:
+            deleted = drain_deletions()
+            total += deleted
+        self.stdout.write(f"{len(orphans)} orphaned objects queued, {total} deletions completed")
@@ -0,0 +1,14 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_user_appeal'),
+        ('user', '0010_remove_user_numberofreviews'),
+    ]
+
+    operations = [
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_merge_20261018_0119'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='profilePictureVariants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -31,6 +31,8 @@ class User(models.Model):
         null=True,
         blank=True
     )
+    # Resized/re-encoded copies written by the media processor, see server.media
+    profilePictureVariants = models.JSONField(default=dict, blank=True)
 
     def get_history(self):
         return self.viewed_listings.all()[:6]
@@ -43,4 +45,20 @@ class History(models.Model):
 
     class Meta:
         ordering = ['-viewed_at']
-        unique_together = ('user', 'listing')
\ No newline at end of file
+        unique_together = ('user', 'listing')
+
+class StorageDeletion(models.Model):
+    """
+    Outbox row for an object (or, with `prefix`, every object under a key
+    prefix) to remove from media storage. Rows are written in the same
+    transaction as the deletes they belong to and drained in the background.
+    """
+    key = models.CharField(max_length=1024)
+    prefix = models.BooleanField(default=False)
+    attempts = models.IntegerField(default=0)
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['attempts', 'id'], name='storage_deletion_queue_idx'),
+        ]
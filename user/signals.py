@@ -0,0 +1,56 @@
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from server.media import get_media_processor, process_media
+from server.principals import invalidate_principal
+from user.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_principal(sender, instance, **kwargs):
+    """
+    Drop the cached auth principal whenever the user row changes so ban,
+    admin and verification updates apply on the next request.
+    """
+    invalidate_principal(instance.uid)
+
+
+def process_profile_picture(uid, name):
+    """Generate and record the variants of a user's profile picture."""
+    close_old_connections()
+    try:
+        variants = process_media(User._meta.get_field("profilePicture").storage, name)
+        # Skip the update if the picture was replaced meanwhile
+        User.objects.filter(uid=uid, profilePicture=name).update(profilePictureVariants=variants)
+    except Exception as e:
+        print(f"Processing profile picture of {uid} failed: {e}")
+    finally:
+        close_old_connections()
+
+
+@receiver(pre_save, sender=User)
+def detect_new_profile_picture(sender, instance, **kwargs):
+    # An uncommitted file is one assigned since the row was loaded; it is
+    # only uploaded (and committed) by the save itself
+    if "profilePicture" in instance.get_deferred_fields():
+        return
+    picture = instance.profilePicture
+    instance._newProfilePicture = bool(picture) and not picture._committed
+    if instance._newProfilePicture:
+        # The old variants no longer match; serve the original until processed
+        instance.profilePictureVariants = {}
+
+
+@receiver(post_save, sender=User)
+def process_new_profile_picture(sender, instance, update_fields=None, **kwargs):
+    """Resize and re-encode a newly uploaded profile picture in the background."""
+    if not getattr(instance, "_newProfilePicture", False):
+        return
+    instance._newProfilePicture = False
+    if update_fields is not None and "profilePictureVariants" not in update_fields:
+        # The save left out the variants reset in pre_save
+        User.objects.filter(uid=instance.uid).update(profilePictureVariants={})
+    uid, name = instance.uid, instance.profilePicture.name
+    transaction.on_commit(lambda: get_media_processor().submit(process_profile_picture, uid, name))
@@ -0,0 +1,258 @@
+import os
+import threading
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from listing.models import ListingMedia
+from server.media import variant_keys
+from user.models import StorageDeletion, User
+
+# S3 DeleteObjects takes at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# Variant sources looked up per query
+SOURCE_LOOKUP_BATCH = 200
+# Outbox rows handled per drain pass
+DRAIN_BATCH_SIZE = getattr(settings, "STORAGE_DELETION_DRAIN_BATCH", 1000)
+# The worker also wakes up this often (seconds) to retry failed deletions
+DRAIN_INTERVAL = getattr(settings, "STORAGE_DELETION_DRAIN_INTERVAL", 60)
+# Objects younger than this are never reported as orphans: uploads that
+# are not finalized yet and variants not yet recorded look the same
+RECONCILE_GRACE = getattr(settings, "STORAGE_RECONCILE_GRACE", timedelta(days=1))
+USERS_PREFIX = "users/"
+
+
+def media_storage():
+    return User._meta.get_field("profilePicture").storage
+
+
+def enqueue_deletions(keys=(), prefixes=()):
+    """
+    Queue storage objects for deletion once the current transaction commits.
+    Call this in the transaction that removes the rows referencing them.
+    """
+    rows = [StorageDeletion(key=key) for key in keys if key]
+    rows += [StorageDeletion(key=prefix, prefix=True) for prefix in prefixes if prefix]
+    if not rows:
+        return
+    StorageDeletion.objects.bulk_create(rows)
+    transaction.on_commit(lambda: get_deletion_worker().wake())
+
+
+def list_keys(client, bucket, prefix):
+    """Keys and last-modified times of every object under `prefix`."""
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"], obj["LastModified"]
+
+
+def variant_source(key):
+    """users/u/1/photo__<version>-thumb.webp -> users/u/1/photo, or None when `key` is not a variant key."""
+    base, separator, suffix = key.rpartition("__")
+    if not separator or "/" in suffix:
+        return None
+    return base
+
+
+def referenced_files(keys):
+    """
+    The given keys that are still the file of a ListingMedia or a profile
+    picture, or a variant recorded in its variants. Every processing run
+    writes its variants under new keys, so a queued variant key is never
+    about to be written again.
+    """
+    referenced = set(ListingMedia.objects.filter(file__in=keys).values_list("file", flat=True))
+    referenced.update(User.objects.filter(profilePicture__in=keys).values_list("profilePicture", flat=True))
+
+    sources = {}
+    for key in keys:
+        base = variant_source(key)
+        if base is not None:
+            sources.setdefault(base, []).append(key)
+    bases = list(sources)
+    for i in range(0, len(bases), SOURCE_LOOKUP_BATCH):
+        batch = bases[i:i + SOURCE_LOOKUP_BATCH]
+        media = Q()
+        pictures = Q()
+        for base in batch:
+            media |= Q(file__startswith=f"{base}.")
+            pictures |= Q(profilePicture__startswith=f"{base}.")
+        files = [
+            (file, variants) for file, variants in
+            ListingMedia.objects.filter(media).values_list("file", "variants")
+        ]
+        files += [
+            (file, variants) for file, variants in
+            User.objects.filter(pictures).values_list("profilePicture", "profilePictureVariants")
+        ]
+        for file, variants in files:
+            candidates = sources.get(os.path.splitext(file)[0], [])
+            referenced.update(set(candidates) & set(variant_keys(variants or {})))
+    return referenced
+
+
+def delete_objects(client, bucket, keys):
+    """Delete keys with DeleteObjects, 1000 per request. Returns the keys that failed."""
+    failed = set()
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        try:
+            response = client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+        except (BotoCoreError, ClientError) as e:
+            print(f"Deleting {len(batch)} objects failed: {e}")
+            failed.update(batch)
+            continue
+        for error in response.get("Errors", []):
+            print(f"Deleting {error.get('Key')} failed: {error.get('Code')} {error.get('Message')}")
+            failed.add(error.get("Key"))
+    return failed
+
+
+def drain_deletions(batch_size=DRAIN_BATCH_SIZE):
+    """
+    Delete the objects of up to `batch_size` outbox rows. Rows whose objects
+    are all gone are removed; the others are kept and retried after the
+    rows that have not failed yet. Returns the number of rows completed.
+
+    Every process runs a DeletionWorker, so the rows are locked for the
+    pass and rows another worker holds are skipped: each row is handled by
+    one worker at a time.
+    """
+    with transaction.atomic():
+        rows = list(StorageDeletion.objects.select_for_update(skip_locked=True).order_by("attempts", "id")[:batch_size])
+        if not rows:
+            return 0
+        return delete_rows(rows)
+
+
+def delete_rows(rows):
+    """Delete the objects of locked outbox rows and record the outcome."""
+    storage = media_storage()
+    client = storage.connection.meta.client
+    bucket = storage.bucket_name
+
+    row_keys = {}
+    failed = set()
+    for row in rows:
+        if row.prefix:
+            try:
+                # Objects written after the row was queued belong to whoever
+                # uses the prefix now (an account re-created with the same uid)
+                row_keys[row.id] = [
+                    key for key, modified in list_keys(client, bucket, row.key) if modified <= row.createdAt
+                ]
+            except (BotoCoreError, ClientError) as e:
+                print(f"Listing {row.key} failed: {e}")
+                row_keys[row.id] = [row.key]
+                failed.add(row.key)
+        else:
+            row_keys[row.id] = [row.key]
+
+    # A key can be referenced again after it was queued (e.g. a profile
+    # picture re-uploaded under the same name); those are left alone
+    single_keys = [row.key for row in rows if not row.prefix]
+    referenced = referenced_files(single_keys) if single_keys else set()
+    for row in rows:
+        if row.prefix and row.key.startswith(USERS_PREFIX):
+            referenced |= referenced_keys(row.key[len(USERS_PREFIX):].rstrip("/"))
+
+    keys = sorted({key for keys in row_keys.values() for key in keys} - referenced - failed)
+    failed |= delete_objects(client, bucket, keys)
+
+    done = [row.id for row in rows if not failed.intersection(row_keys[row.id])]
+    StorageDeletion.objects.filter(id__in=done).delete()
+    StorageDeletion.objects.exclude(id__in=done).filter(id__in=row_keys).update(attempts=F("attempts") + 1)
+    return len(done)
+
+
+def referenced_keys(uid):
+    """Every storage key a user's rows point at: originals and their variants."""
+    user = User.objects.filter(uid=uid).values("profilePicture", "profilePictureVariants").first()
+    if user is None:
+        return set()
+    keys = {user["profilePicture"], *variant_keys(user["profilePictureVariants"])}
+    for file, variants in ListingMedia.objects.filter(listing__user_id=uid).values_list("file", "variants"):
+        keys.add(file)
+        keys.update(variant_keys(variants))
+    return keys
+
+
+def find_orphaned_keys(grace=RECONCILE_GRACE):
+    """
+    Keys under users/<uid>/ that no row references any more and that are
+    older than `grace`: objects of deleted users and listings, and uploads
+    that were never finalized.
+    """
+    storage = media_storage()
+    client = storage.connection.meta.client
+    cutoff = timezone.now() - grace
+    orphans = []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=storage.bucket_name, Prefix=USERS_PREFIX, Delimiter="/"):
+        for user_prefix in page.get("CommonPrefixes", []):
+            prefix = user_prefix["Prefix"]
+            referenced = referenced_keys(prefix[len(USERS_PREFIX):].rstrip("/"))
+            orphans += [
+                key for key, modified in list_keys(client, storage.bucket_name, prefix)
+                if key not in referenced and modified < cutoff
+            ]
+    return orphans
+
+
+def reconcile_orphans(grace=RECONCILE_GRACE, dry_run=False):
+    """Queue every orphaned key for deletion and return them."""
+    orphans = find_orphaned_keys(grace)
+    if not dry_run:
+        with transaction.atomic():
+            enqueue_deletions(orphans)
+    return orphans
+
+
+class DeletionWorker:
+    """
+    Background thread draining the deletion outbox: woken when new rows are
+    committed, and every DRAIN_INTERVAL seconds to retry failed ones.
+    """
+
+    def __init__(self, interval=DRAIN_INTERVAL):
+        self.interval = interval
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="storage-deletions", daemon=True)
+        self.thread.start()
+
+    def wake(self):
+        self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            close_old_connections()
+            try:
+                # Keep going while whole batches complete
+                while drain_deletions() == DRAIN_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"Draining storage deletions failed: {e}")
+            finally:
+                close_old_connections()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_deletion_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = DeletionWorker()
+    return _worker
@@ -0,0 +1,195 @@
+import unittest
+from datetime import timedelta
+from io import BytesIO
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from listing.models import Listing, ListingMedia
+from user.models import StorageDeletion, User
+from user.storage_cleanup import drain_deletions, enqueue_deletions, find_orphaned_keys
+from unittest.mock import patch
+from PIL import Image
+
+try:
+    import boto3
+    from moto import mock_aws
+    from storages.backends.s3boto3 import S3Boto3Storage
+except ImportError:
+    mock_aws = None
+
+# Dummy token verifier for testing purposes.
+def dummy_verify_id_token(token):
+    return {
+        "uid": "dummy_uid",
+        "email_verified": True
+    }
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class StorageCleanupTests(APITestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.addCleanup(self.mock.stop)
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+        self.s3 = boto3.client("s3", region_name=settings.AWS_S3_REGION_NAME)
+        self.s3.create_bucket(Bucket=self.bucket)
+
+        # A storage created inside the mock, shared by both file fields
+        storage = S3Boto3Storage()
+        for field in (ListingMedia._meta.get_field("file"), User._meta.get_field("profilePicture")):
+            patcher = patch.object(field, "storage", storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = APIClient()
+        self.user = User.objects.create(
+            uid="dummy_uid",
+            email="dummy@example.com",
+            displayName="Dummy User",
+            purdueEmail="fake@purdue.edu",
+            purdueEmailVerified=True
+        )
+        self.listing = Listing.objects.create(
+            title="Desk",
+            description="A desk",
+            price=10.0,
+            original_price=10.0,
+            category="Test",
+            user=self.user
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer dummy_token")
+
+    def put(self, *keys):
+        for key in keys:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=b"data")
+
+    def stored_keys(self):
+        return sorted(obj["Key"] for obj in self.s3.list_objects_v2(Bucket=self.bucket).get("Contents", []))
+
+    @patch("user.storage_cleanup.DELETE_BATCH_SIZE", 2)
+    def test_queued_keys_are_deleted_in_batches(self):
+        keys = [f"users/gone/1/photo{i}.jpg" for i in range(5)]
+        self.put(*keys, "users/gone/1/keep.jpg")
+        enqueue_deletions(keys)
+
+        storage = ListingMedia._meta.get_field("file").storage
+        client = storage.connection.meta.client
+        with patch.object(client, "delete_objects", wraps=client.delete_objects) as delete_objects:
+            self.assertEqual(drain_deletions(), 5)
+        self.assertEqual(delete_objects.call_count, 3)
+        self.assertEqual(self.stored_keys(), ["users/gone/1/keep.jpg"])
+        self.assertFalse(StorageDeletion.objects.exists())
+
+    def test_referenced_keys_are_not_deleted(self):
+        key = f"users/dummy_uid/{self.listing.id}/photo.jpg"
+        self.put(key)
+        enqueue_deletions([key])
+        ListingMedia.objects.create(listing=self.listing, file=key)
+
+        self.assertEqual(drain_deletions(), 1)
+        self.assertEqual(self.stored_keys(), [key])
+
+    def test_only_recorded_variants_are_kept(self):
+        # Uploaded again under the same name and not processed yet; its new
+        # variants will get new keys
+        picture = "users/dummy_uid/profile_picture.jpg"
+        User.objects.filter(uid="dummy_uid").update(profilePicture=picture, profilePictureVariants={})
+        # Processed; its medium variant is no longer written
+        photo = f"users/dummy_uid/{self.listing.id}/photo.jpg"
+        thumb = f"users/dummy_uid/{self.listing.id}/photo__0a1b2c3d-thumb.webp"
+        medium = f"users/dummy_uid/{self.listing.id}/photo__0a1b2c3d-medium.webp"
+        ListingMedia.objects.create(listing=self.listing, file=photo, variants={"source": photo, "thumb": {"webp": thumb}})
+        keys = ["users/dummy_uid/profile_picture__9e8d7c6b-thumb.webp", thumb, medium]
+        self.put(*keys)
+        enqueue_deletions(keys)
+
+        self.assertEqual(drain_deletions(), 3)
+        self.assertEqual(self.stored_keys(), [thumb])
+
+    def test_prefix_deletion_skips_objects_written_after_it_was_queued(self):
+        enqueue_deletions(prefixes=["users/gone/"])
+        queued_at = StorageDeletion.objects.get().createdAt
+        self.put("users/gone/old.jpg", "users/gone/new.jpg")
+        modified = {"users/gone/old.jpg": queued_at - timedelta(minutes=1), "users/gone/new.jpg": queued_at + timedelta(minutes=1)}
+
+        def list_keys(client, bucket, prefix):
+            return [(key, modified[key]) for key in self.stored_keys() if key.startswith(prefix)]
+
+        with patch("user.storage_cleanup.list_keys", side_effect=list_keys):
+            self.assertEqual(drain_deletions(), 1)
+        self.assertEqual(self.stored_keys(), ["users/gone/new.jpg"])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_delete_listing_queues_media_and_variants(self, mock_verify):
+        prefix = f"users/dummy_uid/{self.listing.id}/"
+        variants = {"source": prefix + "photo.jpg", "thumb": {"webp": prefix + "photo__thumb.webp"}}
+        ListingMedia.objects.create(listing=self.listing, file=prefix + "photo.jpg", variants=variants)
+        self.put(prefix + "photo.jpg", prefix + "photo__thumb.webp", "users/dummy_uid/profile_picture.jpg")
+
+        response = self.client.delete(reverse("delete_listing", args=[self.listing.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(ListingMedia.objects.exists())
+        self.assertEqual(
+            sorted(StorageDeletion.objects.values_list("key", flat=True)),
+            [prefix + "photo.jpg", prefix + "photo__thumb.webp"]
+        )
+
+        drain_deletions()
+        self.assertEqual(self.stored_keys(), ["users/dummy_uid/profile_picture.jpg"])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_delete_user_removes_everything_under_their_prefix(self, mock_verify):
+        self.put("users/dummy_uid/profile_picture.jpg", f"users/dummy_uid/{self.listing.id}/photo.jpg", "users/other_uid/profile_picture.jpg")
+
+        response = self.client.delete(reverse("delete_user"), {"uid": "dummy_uid"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(StorageDeletion.objects.values_list("key", "prefix")), [("users/dummy_uid/", True)])
+
+        self.assertEqual(drain_deletions(), 1)
+        self.assertEqual(self.stored_keys(), ["users/other_uid/profile_picture.jpg"])
+
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
+    def test_new_profile_picture_with_another_extension_queues_the_old_one(self, mock_verify):
+        old_thumb = "users/dummy_uid/profile_picture__0a1b2c3d-thumb.webp"
+        self.put("users/dummy_uid/profile_picture.jpg", old_thumb)
+        User.objects.filter(uid="dummy_uid").update(
+            profilePicture="users/dummy_uid/profile_picture.jpg", profilePictureVariants={"thumb": {"webp": old_thumb}}
+        )
+        image = BytesIO()
+        Image.new("RGB", (10, 10)).save(image, format="PNG")
+        picture = SimpleUploadedFile("new.png", image.getvalue(), content_type="image/png")
+
+        response = self.client.post(reverse("upload_profile_picture"), {"profilePicture": picture}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(StorageDeletion.objects.values_list("key", flat=True)), ["users/dummy_uid/profile_picture.jpg", old_thumb]
+        )
+        self.assertEqual(User.objects.get(uid="dummy_uid").profilePictureVariants, {})
+
+        drain_deletions()
+        self.assertEqual(self.stored_keys(), ["users/dummy_uid/profile_picture.png"])
+
+    def test_reconciliation_finds_unreferenced_keys(self):
+        prefix = f"users/dummy_uid/{self.listing.id}/"
+        ListingMedia.objects.create(
+            listing=self.listing,
+            file=prefix + "photo.jpg",
+            variants={"source": prefix + "photo.jpg", "thumb": {"webp": prefix + "photo__thumb.webp"}}
+        )
+        self.put(
+            prefix + "photo.jpg",
+            prefix + "photo__thumb.webp",
+            prefix + "never-finalized.jpg",
+            "users/dummy_uid/999/old.jpg",
+            "users/deleted_uid/profile_picture.jpg",
+        )
+
+        # Recent objects are within the grace period
+        self.assertEqual(find_orphaned_keys(), [])
+        self.assertEqual(sorted(find_orphaned_keys(grace=timedelta(0))), [
+            "users/deleted_uid/profile_picture.jpg",
+            prefix + "never-finalized.jpg",
+            "users/dummy_uid/999/old.jpg",
+        ])
@@ -65,7 +65,7 @@ class UserEndpointTests(APITestCase):
     # Create User Tests (User Story #1)
     # ---------------------------
     # User Story #1: "As a user, I would like to create an account"
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us1_create_user_success(self, mock_verify):
         """US#1: Successful creation of a new user account."""
         url = reverse("create_user")
@@ -81,7 +81,7 @@ class UserEndpointTests(APITestCase):
         self.assertTrue(User.objects.filter(uid="new_uid").exists())
 
     # User Story #1: Failure due to duplicate uid
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us1_create_user_duplicate_uid(self, mock_verify):
         """US#1: Attempt to create a user with a duplicate UID should fail."""
         url = reverse("create_user")
@@ -96,7 +96,7 @@ class UserEndpointTests(APITestCase):
         self.assertIn("error", response.json())
 
     # User Story #1: Failure due to missing required field
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us1_create_user_missing_field(self, mock_verify):
         """US#1: Missing required field (email) should return a 400 error."""
         url = reverse("create_user")
@@ -112,21 +112,21 @@ class UserEndpointTests(APITestCase):
     # ---------------------------
     # Email Verification Tests (User Story #2 and #3)
     # ---------------------------
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token_verified_purdue_unverified_email)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token_verified_purdue_unverified_email)
     def test_us2_verify_email_failure(self, mock_verify):
         """US#2: Failure to verify email even though purdue email is verified"""
         url = reverse("check_email_auth")
         response = self.client.get(url, content_type="application/json")
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us3_verify_purdue_email_successful(self, mock_verify):
         """US#2: Successful verification of Purdue email."""
         url = reverse("check_email_auth")
         response = self.client.get(url, content_type="application/json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token_unverified)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token_unverified)
     def test_us3_verify_purdue_email_failure(self, mock_verify):
         """US#2: Attempt to verify Purdue email without authentication should fail."""
         url = reverse("check_email_auth")
@@ -137,7 +137,7 @@ class UserEndpointTests(APITestCase):
     # Delete User Tests (User Story #5)
     # ---------------------------
     # User Story #5: "As a user, I would like to delete my account"
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us5_delete_user_success(self, mock_verify):
         """US#4: Successful deletion of an existing user account."""
         url = reverse("delete_user")
@@ -148,7 +148,7 @@ class UserEndpointTests(APITestCase):
             User.objects.get(uid=self.user.uid)
 
     # User Story 5: Deletion failure (user not found)
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us5_delete_user_not_found(self, mock_verify):
         """US#4: Deleting a non-existent user should return a 404 error."""
         url = reverse("delete_user")
@@ -161,7 +161,7 @@ class UserEndpointTests(APITestCase):
     # ---------------------------
     # User Story #6: "As a user, I would like to view my own profile"
     # User Story #7: "As a user, I would like to view another user’s profile"
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us6_view_user_info_success(self, mock_verify):
         """US#5/6: Retrieve user information successfully by UID."""
         url = reverse("get_user_by_uid", kwargs={"uid": self.user.uid})
@@ -172,7 +172,7 @@ class UserEndpointTests(APITestCase):
         self.assertEqual(data["displayName"], self.user.displayName)
 
     # User Story #6: Viewing non-existent user profile
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us6_view_user_info_not_found(self, mock_verify):
         """US#6: Requesting profile for a non-existent UID should return 404."""
         url = reverse("get_user_by_uid", kwargs={"uid": "nonexistent_uid"})
@@ -183,7 +183,7 @@ class UserEndpointTests(APITestCase):
     # Update User Info Tests (User Story #8)
     # ---------------------------
     # User Story #8: "As a user, I would like to edit account profile"
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us8_update_user_info_success(self, mock_verify):
         """US#8: Successful update of user profile fields."""
         url = reverse("update_user_info")
@@ -200,7 +200,7 @@ class UserEndpointTests(APITestCase):
         self.assertEqual(updated_user.bio, "Updated bio")
 
     # User Story #8: Update failure due to invalid data type for displayName
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_us8_update_user_info_invalid(self, mock_verify):
         """US#8: Providing an invalid data type for displayName should return 400."""
         url = reverse("update_user_info")
@@ -213,7 +213,7 @@ class UserEndpointTests(APITestCase):
         self.assertIn("displayName", data)
 
     # User Story #16: Block a user
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_block_user(self, mock_verify):
         """
         Test blocking a user.
@@ -224,7 +224,7 @@ class UserEndpointTests(APITestCase):
         self.assertTrue(self.user.blockedUsers.filter(uid=self.other_user.uid).exists())
 
     # User Story #16: unblock a user
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_unblock_user(self, mock_verify):
         """
         Test unblocking a user.
@@ -237,7 +237,7 @@ class UserEndpointTests(APITestCase):
         self.assertEqual(response.json()["message"], "User unblocked")
 
     # User Story #16: View all blocked users
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_get_blocked_users(self, mock_verify):
         """
         Test retrieving blocked users.
@@ -251,7 +251,7 @@ class UserEndpointTests(APITestCase):
         self.assertEqual(data[0]["uid"], self.other_user.uid)
         self.assertEqual(data[0]["displayName"], self.other_user.displayName)
 
-    @patch("user.views.firebase_admin_auth.verify_id_token", side_effect=dummy_verify_id_token)
+    @patch("server.firebase_tokens.auth.verify_id_token", side_effect=dummy_verify_id_token)
     def test_upload_profile_picture_success(self, mock_verify):
         """Test successful upload of a profile picture."""
         url = reverse("upload_profile_picture")
@@ -9,6 +9,7 @@ from user.views import (
     create_user, 
     delete_user, 
     get_connected_users,
+    get_online_users,
     get_user_info, 
     send_purdue_verification, 
     update_user_info, 
@@ -42,6 +43,7 @@ urlpatterns = [
     path('addToHistory/', addToHistory, name="get_history"),
     path('getRec/<str:uid>/', getRecommendedListings, name="get_recommended_listings"),
     path('getConnectedUsers/', get_connected_users, name="get_connected_users"),
+    path('getOnlineUsers/', get_online_users, name="get_online_users"),
     path('isAdmin/', is_admin, name="is_admin"),
     path('addAppeal/', addAppeal, name="add_appeal"),
     path('getAppeals/', getAppeals, name="get_appeals"),
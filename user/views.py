@@ -1,22 +1,26 @@
 import os
 import django
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q, Sum
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import status
-from django.core.cache import cache
-
-from firebase_admin import auth as firebase_admin_auth
 
+from listing.analytics import seller_views
+from listing.cards import listing_cards, wants_cards
 from listing.serializers import ListingSerializer
 from listing.models import Listing
+from message.connection_stats import get_connection_counter
 from message.models import Message, Room
+from message.presence import online_users
 from user.models import History
 from server.authentication import AdminFirebaseAuthentication, FirebaseAuthentication, FirebaseEmailVerifiedAuthentication
 from server.firebase_auth import firebase_required
+from server.media import variant_keys
 from user.models import User
+from user.storage_cleanup import enqueue_deletions
 from user.serializers import AddPurdueVerificationTokenSerializer, CreateUserSerializer, DeleteUserSerializer, EditUserSerializer, UploadProfilePictureSerializer, UserSerializer, VerifyPurdueEmailSerializer
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
@@ -43,11 +47,26 @@ def is_admin(request):
 @permission_classes([IsAuthenticated])
 def get_connected_users(request):
     """
-    Returns the number of connected users.
+    Returns the number of connected users across all websocket workers, the
+    count per worker and a per-minute series for the last `minutes` minutes.
+    """
+    try:
+        minutes = min(max(int(request.query_params.get("minutes", 60)), 1), 24 * 60)
+    except ValueError:
+        return Response({"error": "minutes must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    stats = get_connection_counter().snapshot(minutes=minutes)
+    return Response(stats, status=status.HTTP_200_OK)
+
+@api_view(["GET"])
+@authentication_classes([AdminFirebaseAuthentication])
+@permission_classes([IsAuthenticated])
+def get_online_users(request):
+    """
+    Returns the users that currently have a live notification socket, across
+    all websocket workers.
     """
-    connected_users = cache.get("connected_users", 0)
-    print("Connected users:", connected_users)
-    return Response({"connected_users": connected_users}, status=status.HTTP_200_OK)
+    uids = sorted(online_users())
+    return Response({"online_users": len(uids), "uids": uids}, status=status.HTTP_200_OK)
 
 @api_view(["POST"])
 @authentication_classes([FirebaseAuthentication])
@@ -157,7 +176,11 @@ def delete_user(request):
     except User.DoesNotExist:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
     
-    user.delete()
+    # Everything the user uploaded lives under users/<uid>/. Objects written
+    # there after this (an account re-created with the same uid) are kept.
+    with transaction.atomic():
+        enqueue_deletions(prefixes=[f"users/{uid}/"])
+        user.delete()
     return Response({"message": "User deleted"}, status=status.HTTP_200_OK)
 
 
@@ -169,18 +192,18 @@ def get_user_info(request, uid=None):
     Fetch a user's profile by UID.
     - If no UID is provided, return the authenticated user's profile.
     - If a UID is provided, return that user's profile.
-    This also returns the total views across all of that user's listings.
+    This also returns the total views across all of that user's listings,
+    and the views of the last 7 days.
     """
     if uid is None and request.user.is_authenticated:
-        user = request.user
-    else:
-        try:
-            user = User.objects.get(uid=uid)
-        except User.DoesNotExist:
-            return Response(
-                {"error": "User not found"},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        uid = request.user.username
+    try:
+        user = User.objects.get(uid=uid)
+    except User.DoesNotExist:
+        return Response(
+            {"error": "User not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
 
     # serialize the user
     serializer = UserSerializer(user)
@@ -193,23 +216,30 @@ def get_user_info(request, uid=None):
     # merge serializer data with the new field
     response_data = serializer.data
     response_data["views"] = total
+    # read from the seller's daily analytics buckets
+    response_data["viewsThisWeek"] = seller_views(user.uid, days=7)
 
     return Response(response_data, status=status.HTTP_200_OK)
 
+def queue_replaced_picture(user, old_picture, old_variants):
+    """
+    Queue the previous profile picture's variants for deletion once a new
+    picture is saved (the new one gets variants under new keys), and the
+    old file itself when the new one has another key (another extension)
+    instead of overwriting it. Call inside the transaction that saves the
+    new picture.
+    """
+    keys = variant_keys(old_variants)
+    if old_picture and user.profilePicture.name != old_picture:
+        keys.append(old_picture)
+    enqueue_deletions(keys)
+
 @api_view(["PUT", "PATCH"])
 @authentication_classes([FirebaseAuthentication])
 @permission_classes([IsAuthenticated])
 def update_user_info(request):
-    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
-    token = ""
-    if auth_header.startswith("Bearer "):
-        token = auth_header.split("Bearer ")[1]
-    
-    try:
-        decoded_token = firebase_admin_auth.verify_id_token(token)
-        token_uid = decoded_token.get("uid")
-    except Exception:
-        return Response({"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED)
+    # The authentication class has already verified the token
+    token_uid = request.user.username
 
     try:
         user = User.objects.get(uid=token_uid)
@@ -218,18 +248,23 @@ def update_user_info(request):
 
     remove = request.data.get("removeProfilePicture") == "true"
     new_profile_picture = request.FILES.get("profilePicture")
-
-    if user.profilePicture and (remove or new_profile_picture):
-        user.profilePicture.delete(save=False)
+    old_picture = user.profilePicture.name if user.profilePicture else None
+    old_variants = user.profilePictureVariants
 
     if remove:
         user.profilePicture = None
+        user.profilePictureVariants = {}
 
     serializer = EditUserSerializer(user, data=request.data, partial=True)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    serializer.save()
+    with transaction.atomic():
+        serializer.save()
+        if old_picture and remove:
+            enqueue_deletions([old_picture, *variant_keys(old_variants)])
+        elif new_profile_picture:
+            queue_replaced_picture(user, old_picture, old_variants)
     full_serializer = UserSerializer(user)
     return Response(full_serializer.data, status=status.HTTP_200_OK)
 
@@ -245,16 +280,8 @@ def check_email_auth(request):
 def upload_profile_picture(request):
     print("DJANGO_SETTINGS_MODULE:", os.environ.get("DJANGO_SETTINGS_MODULE"))
     print("DEFAULT_FILE_STORAGE from settings:", settings.DEFAULT_FILE_STORAGE)
-    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
-    token = ""
-    if auth_header.startswith("Bearer "):
-        token = auth_header.split("Bearer ")[1]
-
-    try:
-        decoded_token = firebase_admin_auth.verify_id_token(token)
-        token_uid = decoded_token.get("uid")
-    except Exception as e:
-        return Response({"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED)
+    # The authentication class has already verified the token
+    token_uid = request.user.username
 
     try:
         user = User.objects.get(uid=token_uid)
@@ -262,12 +289,17 @@ def upload_profile_picture(request):
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
+    old_picture = user.profilePicture.name if user.profilePicture else None
+    old_variants = user.profilePictureVariants
+
     serializer = UploadProfilePictureSerializer(user, data=request.data, partial=True)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
+            queue_replaced_picture(user, old_picture, old_variants)
 
     except Exception as e:
         return Response({"error": "File save failed", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -285,11 +317,10 @@ def block_user(request, uid):
         blocked_user = User.objects.get(uid=uid)
     except User.DoesNotExist:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-    user = User.objects.get(uid=request.user.username)
+    user = request.user.account
     if blocked_user in user.blockedUsers.all():
         return Response({"error": "User already blocked"}, status=status.HTTP_400_BAD_REQUEST)
     user.blockedUsers.add(blocked_user)
-    user.save()
     rooms = Room.objects.filter(
         (Q(seller=user, buyer=blocked_user) | Q(seller=blocked_user, buyer=user))
     )
@@ -303,7 +334,7 @@ def block_user(request, uid):
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([IsAuthenticated])
 def get_blocked_users(request):
-    user = User.objects.get(uid=request.user.username)
+    user = request.user.account
     blocked_users = user.blockedUsers.all()
 
     display_names = [
@@ -324,19 +355,22 @@ def unblock_user(request, uid):
         blocked_user = User.objects.get(uid=uid)
     except User.DoesNotExist:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-    user = User.objects.get(uid=request.user.username)
+    user = request.user.account
     if blocked_user not in user.blockedUsers.all():
         return Response({"error": "User is not blocked"}, status=status.HTTP_400_BAD_REQUEST)
     user.blockedUsers.remove(blocked_user)
-    user.save()
     return Response({"message": "User unblocked"}, status=status.HTTP_200_OK)
 
 @api_view(["GET"])
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([IsAuthenticated])
 def get_history(request, uid):
-    user = User.objects.get(uid=request.user.username)
+    user = request.user.account
     
+    if wants_cards(request):
+        listings = Listing.objects.filter(history__user=user).order_by("-history__viewed_at")[:6]
+        return Response(listing_cards(listings), status=200)
+
     viewed_listings = user.get_history()
 
     listings = [entry.listing for entry in viewed_listings]
@@ -385,7 +419,7 @@ def addToHistory(request):
 @authentication_classes([FirebaseEmailVerifiedAuthentication])
 @permission_classes([IsAuthenticated])
 def getRecommendedListings(request, uid):
-    user = User.objects.get(uid=request.user.username)
+    user = request.user.account
     
     viewed_listings = user.get_history()
     if not viewed_listings:
@@ -410,6 +444,9 @@ def getRecommendedListings(request, uid):
         user=user
     ).order_by('-dateListed')[:6]
 
+    if wants_cards(request):
+        return Response(listing_cards(recommended_listings), status=status.HTTP_200_OK)
+
     serializer = ListingSerializer(recommended_listings, many=True)
 
     return Response(serializer.data, status=status.HTTP_200_OK)
@@ -423,7 +460,7 @@ def addAppeal(request):
     if not uid:
         return Response({"error": "UID is required"}, status=status.HTTP_400_BAD_REQUEST)
     
-    user = User.objects.get(uid=request.user.username)
+    user = request.user.account
     appeal = request.data.get("appeal")
     if not appeal:
         return Response({"error": "Appeal is required"}, status=status.HTTP_400_BAD_REQUEST)
@@ -435,7 +472,7 @@ def addAppeal(request):
         return Response({"error": "User already has an appeal"}, status=status.HTTP_400_BAD_REQUEST)
     
     user.appeal = appeal
-    user.save()
+    user.save(update_fields=["appeal"])
     return Response({"message": "Appeal added"}, status=status.HTTP_200_OK)
 
 